@@ -21,17 +21,99 @@ class Settings(BaseSettings):
     LLM_MODEL: str = "gpt-4o"
     LLM_TEMPERATURE: float = 0.7
     EMBEDDING_MODEL: str = "sentence-transformers/all-MiniLM-L6-v2"
+    EMBEDDING_BACKEND: str = "torch"  # torch | onnx
+    EMBEDDING_ONNX_PATH: str = "./data/onnx"  # exported models, created on first use
+    EMBEDDING_ONNX_QUANTIZE: bool = True  # int8 dynamic quantization
+    EMBEDDING_ONNX_THREADS: int = 0  # onnxruntime intra-op threads; 0 = all cores
+    
+    # LLM Gateway (purposes: chat, intent, topics, precompute, context)
+    LLM_MAX_CONCURRENCY: int = 16  # LLM calls in flight across all purposes
+    LLM_PURPOSE_CONCURRENCY: dict[str, int] = {"chat": 12, "intent": 4, "topics": 4, "precompute": 4, "context": 2}
+    LLM_TIMEOUT_SECONDS: float = 60.0  # deadline per call, including queueing and retries
+    LLM_PURPOSE_TIMEOUTS: dict[str, float] = {"intent": 20.0, "topics": 20.0, "context": 20.0}
+    LLM_MAX_RETRIES: int = 2  # on timeouts, connection errors, 429 and 5xx
+    LLM_RETRY_BACKOFF_SECONDS: float = 0.5  # base of the jittered exponential backoff
+    LLM_MAX_CONNECTIONS: int = 32  # pooled HTTP connections to the provider
+    
+    # Embedding Cache (persistent tier: none | redis | mmap)
+    EMBEDDING_CACHE_SIZE: int = 20000  # in-process LRU entries; 0 disables
+    EMBEDDING_CACHE_BACKEND: str = "none"
+    EMBEDDING_CACHE_TTL: int = 604800  # redis tier, seconds
+    EMBEDDING_CACHE_PATH: str = "./data/embedding_cache"  # mmap tier
+    EMBEDDING_CACHE_MMAP_SLOTS: int = 262144  # mmap tier capacity in vectors
+    
+    # Query Embedding Micro-batching
+    EMBEDDING_BATCH_MAX_SIZE: int = 32
+    EMBEDDING_BATCH_MAX_WAIT_MS: float = 5.0  # window for collecting concurrent queries; 0 disables batching
+    
+    # Bulk Embedding Process Pool
+    EMBEDDING_POOL_WORKERS: int = 0  # > 1 embeds large ingestion batches in that many processes
+    EMBEDDING_POOL_CHUNK_SIZE: int = 256  # texts per worker task
+    EMBEDDING_POOL_MIN_TEXTS: int = 512  # smaller batches are embedded in-process
     
     # RAG Settings
     RAG_TOP_K: int = 5
     RAG_SIMILARITY_THRESHOLD: float = 0.7
     VECTOR_STORE_PATH: str = "./data/vector_store"
     DOCUMENTS_PATH: str = "./data/documents"
+    RAG_CHUNK_MAX_TOKENS: int = 0  # 0 = the embedding model's input window
+    RAG_CHUNK_OVERLAP_TOKENS: int = 32
+    
+    # Ingestion
+    RAG_UPLOAD_CHUNK_BYTES: int = 1048576  # uploads are written to disk in pieces of this size
+    RAG_EXTRACT_WORKERS: int = 2  # PDF parsing processes
+    RAG_EXTRACT_PAGES_PER_TASK: int = 8
+    RAG_EXTRACT_PART_CHARS: int = 65536  # text files are read in paragraph blocks of about this size
+    RAG_INGEST_BATCH_CHUNKS: int = 512  # chunks embedded and indexed per step
+    RAG_INGEST_CONCURRENCY: int = 1  # ingestion jobs running at once
+    RAG_INGEST_JOB_HISTORY: int = 200  # finished jobs kept for the status endpoint
+    
+    # Vector Index (flat | fp16 | sq8 | ivf_flat | ivf_sq8 | ivf_pq | hnsw)
+    RAG_INDEX_TYPE: str = "flat"
+    RAG_INDEX_TRAIN_MIN_VECTORS: int = 0  # 0 = 39 vectors per IVF list
+    RAG_IVF_NLIST: int = 256
+    RAG_IVF_NPROBE: int = 8
+    RAG_PQ_M: int = 48  # sub-quantizers, must divide the embedding dimension
+    RAG_PQ_NBITS: int = 8
+    RAG_HNSW_M: int = 32
+    RAG_HNSW_EF_CONSTRUCTION: int = 200
+    RAG_HNSW_EF_SEARCH: int = 64
+    RAG_RERANK_FACTOR: int = 4  # compressed indexes re-rank k * factor candidates exactly; <= 1 disables
+    RAG_SEGMENT_COMPACT_THRESHOLD: int = 8  # merge once this many similar-sized segments are adjacent
+    RAG_TOMBSTONE_COMPACT_RATIO: float = 0.2  # purge once this share of chunks is deleted
+    RAG_METADATA_INDEX_KEYS: list[str] = ["name", "type"]
+    RAG_FILTER_EXACT_MAX_ROWS: int = 2048  # smaller filtered sets are scanned exactly
+    RAG_INDEX_TAIL_MAX_ROWS: int = 2048  # new rows searched exactly before being folded into the index
+    RAG_EXECUTOR_WORKERS: int = 4  # threads running retrieval/embedding work off the event loop
+    RAG_SHARDS: int = 0  # > 1 partitions the vector store across that many local shard processes
+    RAG_SHARD_THREADS: int = 4  # concurrent requests served by each shard process
+    
+    # Retrieval mode (vector | lexical | hybrid)
+    RAG_SEARCH_MODE: str = "vector"  # lexical/hybrid build a BM25 index in memory on startup
+    RAG_HYBRID_CANDIDATES: int = 50  # hits taken from each ranking before fusion
+    RAG_RRF_K: int = 60  # reciprocal rank fusion damping constant
+    RAG_BM25_K1: float = 1.2
+    RAG_BM25_B: float = 0.75
+    RAG_KEYWORD_MAX_TERMS: int = 3  # identifier-only queries up to this length skip embedding
+    
+    # Chat Sessions
+    CHAT_RECENT_MESSAGES: int = 20  # window of latest messages kept on the session document
+    CHAT_CONTEXT_MESSAGES: int = 5  # latest messages sent to the LLM with each question
+    CHAT_HISTORY_PAGE_SIZE: int = 50  # messages per page of full history
+    CHAT_WRITE_BEHIND: str = "async"  # off | ack | async, see app/services/write_behind.py
+    CHAT_WRITE_BEHIND_MAX_BATCH: int = 256  # queued writes that trigger an immediate flush
+    CHAT_WRITE_BEHIND_MAX_DELAY_MS: float = 50.0
+    CHAT_WRITE_CONCERN: str = "1"  # w for batched writes: a number or "majority"
+    CHAT_WRITE_JOURNAL: bool = False  # j for batched writes
     
     # Prediction Settings
     PREDICTION_CONFIDENCE_THRESHOLD: float = 0.8
     MAX_MESSAGES_FOR_PREDICTION: int = 5
     PRECOMPUTE_ENABLED: bool = True
+    PRECOMPUTE_MAX_CANDIDATES: int = 3  # confident predictions answered ahead of time per prediction run
+    PRECOMPUTE_MATCH_THRESHOLD: float = 0.8  # cosine similarity; calibrate with scripts/calibrate_precompute_threshold.py
+    PRECOMPUTE_MATCH_CANDIDATES: int = 20  # latest precomputed answers of a session compared with a question
+    PRECOMPUTE_ANSWER_TTL_SECONDS: int = 7200
     
     # Background Workers
     CELERY_BROKER_URL: str = "redis://localhost:6379/1"
@@ -4,8 +4,12 @@ from contextlib import asynccontextmanager
 import logging
 
 from app.config import settings
-from app.db.mongo import connect_to_mongo, close_mongo_connection
+from app.db.mongo import connect_to_mongo, close_mongo_connection, get_database
 from app.db.redis import connect_to_redis, close_redis_connection
+from app.services.session_store import SessionStore
+from app.services.write_behind import chat_write_behind
+from app.services.precomputed_answers import precomputed_answers
+from app.services.llm_gateway import llm_gateway
 from app.routes import chat, predict, rag, ws
 
 # Configure logging
@@ -21,6 +25,19 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting up NextMind API...")
     await connect_to_mongo()
+    try:
+        # Before the indexes: the unique session_id index needs duplicate sessions merged
+        await SessionStore.migrate_legacy_sessions()
+    except Exception as e:
+        logger.error(f"Chat session migration did not finish; sessions are migrated on their next message: {e}")
+    try:
+        await SessionStore.ensure_indexes()
+    except Exception as e:
+        logger.warning(f"Could not create chat session indexes: {e}")
+    try:
+        await precomputed_answers.ensure_indexes(await get_database())
+    except Exception as e:
+        logger.warning(f"Could not create precomputed answer indexes: {e}")
     try:
         await connect_to_redis()
     except Exception as e:
@@ -29,6 +46,8 @@ async def lifespan(app: FastAPI):
     yield
     # Shutdown
     logger.info("Shutting down NextMind API...")
+    await chat_write_behind.close()
+    await llm_gateway.close()
     await close_mongo_connection()
     try:
         await close_redis_connection()
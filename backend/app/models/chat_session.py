@@ -13,7 +13,9 @@ class Message(BaseModel):
 class ChatSession(BaseModel):
     session_id: str
     user_id: Optional[str] = None
-    messages: List[Message] = []
+    title: str = ""
+    message_count: int = 0
+    messages: List[Message] = []  # latest messages only; full history is in chat_messages
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     
@@ -19,6 +19,7 @@ class Prediction(BaseModel):
     required_rag_docs: List[str] = []
     precomputed_answer: Optional[str] = None
     precomputed_answer_id: Optional[str] = None
+    precomputed_answer_ids: List[str] = []
     created_at: datetime = Field(default_factory=datetime.utcnow)
     
     class Config:
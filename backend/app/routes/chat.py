@@ -1,13 +1,19 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Optional
-from openai import AsyncOpenAI
+from typing import List, Dict, Optional, Tuple, AsyncIterator
 from app.config import settings
-from app.services.rag_engine import rag_engine
-from app.services.cache import CacheManager
+from app.services.retrieval import retrieval_service
+from app.services.llm_gateway import llm_gateway
+from app.services.precomputed_answers import precomputed_answers
+from app.services.session_store import SessionStore
+from app.services.write_behind import chat_write_behind
 from app.db.mongo import get_database
 from app.models.chat_session import Message, ChatSession
+from bson import ObjectId
 from datetime import datetime
+import asyncio
+import json
 import logging
 
 logger = logging.getLogger(__name__)
@@ -24,6 +30,100 @@ class ChatResponse(BaseModel):
     used_precomputed: bool = False
     precomputed_answer_id: Optional[str] = None
 
+SYSTEM_PROMPT = """You are a helpful AI assistant. Answer questions based on the provided context. 
+If the context doesn't fully answer the question, use your knowledge to provide a helpful response."""
+
+async def _find_precomputed_answer(db, request: ChatRequest) -> Optional[Dict]:
+    """The session's precomputed answer whose predicted question matches the message closely enough"""
+    if not request.use_precomputed:
+        return None
+    try:
+        return await precomputed_answers.match(db, request.session_id, request.message)
+    except Exception as e:
+        logger.warning(f"Precomputed answer lookup failed, answering directly: {e}")
+        return None
+
+async def _llm_messages(request: ChatRequest, messages: List[Dict]) -> List[Dict]:
+    """System prompt, recent history and the question with its RAG context"""
+    rag_results = await retrieval_service.search(request.message, k=settings.RAG_TOP_K)
+    rag_context = "\n\n".join([r.get("text", "") for r in rag_results[:3]])
+    
+    user_prompt = f"""Context:
+{rag_context[:2000] if rag_context else "No specific context available."}
+
+User Question: {request.message}
+
+Provide a comprehensive answer."""
+    
+    # Include conversation history
+    conversation_messages = [
+        {"role": "system", "content": SYSTEM_PROMPT}
+    ]
+    
+    # Add last few messages for context
+    for msg in messages[-settings.CHAT_CONTEXT_MESSAGES:]:
+        conversation_messages.append({
+            "role": msg.get("role", "user"),
+            "content": msg.get("content", "")
+        })
+    
+    conversation_messages.append({"role": "user", "content": user_prompt})
+    return conversation_messages
+
+async def chat_events(request: ChatRequest) -> AsyncIterator[Dict]:
+    """
+    Answer a chat message as a stream of events: `start`, then `token`
+    events as the answer is generated, then `done` with the full response
+    once the assistant message is saved. A precomputed answer is replayed
+    as a single token. Errors are raised to the caller.
+    """
+    db = await get_database()
+    # One upsert appends the question and returns the context window; the prediction lookup runs alongside
+    messages, precomputed = await asyncio.gather(
+        SessionStore.append_user_message(request.session_id, request.message, settings.CHAT_CONTEXT_MESSAGES),
+        _find_precomputed_answer(db, request)
+    )
+    precomputed_answer_id = precomputed["precomputed_answer_id"] if precomputed else None
+    yield {"type": "start", "used_precomputed": bool(precomputed), "precomputed_answer_id": precomputed_answer_id}
+    
+    if precomputed:
+        answer = precomputed["answer"]
+        yield {"type": "token", "content": answer}
+    elif not llm_gateway.enabled:
+        # Fallback response
+        answer = f"I understand you're asking: {request.message}. This is a placeholder response. Please configure OpenAI API key for full functionality."
+        yield {"type": "token", "content": answer}
+    else:
+        parts = []
+        async for token in llm_gateway.stream(
+            "chat",
+            await _llm_messages(request, messages),
+            temperature=settings.LLM_TEMPERATURE,
+            max_tokens=1000
+        ):
+            parts.append(token)
+            yield {"type": "token", "content": token}
+        answer = "".join(parts)
+    
+    # Persisted once the answer is complete (write-behind, see CHAT_WRITE_BEHIND); an abandoned stream saves nothing
+    await SessionStore.append_message(request.session_id, "assistant", answer)
+    yield {
+        "type": "done",
+        "response": answer,
+        "used_precomputed": bool(precomputed),
+        "precomputed_answer_id": precomputed_answer_id
+    }
+
+def error_detail(e: Exception) -> Tuple[int, str]:
+    """HTTP status and message for a chat failure"""
+    error_msg = str(e)
+    if isinstance(e, TimeoutError):
+        return 504, f"Error: {error_msg}"
+    # Check if it's an OpenAI API key error
+    if "invalid_api_key" in error_msg or "Incorrect API key" in error_msg or "401" in error_msg:
+        return 401, "Invalid OpenAI API key. Please check your OPENAI_API_KEY in the .env file."
+    return 500, f"Error: {error_msg}"
+
 @router.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     """
@@ -31,199 +131,83 @@ async def chat(request: ChatRequest):
     use it for instant response. Otherwise, generate answer normally with RAG.
     """
     try:
-        client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY) if settings.OPENAI_API_KEY else None
-        
-        db = await get_database()
-        
-        # Get or create session
-        session = await db.chat_sessions.find_one({"session_id": request.session_id})
-        
-        # Add user message to session
-        user_message = {
-            "role": "user",
-            "content": request.message,
-            "timestamp": datetime.utcnow()
-        }
-        
-        if session:
-            await db.chat_sessions.update_one(
-                {"session_id": request.session_id},
-                {
-                    "$push": {"messages": user_message},
-                    "$set": {"updated_at": datetime.utcnow()}
-                }
-            )
-            messages = session.get("messages", [])
-            messages.append(user_message)
-        else:
-            new_session = {
-                "session_id": request.session_id,
-                "messages": [user_message],
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow()
-            }
-            await db.chat_sessions.insert_one(new_session)
-            messages = [user_message]
-        
-        # Check for precomputed answer if enabled
-        if request.use_precomputed:
-            # Get latest prediction for this session
-            prediction = await db.predictions.find_one(
-                {"session_id": request.session_id},
-                sort=[("created_at", -1)]
-            )
-            
-            if prediction:
-                predicted_question = prediction.get("predicted_question", "")
-                confidence = prediction.get("confidence", 0)
-                precomputed_answer_id = prediction.get("precomputed_answer_id")
-                
-                # Check if user's question matches predicted question (simple similarity)
-                if confidence >= settings.PREDICTION_CONFIDENCE_THRESHOLD and precomputed_answer_id:
-                    # Simple check: if question is similar enough
-                    question_similarity = _calculate_similarity(request.message.lower(), predicted_question.lower())
-                    
-                    if question_similarity > 0.6:  # 60% similarity threshold
-                        cached_answer = await CacheManager.get_precomputed_answer(precomputed_answer_id)
-                        if cached_answer:
-                            answer = cached_answer.get("answer", "")
-                            
-                            # Add assistant message to session
-                            assistant_message = {
-                                "role": "assistant",
-                                "content": answer,
-                                "timestamp": datetime.utcnow()
-                            }
-                            await db.chat_sessions.update_one(
-                                {"session_id": request.session_id},
-                                {
-                                    "$push": {"messages": assistant_message},
-                                    "$set": {"updated_at": datetime.utcnow()}
-                                }
-                            )
-                            
-                            return ChatResponse(
-                                response=answer,
-                                used_precomputed=True,
-                                precomputed_answer_id=precomputed_answer_id
-                            )
-        
-        # Generate answer using RAG + LLM
-        if not client:
-            # Fallback response
-            answer = f"I understand you're asking: {request.message}. This is a placeholder response. Please configure OpenAI API key for full functionality."
-        else:
-            # Get RAG context
-            rag_results = rag_engine.search(request.message, k=settings.RAG_TOP_K)
-            rag_context = "\n\n".join([r.get("text", "") for r in rag_results[:3]])
-            
-            # Prepare messages for LLM
-            system_prompt = """You are a helpful AI assistant. Answer questions based on the provided context. 
-If the context doesn't fully answer the question, use your knowledge to provide a helpful response."""
-            
-            user_prompt = f"""Context:
-{rag_context[:2000] if rag_context else "No specific context available."}
-
-User Question: {request.message}
-
-Provide a comprehensive answer."""
-            
-            # Include conversation history
-            conversation_messages = [
-                {"role": "system", "content": system_prompt}
-            ]
-            
-            # Add last few messages for context
-            for msg in messages[-5:]:
-                conversation_messages.append({
-                    "role": msg.get("role", "user"),
-                    "content": msg.get("content", "")
-                })
-            
-            conversation_messages.append({"role": "user", "content": user_prompt})
-            
-            response = await client.chat.completions.create(
-                model=settings.LLM_MODEL,
-                messages=conversation_messages,
-                temperature=settings.LLM_TEMPERATURE,
-                max_tokens=1000
-            )
-            
-            answer = response.choices[0].message.content
-        
-        # Add assistant message to session
-        assistant_message = {
-            "role": "assistant",
-            "content": answer,
-            "timestamp": datetime.utcnow()
-        }
-        await db.chat_sessions.update_one(
-            {"session_id": request.session_id},
-            {
-                "$push": {"messages": assistant_message},
-                "$set": {"updated_at": datetime.utcnow()}
-            }
-        )
-        
-        return ChatResponse(
-            response=answer,
-            used_precomputed=False
-        )
-        
+        async for event in chat_events(request):
+            if event["type"] == "done":
+                return ChatResponse(
+                    response=event["response"],
+                    used_precomputed=event["used_precomputed"],
+                    precomputed_answer_id=event["precomputed_answer_id"]
+                )
     except Exception as e:
         logger.error(f"Error in chat: {e}")
-        error_msg = str(e)
-        # Check if it's an OpenAI API key error
-        if "invalid_api_key" in error_msg or "Incorrect API key" in error_msg or "401" in error_msg:
-            raise HTTPException(
-                status_code=401, 
-                detail="Invalid OpenAI API key. Please check your OPENAI_API_KEY in the .env file."
-            )
-        raise HTTPException(status_code=500, detail=f"Error: {error_msg}")
+        status_code, detail = error_detail(e)
+        raise HTTPException(status_code=status_code, detail=detail)
 
-def _calculate_similarity(str1: str, str2: str) -> float:
-    """Simple similarity calculation based on common words"""
-    words1 = set(str1.split())
-    words2 = set(str2.split())
-    
-    if not words1 or not words2:
-        return 0.0
-    
-    intersection = words1.intersection(words2)
-    union = words1.union(words2)
+@router.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Same as /chat, streamed as Server-Sent Events: `start`, `token` (one per
+    generated piece of text), then `done` or `error`. Each event's data is JSON.
+    """
+    async def events():
+        try:
+            async for event in chat_events(request):
+                yield _sse(event)
+        except Exception as e:
+            logger.error(f"Error in chat stream: {e}")
+            status_code, detail = error_detail(e)
+            yield _sse({"type": "error", "status": status_code, "message": detail})
     
-    return len(intersection) / len(union) if union else 0.0
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def _sse(event: Dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+@router.get("/llm/metrics")
+async def llm_metrics():
+    """Per-purpose LLM call counts, latency, retries and token usage"""
+    return llm_gateway.metrics()
+
+@router.get("/chat/write-behind/metrics")
+async def write_behind_metrics():
+    """Batched chat writes: mode, queue depth, batches and failures"""
+    return chat_write_behind.metrics()
+
+def _serialize_datetime(obj):
+    """Convert datetime objects to ISO strings"""
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    return obj
+
+def _serialize_messages(messages: List[Dict]) -> List[Dict]:
+    return [{**msg, "timestamp": _serialize_datetime(msg.get("timestamp"))} for msg in messages]
 
 @router.get("/chat/session/{session_id}")
-async def get_session(session_id: str):
-    """Get chat session history"""
+async def get_session(session_id: str, limit: int = settings.CHAT_HISTORY_PAGE_SIZE):
+    """
+    Get a chat session with its latest `limit` messages. Older messages are
+    paged from /chat/session/{session_id}/messages starting at `next_before`.
+    """
     try:
-        db = await get_database()
-        session = await db.chat_sessions.find_one({"session_id": session_id})
+        session = await SessionStore.get_session(session_id)
         
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
         
-        # Convert datetime objects to ISO strings
-        def serialize_datetime(obj):
-            if isinstance(obj, datetime):
-                return obj.isoformat()
-            return obj
-        
-        messages = session.get("messages", [])
-        # Serialize timestamps in messages
-        serialized_messages = []
-        for msg in messages:
-            serialized_msg = {**msg}
-            if "timestamp" in serialized_msg and isinstance(serialized_msg["timestamp"], datetime):
-                serialized_msg["timestamp"] = serialized_msg["timestamp"].isoformat()
-            serialized_messages.append(serialized_msg)
+        messages, next_before = await SessionStore.history_page(session_id, limit=limit)
         
         return {
             "session_id": session.get("session_id"),
-            "messages": serialized_messages,
-            "created_at": serialize_datetime(session.get("created_at")),
-            "updated_at": serialize_datetime(session.get("updated_at"))
+            "title": session.get("title"),
+            "message_count": session.get("message_count", 0),
+            "messages": _serialize_messages(messages),
+            "next_before": next_before,
+            "created_at": _serialize_datetime(session.get("created_at")),
+            "updated_at": _serialize_datetime(session.get("updated_at"))
         }
         
     except HTTPException:
@@ -232,6 +216,19 @@ async def get_session(session_id: str):
         logger.error(f"Error getting session: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/chat/session/{session_id}/messages")
+async def get_session_messages(session_id: str, before: Optional[str] = None,
+                               limit: int = settings.CHAT_HISTORY_PAGE_SIZE):
+    """Page through a session's full history, newest page first; pass `next_before` back as `before`"""
+    if before and not ObjectId.is_valid(before):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    try:
+        messages, next_before = await SessionStore.history_page(session_id, before, min(max(limit, 1), 500))
+        return {"session_id": session_id, "messages": _serialize_messages(messages), "next_before": next_before}
+    except Exception as e:
+        logger.error(f"Error getting session messages: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/chat/sessions")
 async def list_sessions(limit: int = 50):
     """List all chat sessions"""
@@ -239,29 +236,21 @@ async def list_sessions(limit: int = 50):
         db = await get_database()
         sessions = await db.chat_sessions.find(
             {},
-            {"session_id": 1, "messages": 1, "created_at": 1, "updated_at": 1}
+            {"session_id": 1, "title": 1, "message_count": 1, "messages": 1, "created_at": 1, "updated_at": 1}
         ).sort("updated_at", -1).limit(limit).to_list(length=limit)
         
         result = []
         for session in sessions:
-            messages = session.get("messages", [])
+            messages = session.get("messages", [])  # the recent window
             last_message = messages[-1] if messages else None
             
-            # Convert datetime objects to ISO strings
-            created_at = session.get("created_at")
-            updated_at = session.get("updated_at")
-            if isinstance(created_at, datetime):
-                created_at = created_at.isoformat()
-            if isinstance(updated_at, datetime):
-                updated_at = updated_at.isoformat()
-            
             result.append({
                 "session_id": session.get("session_id"),
-                "title": messages[0].get("content", "New Conversation")[:50] if messages else "New Conversation",
+                "title": session.get("title") or "New Conversation",
                 "last_message": last_message.get("content", "") if last_message else "",
-                "message_count": len(messages),
-                "created_at": created_at,
-                "updated_at": updated_at,
+                "message_count": session.get("message_count", len(messages)),
+                "created_at": _serialize_datetime(session.get("created_at")),
+                "updated_at": _serialize_datetime(session.get("updated_at")),
                 "messages": messages  # Include messages for context analysis
             })
         
@@ -273,12 +262,9 @@ async def list_sessions(limit: int = 50):
 
 @router.delete("/chat/session/{session_id}")
 async def delete_session(session_id: str):
-    """Delete a chat session"""
+    """Delete a chat session and its history"""
     try:
-        db = await get_database()
-        result = await db.chat_sessions.delete_one({"session_id": session_id})
-        
-        if result.deleted_count == 0:
+        if not await SessionStore.delete_session(session_id):
             raise HTTPException(status_code=404, detail="Session not found")
         
         return {"message": "Session deleted successfully", "session_id": session_id}
@@ -3,13 +3,11 @@ from pydantic import BaseModel
 from typing import List, Dict, Optional
 from app.services.intent_predictor import intent_predictor
 from app.services.next_agent import next_agent
-from app.services.precompute_agent import precompute_agent
 from app.services.cache import CacheManager
+from app.services.precomputed_answers import precomputed_answers, precompute_candidates, precompute_predictions
 from app.models.prediction import Prediction
 from app.db.mongo import get_database
-from app.config import settings
 from datetime import datetime
-import uuid
 import logging
 
 logger = logging.getLogger(__name__)
@@ -25,6 +23,7 @@ class PredictResponse(BaseModel):
     confidence: float
     suggestions: List[str]
     precomputed_answer_id: Optional[str] = None
+    precomputed_answer_ids: List[str] = []
     predictions: List[Dict] = []
 
 @router.post("/predict-intent", response_model=PredictResponse)
@@ -55,30 +54,25 @@ async def predict_intent(request: PredictRequest):
         # Step 3: RAG Document Planning
         rag_docs = await next_agent.plan_rag_documents(predicted_question, topics)
         
-        # Step 4: Precompute Answer (if confidence is high enough)
+        # Step 4: Precompute answers for every confident prediction, indexed for /chat to match
         precomputed_answer_id = None
-        if confidence >= settings.PREDICTION_CONFIDENCE_THRESHOLD:
-            precomputed = await precompute_agent.precompute_answer(
-                predicted_question,
-                topics,
-                rag_docs
-            )
-            
-            if precomputed.get("ready_answer"):
-                precomputed_answer_id = f"pre_{uuid.uuid4().hex[:8]}"
-                
-                # Store precomputed answer in cache
-                await CacheManager.set_precomputed_answer(
-                    precomputed_answer_id,
-                    {
-                        "answer": precomputed["ready_answer"],
-                        "question": predicted_question,
-                        "context_used": precomputed["context_used"]
-                    }
+        precomputed_answer_ids = []
+        candidates = precompute_candidates(prediction_result)
+        if candidates:
+            db = await get_database()
+            stored = [
+                result for result in await precompute_predictions(
+                    db, request.session_id, candidates, {predicted_question: (topics, rag_docs)}
                 )
+                if result
+            ]
+            precomputed_answer_ids = [result["answer_id"] for result in stored]
+            top = next((result for result in stored if result["question"] == predicted_question), None)
+            
+            if top:
+                precomputed_answer_id = top["answer_id"]
                 
                 # Store in MongoDB
-                db = await get_database()
                 prediction_doc = {
                     "session_id": request.session_id,
                     "predicted_question": predicted_question,
@@ -86,8 +80,9 @@ async def predict_intent(request: PredictRequest):
                     "predictions": predictions,
                     "likely_topics": topics,
                     "required_rag_docs": rag_docs,
-                    "precomputed_answer": precomputed["ready_answer"],
+                    "precomputed_answer": top["answer"],
                     "precomputed_answer_id": precomputed_answer_id,
+                    "precomputed_answer_ids": precomputed_answer_ids,
                     "created_at": datetime.utcnow()
                 }
                 await db.predictions.insert_one(prediction_doc)
@@ -98,6 +93,7 @@ async def predict_intent(request: PredictRequest):
             "confidence": confidence,
             "suggestions": topics,
             "precomputed_answer_id": precomputed_answer_id,
+            "precomputed_answer_ids": precomputed_answer_ids,
             "predictions": predictions
         }
         
@@ -130,6 +126,14 @@ async def get_precomputed_answer(answer_id: str):
                 "context_used": prediction.get("required_rag_docs", [])
             }
         
+        stored = await precomputed_answers.get(db, answer_id)
+        if stored:
+            return {
+                "answer": stored["answer"],
+                "question": stored["question"],
+                "context_used": stored.get("context_used", [])
+            }
+        
         raise HTTPException(status_code=404, detail="Precomputed answer not found")
         
     except HTTPException:
@@ -138,3 +142,7 @@ async def get_precomputed_answer(answer_id: str):
         logger.error(f"Error getting precomputed answer: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/precomputed-answers/metrics")
+async def precomputed_answer_metrics():
+    """How often chat questions matched a precomputed answer, and how closely"""
+    return precomputed_answers.metrics()
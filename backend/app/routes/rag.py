@@ -1,11 +1,16 @@
 from fastapi import APIRouter, HTTPException, UploadFile, File
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Dict, Any
 from app.services.rag_engine import rag_engine
+from app.services.retrieval import retrieval_service
+from app.services.embeddings import embedding_service
 from app.services.cache import CacheManager
-import PyPDF2
+from app.services.extraction import is_supported
+from app.services.ingestion import ingestion_jobs
 import aiofiles
 import os
+import json
+import uuid
 from app.config import settings
 import logging
 
@@ -16,24 +21,56 @@ router = APIRouter()
 class RAGQueryRequest(BaseModel):
     query: str
     top_k: Optional[int] = None
+    nprobe: Optional[int] = None  # IVF lists to probe
+    ef_search: Optional[int] = None  # HNSW search breadth
+    filters: Optional[Dict[str, Any]] = None  # metadata key -> value or list of values
+    mode: Optional[str] = None  # vector | lexical | hybrid
 
 class RAGQueryResponse(BaseModel):
     results: List[dict]
     query: str
 
+class RAGBatchQueryRequest(BaseModel):
+    queries: List[str]
+    top_k: Optional[int] = None
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    filters: Optional[Dict[str, Any]] = None
+    mode: Optional[str] = None
+
+class RAGBatchQueryResponse(BaseModel):
+    results: List[RAGQueryResponse]
+
+def _query_hash(query: str, k: int, request) -> str:
+    """Cache key covering everything that changes the result of a query"""
+    filters = json.dumps(request.filters, sort_keys=True) if request.filters else ""
+    # The store version changes on every add/delete, so stale results are never served.
+    # It is a local counter even when sharded, so reading it here does not block the loop
+    return CacheManager.hash_query(
+        f"{query}|{k}|{request.nprobe}|{request.ef_search}|{filters}|{request.mode}|{rag_engine.version}"
+    )
+
 @router.post("/rag/query", response_model=RAGQueryResponse)
 async def query_rag(request: RAGQueryRequest):
     """Query the RAG vector store for relevant documents"""
     try:
+        k = request.top_k or settings.RAG_TOP_K
+        
         # Check cache
-        query_hash = CacheManager.hash_query(request.query)
+        query_hash = _query_hash(request.query, k, request)
         cached = await CacheManager.get_rag_context(query_hash)
         if cached:
             return RAGQueryResponse(**cached)
         
         # Search RAG engine
-        k = request.top_k or settings.RAG_TOP_K
-        results = rag_engine.search(request.query, k=k)
+        results = await retrieval_service.search(
+            request.query,
+            k=k,
+            nprobe=request.nprobe,
+            ef_search=request.ef_search,
+            filters=request.filters,
+            mode=request.mode
+        )
         
         response_data = {
             "results": results,
@@ -45,58 +82,93 @@ async def query_rag(request: RAGQueryRequest):
         
         return RAGQueryResponse(**response_data)
         
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error querying RAG: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/rag/upload")
-async def upload_document(file: UploadFile = File(...)):
-    """Upload and index a document in the RAG system"""
+@router.post("/rag/query/batch", response_model=RAGBatchQueryResponse)
+async def query_rag_batch(request: RAGBatchQueryRequest):
+    """Query the RAG vector store for several queries in one embedding and index pass"""
     try:
-        os.makedirs(settings.DOCUMENTS_PATH, exist_ok=True)
-        
-        # Save file
-        file_path = os.path.join(settings.DOCUMENTS_PATH, file.filename)
-        async with aiofiles.open(file_path, 'wb') as f:
-            content = await file.read()
-            await f.write(content)
-        
-        # Extract text based on file type
-        text_content = ""
-        metadata = {"name": file.filename, "type": file.content_type}
-        
-        if file.filename.endswith('.pdf'):
-            # Extract text from PDF
-            with open(file_path, 'rb') as pdf_file:
-                pdf_reader = PyPDF2.PdfReader(pdf_file)
-                text_parts = []
-                for page in pdf_reader.pages:
-                    text_parts.append(page.extract_text())
-                text_content = "\n\n".join(text_parts)
-        elif file.filename.endswith(('.txt', '.md')):
-            async with aiofiles.open(file_path, 'r') as f:
-                text_content = await f.read()
-        else:
-            raise HTTPException(status_code=400, detail="Unsupported file type")
+        k = request.top_k or settings.RAG_TOP_K
         
-        # Split into chunks (simple chunking)
-        chunk_size = 1000
-        chunks = []
-        words = text_content.split()
+        # Serve what we can from cache, search the rest together
+        responses: List[Optional[dict]] = []
+        query_hashes = []
+        missing = []
+        for i, query in enumerate(request.queries):
+            query_hash = _query_hash(query, k, request)
+            query_hashes.append(query_hash)
+            cached = await CacheManager.get_rag_context(query_hash)
+            responses.append(cached)
+            if not cached:
+                missing.append(i)
         
-        for i in range(0, len(words), chunk_size):
-            chunk = " ".join(words[i:i + chunk_size])
-            chunks.append(chunk)
+        if missing:
+            batch_results = await retrieval_service.search_many(
+                [request.queries[i] for i in missing],
+                k=k,
+                nprobe=request.nprobe,
+                ef_search=request.ef_search,
+                filters=request.filters,
+                mode=request.mode
+            )
+            for i, results in zip(missing, batch_results):
+                response_data = {
+                    "results": results,
+                    "query": request.queries[i]
+                }
+                await CacheManager.set_rag_context(query_hashes[i], response_data)
+                responses[i] = response_data
         
-        # Add to vector store
-        metadata_list = [{**metadata, "chunk_index": i} for i in range(len(chunks))]
-        rag_engine.add_documents(chunks, metadata_list)
+        return RAGBatchQueryResponse(
+            results=[RAGQueryResponse(**response) for response in responses]
+        )
         
-        return {
-            "message": "Document uploaded and indexed successfully",
-            "filename": file.filename,
-            "chunks": len(chunks)
-        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error batch querying RAG: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def _save_upload(file: UploadFile, file_path: str):
+    """Stream an upload to disk in fixed-size chunks; the file appears only once complete"""
+    partial_path = f"{file_path}.part"
+    try:
+        async with aiofiles.open(partial_path, 'wb') as f:
+            while chunk := await file.read(settings.RAG_UPLOAD_CHUNK_BYTES):
+                await f.write(chunk)
+        os.replace(partial_path, file_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+async def _queue_upload(file: UploadFile, name: str) -> dict:
+    """Stage an uploaded file and queue a job that indexes it in place of any document of the same name"""
+    if not is_supported(name):
+        raise HTTPException(status_code=400, detail="Unsupported file type")
+    
+    staging_path = os.path.join(settings.DOCUMENTS_PATH, ".uploads")
+    os.makedirs(staging_path, exist_ok=True)
+    staged_file = os.path.join(staging_path, f"{uuid.uuid4().hex}-{name}")
+    await _save_upload(file, staged_file)
+    
+    job = ingestion_jobs.submit(staged_file, name, {"name": name, "type": file.content_type})
+    return {
+        "filename": name,
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"{settings.API_V1_PREFIX}/rag/jobs/{job.id}"
+    }
+
+@router.post("/rag/upload", status_code=202)
+async def upload_document(file: UploadFile = File(...)):
+    """Upload a document and queue it for indexing in the RAG system"""
+    try:
+        result = await _queue_upload(file, os.path.basename(file.filename))
+        return {"message": "Document uploaded and queued for indexing", **result}
         
     except HTTPException:
         raise
@@ -104,25 +176,79 @@ async def upload_document(file: UploadFile = File(...)):
         logger.error(f"Error uploading document: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.put("/rag/documents/{name}", status_code=202)
+async def replace_document(name: str, file: UploadFile = File(...)):
+    """Queue replacing every chunk of a document with the uploaded file's contents"""
+    try:
+        result = await _queue_upload(file, os.path.basename(name))
+        return {"message": "Document uploaded and queued for replacement", **result}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error replacing document: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/rag/jobs")
+async def list_ingestion_jobs():
+    """Recent and running ingestion jobs, newest first"""
+    return {"jobs": ingestion_jobs.list()}
+
+@router.get("/rag/jobs/{job_id}")
+async def get_ingestion_job(job_id: str):
+    """Progress of an ingestion job: pages parsed, chunks embedded and whether the index swap committed"""
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.delete("/rag/documents/{name}")
+async def delete_document(name: str):
+    """Remove a document from search immediately; storage is reclaimed by compaction"""
+    try:
+        # Waits for a running ingestion of the same name, which would otherwise re-publish it
+        removed = await ingestion_jobs.delete(name)
+    except Exception as e:
+        logger.error(f"Error deleting document: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if not removed:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    return {
+        "message": "Document deleted successfully",
+        "filename": name,
+        "chunks": removed
+    }
+
 @router.get("/rag/documents")
 async def list_documents():
     """List all indexed documents"""
     try:
-        # Get unique document names from metadata
-        doc_names = set()
-        for doc in rag_engine.documents:
-            name = doc.get("metadata", {}).get("name", "")
-            if name:
-                doc_names.add(name)
-        
-        return {
-            "documents": list(doc_names),
-            "total_documents": len(rag_engine.documents)
-        }
+        return await retrieval_service.list_documents()
         
     except Exception as e:
         logger.error(f"Error listing documents: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/rag/index")
+async def get_index_info():
+    """Describe the live vector index, the embedding cache and query batching"""
+    return {
+        **(await retrieval_service.index_info()),
+        "embedding_cache": embedding_service.cache_info(),
+        "embedding_batcher": embedding_service.batcher_metrics()
+    }
 
-
+@router.post("/rag/index/rebuild")
+async def rebuild_index(index_type: Optional[str] = None):
+    """Rebuild the vector index in the background and swap it in when ready"""
+    try:
+        started = await retrieval_service.rebuild_index(index_type)
+        return {
+            "message": "Index rebuild started" if started else "Index rebuild already in progress",
+            "started": started,
+            **(await retrieval_service.index_info())
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
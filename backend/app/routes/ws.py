@@ -1,12 +1,12 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from typing import Dict, Set
+from typing import Dict
 import json
 import logging
 from app.services.intent_predictor import intent_predictor
 from app.services.next_agent import next_agent
-from app.services.precompute_agent import precompute_agent
-from app.services.cache import CacheManager
-from app.config import settings
+from app.services.precomputed_answers import precompute_candidates, precompute_predictions
+from app.db.mongo import get_database
+from app.routes.chat import ChatRequest, chat_events, error_detail
 
 logger = logging.getLogger(__name__)
 
@@ -83,36 +83,20 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
                     
                     await manager.send_personal_message(suggestion, session_id)
                     
-                    # If confidence is high, trigger precomputation in background
-                    if confidence >= settings.PREDICTION_CONFIDENCE_THRESHOLD:
-                        # This could be done asynchronously
-                        rag_docs = await next_agent.plan_rag_documents(predicted_question, topics)
-                        precomputed = await precompute_agent.precompute_answer(
-                            predicted_question,
-                            topics,
-                            rag_docs
-                        )
-                        
-                        if precomputed.get("ready_answer"):
-                            # Store precomputed answer
-                            import uuid
-                            precomputed_answer_id = f"pre_{uuid.uuid4().hex[:8]}"
-                            
-                            await CacheManager.set_precomputed_answer(
-                                precomputed_answer_id,
-                                {
-                                    "answer": precomputed["ready_answer"],
-                                    "question": predicted_question,
-                                    "context_used": precomputed["context_used"]
-                                }
-                            )
-                            
-                            # Notify client that answer is ready
-                            await manager.send_personal_message({
-                                "type": "precomputed_ready",
-                                "precomputed_answer_id": precomputed_answer_id,
-                                "predicted_question": predicted_question
-                            }, session_id)
+                    # Precompute answers for the confident predictions, indexed for /chat to match
+                    candidates = precompute_candidates(prediction_result)
+                    if candidates:
+                        db = await get_database()
+                        for precomputed in await precompute_predictions(
+                            db, session_id, candidates, {predicted_question: (topics, None)}
+                        ):
+                            if precomputed:
+                                # Notify client that answer is ready
+                                await manager.send_personal_message({
+                                    "type": "precomputed_ready",
+                                    "precomputed_answer_id": precomputed["answer_id"],
+                                    "predicted_question": precomputed["question"]
+                                }, session_id)
             
             except Exception as e:
                 logger.error(f"Error processing WebSocket message: {e}")
@@ -127,5 +111,30 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
         logger.error(f"WebSocket error: {e}")
         manager.disconnect(session_id)
 
-
-
+@router.websocket("/chat/live/{session_id}")
+async def chat_websocket(websocket: WebSocket, session_id: str):
+    """
+    WebSocket variant of /chat/stream. The client sends
+    {"message": ..., "use_precomputed": true} and receives the same
+    start / token / done (or error) events as JSON, one answer at a time.
+    """
+    await websocket.accept()
+    try:
+        while True:
+            data = await websocket.receive_json()
+            request = ChatRequest(
+                session_id=session_id,
+                message=data.get("message", ""),
+                use_precomputed=data.get("use_precomputed", True)
+            )
+            try:
+                async for event in chat_events(request):
+                    await websocket.send_json(event)
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                logger.error(f"Error in chat WebSocket for {session_id}: {e}")
+                status_code, detail = error_detail(e)
+                await websocket.send_json({"type": "error", "status": status_code, "message": detail})
+    except WebSocketDisconnect:
+        logger.info(f"Chat WebSocket disconnected for session {session_id}")
@@ -0,0 +1,110 @@
+"""
+Token-aware chunking shared by /rag/upload and the bulk indexer.
+
+Chunks are sized with the embedding model's own tokenizer so they fit its
+input window (text past the window is silently truncated by the model and
+could never be retrieved). Chunks break at sentence ends, start fresh at
+markdown headings, and repeat the last few sentences of the previous chunk
+as overlap. Input is consumed part by part (e.g. PDF pages) and chunks are
+yielded as they fill, so a document is never held in memory whole.
+"""
+import re
+from typing import Callable, Iterable, Iterator, List, Tuple
+from app.config import settings
+
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_HEADING_RE = re.compile(r"^\s{0,3}#{1,6}\s")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def split_units(part: str) -> Iterator[Tuple[str, bool]]:
+    """(sentence, starts_section) pairs; headings start a section and stand alone"""
+    for paragraph in _PARAGRAPH_RE.split(part):
+        lines = paragraph.strip().splitlines()
+        body = []
+        for line in lines:
+            if _HEADING_RE.match(line):
+                yield from ((sentence, False) for sentence in _sentences(" ".join(body)))
+                body = []
+                yield line.strip(), True
+            else:
+                body.append(line.strip())
+        yield from ((sentence, False) for sentence in _sentences(" ".join(body)))
+
+
+def _sentences(text: str) -> List[str]:
+    return [sentence for sentence in _SENTENCE_RE.split(text) if sentence.strip()]
+
+
+class Chunker:
+    def __init__(self, count_tokens: Callable[[List[str]], List[int]], max_tokens: int, overlap_tokens: int):
+        self.count_tokens = count_tokens
+        self.max_tokens = max(max_tokens, 1)
+        self.overlap_tokens = min(max(overlap_tokens, 0), self.max_tokens // 2)
+        # A heading only forces a break once the current chunk has this much text
+        self.min_section_tokens = self.max_tokens // 4
+
+    def chunks(self, parts: Iterable[str]) -> Iterator[str]:
+        """Chunk texts yielded by `parts` (a whole document or its pages) in order"""
+        current: List[Tuple[str, int]] = []
+        size = 0
+        for part in parts:
+            units = list(split_units(part))
+            if not units:
+                continue
+            counts = self.count_tokens([text for text, _ in units])
+            for (text, starts_section), count in zip(units, counts):
+                for piece, piece_count in self._fit(text, count):
+                    if current and (size + piece_count > self.max_tokens or
+                                    (starts_section and size >= self.min_section_tokens)):
+                        yield " ".join(text for text, _ in current)
+                        current = [] if starts_section else self._overlap(current, piece_count)
+                        size = sum(count for _, count in current)
+                    current.append((piece, piece_count))
+                    size += piece_count
+        if current:
+            yield " ".join(text for text, _ in current)
+
+    def _overlap(self, sentences: List[Tuple[str, int]], incoming: int) -> List[Tuple[str, int]]:
+        """Trailing sentences of the finished chunk that fit the overlap budget and leave room"""
+        budget = min(self.overlap_tokens, self.max_tokens - incoming)
+        kept = []
+        for text, count in reversed(sentences):
+            if count > budget:
+                break
+            kept.append((text, count))
+            budget -= count
+        return kept[::-1]
+
+    def _fit(self, text: str, count: int) -> Iterator[Tuple[str, int]]:
+        """Split a sentence longer than the window at word boundaries"""
+        if count <= self.max_tokens:
+            yield text, count
+            return
+        words = text.split()
+        piece, piece_count = [], 0
+        for word, word_count in zip(words, self.count_tokens(words)):
+            if piece and piece_count + word_count > self.max_tokens:
+                yield " ".join(piece), piece_count
+                piece, piece_count = [], 0
+            # A single word longer than the window is kept whole and truncated by the model
+            piece.append(word)
+            piece_count += word_count
+        if piece:
+            yield " ".join(piece), piece_count
+
+
+def create_chunker() -> Chunker:
+    """Chunker sized to the embedding model, per the RAG_CHUNK_* settings"""
+    from app.services.embeddings import embedding_service
+    max_tokens = embedding_service.max_tokens
+    if settings.RAG_CHUNK_MAX_TOKENS > 0:
+        max_tokens = min(max_tokens, settings.RAG_CHUNK_MAX_TOKENS)
+    return Chunker(embedding_service.count_tokens, max_tokens, settings.RAG_CHUNK_OVERLAP_TOKENS)
+
+
+def chunk_text(parts: str | Iterable[str]) -> Iterator[str]:
+    """Token-sized chunks of a document given as one string or as an iterable of parts"""
+    if isinstance(parts, str):
+        parts = [parts]
+    return create_chunker().chunks(parts)
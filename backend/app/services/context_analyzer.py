@@ -1,5 +1,4 @@
-from openai import AsyncOpenAI
-from app.config import settings
+from app.services.llm_gateway import llm_gateway
 from typing import List, Dict, Optional
 import logging
 import json
@@ -7,9 +6,6 @@ import json
 logger = logging.getLogger(__name__)
 
 class ContextAnalyzer:
-    def __init__(self):
-        self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY) if settings.OPENAI_API_KEY else None
-    
     async def analyze_user_context(self, recent_conversations: List[Dict]) -> Dict:
         """
         Analyze user's recent conversations to determine:
@@ -17,7 +13,7 @@ class ContextAnalyzer:
         - Topics they're working on
         - Context for personalized welcome message
         """
-        if not self.client or not recent_conversations:
+        if not llm_gateway.enabled or not recent_conversations:
             return {
                 "activity_type": "general",
                 "topics": [],
@@ -65,8 +61,8 @@ Return a JSON object with this structure:
 
 Only return valid JSON, no additional text."""
 
-            response = await self.client.chat.completions.create(
-                model=settings.LLM_MODEL,
+            response = await llm_gateway.complete(
+                "context",
                 messages=[
                     {"role": "system", "content": "You are an expert at analyzing user context and activity patterns. Always respond with valid JSON only."},
                     {"role": "user", "content": prompt}
@@ -0,0 +1,172 @@
+"""
+Columnar, memory-mapped storage for chunk texts and metadata.
+
+The documents of one segment are stored as:
+  <name>.text.bin             contiguous UTF-8 text blob
+  <name>.text_offsets.npy     int64 offsets into the text blob (n + 1 entries)
+  <name>.meta.npy             int32 value codes, one column per metadata key (-1 = missing)
+  <name>.meta_values.bin      distinct JSON-encoded metadata values, back to back
+  <name>.meta_values_offsets.npy  int64 offsets into the values blob
+  <name>.meta.json            metadata keys and the code range each key uses
+
+Everything except the small key list is read through mmap, so a process only
+pages in the rows it actually materializes.
+"""
+import numpy as np
+import io
+import os
+import json
+import mmap
+from typing import List, Dict, Any, Iterable, Iterator, Tuple
+
+SUFFIXES = (
+    "text.bin",
+    "text_offsets.npy",
+    "meta.npy",
+    "meta_values.bin",
+    "meta_values_offsets.npy",
+    "meta.json"
+)
+
+
+def fsync_write(path: str, data: bytes):
+    """Write a file durably and atomically via a temp file"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _npy_bytes(array: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.getvalue()
+
+
+def _offsets(parts: List[bytes]) -> np.ndarray:
+    offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+    if parts:
+        offsets[1:] = np.cumsum([len(part) for part in parts])
+    return offsets
+
+
+def _encode_value(value: Any) -> bytes:
+    return json.dumps(value, sort_keys=True, default=str).encode("utf-8")
+
+
+def write_documents(base_path: str, documents: List[Dict]):
+    """Write documents as a columnar segment at `base_path.<suffix>`"""
+    texts = [doc.get("text", "").encode("utf-8") for doc in documents]
+
+    keys: List[str] = []
+    for doc in documents:
+        for key in doc.get("metadata", {}):
+            if key not in keys:
+                keys.append(key)
+
+    # Dictionary-encode each metadata column; codes are global value ids
+    values: List[bytes] = []
+    value_ranges = []
+    codes = np.full((len(documents), len(keys)), -1, dtype=np.int32)
+    for col, key in enumerate(keys):
+        start = len(values)
+        seen: Dict[bytes, int] = {}
+        for row, doc in enumerate(documents):
+            metadata = doc.get("metadata", {})
+            if key not in metadata:
+                continue
+            encoded = _encode_value(metadata[key])
+            if encoded not in seen:
+                seen[encoded] = len(values)
+                values.append(encoded)
+            codes[row, col] = seen[encoded]
+        value_ranges.append([start, len(values)])
+
+    fsync_write(f"{base_path}.text.bin", b"".join(texts))
+    fsync_write(f"{base_path}.text_offsets.npy", _npy_bytes(_offsets(texts)))
+    fsync_write(f"{base_path}.meta.npy", _npy_bytes(codes))
+    fsync_write(f"{base_path}.meta_values.bin", b"".join(values))
+    fsync_write(f"{base_path}.meta_values_offsets.npy", _npy_bytes(_offsets(values)))
+    fsync_write(
+        f"{base_path}.meta.json",
+        json.dumps({"keys": keys, "value_ranges": value_ranges}).encode("utf-8")
+    )
+
+
+def _map_blob(path: str):
+    """mmap a file read-only; empty files cannot be mapped"""
+    if os.path.getsize(path) == 0:
+        return b""
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class DocumentSegment:
+    """Read-only view over one columnar segment"""
+
+    def __init__(self, base_path: str):
+        self._text = _map_blob(f"{base_path}.text.bin")
+        self._text_offsets = np.load(f"{base_path}.text_offsets.npy", mmap_mode="r")
+        self._codes = np.load(f"{base_path}.meta.npy", mmap_mode="r")
+        self._values = _map_blob(f"{base_path}.meta_values.bin")
+        self._value_offsets = np.load(f"{base_path}.meta_values_offsets.npy", mmap_mode="r")
+        with open(f"{base_path}.meta.json", "r") as f:
+            schema = json.load(f)
+        self.keys: List[str] = schema["keys"]
+        self._value_ranges: List[List[int]] = schema["value_ranges"]
+
+    def __len__(self) -> int:
+        return len(self._text_offsets) - 1
+
+    def _value(self, code: int) -> Any:
+        return json.loads(self._values[self._value_offsets[code]:self._value_offsets[code + 1]])
+
+    def text(self, row: int) -> str:
+        return self._text[self._text_offsets[row]:self._text_offsets[row + 1]].decode("utf-8")
+
+    def metadata(self, row: int) -> Dict:
+        metadata = {}
+        for col, key in enumerate(self.keys):
+            code = int(self._codes[row, col])
+            if code >= 0:
+                metadata[key] = self._value(code)
+        return metadata
+
+    def get(self, row: int) -> Dict:
+        """Materialize one row as a {"text", "metadata"} document"""
+        return {"text": self.text(row), "metadata": self.metadata(row)}
+
+    def column_values(self, key: str) -> List[Any]:
+        """Distinct values of a metadata key in this segment"""
+        if key not in self.keys:
+            return []
+        start, end = self._value_ranges[self.keys.index(key)]
+        return [self._value(code) for code in range(start, end)]
+
+    def rows_where(self, key: str, values: Iterable[Any]) -> np.ndarray:
+        """Rows whose metadata `key` equals any of `values`"""
+        if key not in self.keys:
+            return np.empty(0, dtype=np.int64)
+        col = self.keys.index(key)
+        start, end = self._value_ranges[col]
+        wanted = {_encode_value(value) for value in values}
+        codes = [
+            code for code in range(start, end)
+            if self._values[self._value_offsets[code]:self._value_offsets[code + 1]] in wanted
+        ]
+        if not codes:
+            return np.empty(0, dtype=np.int64)
+        return np.nonzero(np.isin(self._codes[:, col], codes))[0]
+
+    def column_groups(self, key: str) -> Iterator[Tuple[Any, np.ndarray]]:
+        """Yield (value, rows) for every distinct value of a metadata key"""
+        if key not in self.keys:
+            return
+        column = np.asarray(self._codes[:, self.keys.index(key)])
+        order = np.argsort(column, kind="stable")
+        codes, starts = np.unique(column[order], return_index=True)
+        for code, rows in zip(codes, np.split(order, starts[1:])):
+            if code >= 0:
+                yield self._value(int(code)), rows
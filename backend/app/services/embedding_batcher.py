@@ -0,0 +1,106 @@
+"""
+Micro-batching for query embeddings. Concurrent single-query calls are
+queued, and a scheduler thread collects them for up to a few milliseconds
+(or until the batch is full), runs one batched forward pass, and resolves
+each caller's future with its own row.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Dict, Tuple
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the batch size histogram buckets
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class EmbeddingBatcher:
+    def __init__(self, encode: Callable[[List[str]], np.ndarray], max_batch_size: int, max_wait_ms: float):
+        self._encode = encode
+        self.max_batch_size = max(max_batch_size, 1)
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[Tuple[str, Future, float]]" = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._histogram = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def submit(self, text: str) -> Future:
+        """Queue one text; the future resolves to its embedding row"""
+        if self._thread is None or not self._thread.is_alive():
+            with self._start_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                    self._thread.start()
+        future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def _collect(self) -> List[Tuple[str, Future, float]]:
+        """Block for the first request, then take more until the window closes or the batch is full"""
+        batch = [self._queue.get()]
+        deadline = batch[0][2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            try:
+                self._process(self._collect())
+            except Exception as e:
+                # Nothing may end the thread: every later query would wait on it forever
+                logger.error(f"Embedding batcher failed to process a batch: {e}")
+
+    def _process(self, batch: List[Tuple[str, Future, float]]):
+        # Callers that gave up (e.g. a cancelled asyncio waiter) are dropped
+        batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        started = time.perf_counter()
+        self._record(len(batch), [started - enqueued for _, _, enqueued in batch])
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        try:
+            rows = dict(zip(texts, self._encode(texts)))
+        except Exception as e:
+            logger.error(f"Batched embedding of {len(texts)} queries failed: {e}")
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for text, future, _ in batch:
+            future.set_result(rows[text])
+
+    def _record(self, size: int, waits: List[float]):
+        bucket = next((i for i, bound in enumerate(BATCH_SIZE_BUCKETS) if size <= bound), len(BATCH_SIZE_BUCKETS))
+        with self._metrics_lock:
+            self._batches += 1
+            self._requests += size
+            self._histogram[bucket] += 1
+            self._wait_total += sum(waits)
+            self._wait_max = max(self._wait_max, max(waits))
+
+    def metrics(self) -> Dict:
+        """Batch size distribution and time requests spent queued"""
+        with self._metrics_lock:
+            labels = [f"<={bound}" for bound in BATCH_SIZE_BUCKETS] + [f">{BATCH_SIZE_BUCKETS[-1]}"]
+            return {
+                "batches": self._batches,
+                "requests": self._requests,
+                "queued": self._queue.qsize(),
+                "avg_batch_size": self._requests / self._batches if self._batches else 0.0,
+                "batch_sizes": dict(zip(labels, self._histogram)),
+                "avg_queue_wait_ms": 1000 * self._wait_total / self._requests if self._requests else 0.0,
+                "max_queue_wait_ms": 1000 * self._wait_max
+            }
@@ -0,0 +1,232 @@
+"""
+Content-addressed embedding cache: vectors are keyed by a hash of the model
+name and the text, so identical strings (repeated predicted questions,
+topic expansions, re-uploaded chunks) are embedded once.
+
+Lookups go to a bounded in-process LRU first, then to an optional
+persistent tier holding raw float32 bytes: Redis, shared by every API
+process, or a fixed-size memory-mapped file on local disk.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional
+import numpy as np
+from app.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKENDS = ("none", "redis", "mmap")
+
+
+def cache_key(model_name: str, text: str) -> bytes:
+    """16-byte digest identifying one (model, text) pair"""
+    return hashlib.blake2b(f"{model_name}\0{text}".encode("utf-8"), digest_size=16).digest()
+
+
+class RedisEmbeddingStore:
+    """
+    Persistent tier in Redis. Embedding runs on worker threads, so this uses
+    its own synchronous client rather than the app's asyncio one.
+    """
+
+    def __init__(self, url: str, db: int, ttl: int):
+        import redis
+        self.ttl = ttl
+        self._client = redis.Redis.from_url(url, db=db, socket_timeout=1.0)
+
+    @staticmethod
+    def _redis_key(key: bytes) -> bytes:
+        return b"embedding:" + key
+
+    def get_many(self, keys: List[bytes]) -> List[Optional[bytes]]:
+        return self._client.mget([self._redis_key(key) for key in keys])
+
+    def put_many(self, items: Dict[bytes, bytes]):
+        pipeline = self._client.pipeline(transaction=False)
+        for key, value in items.items():
+            pipeline.setex(self._redis_key(key), self.ttl, value)
+        pipeline.execute()
+
+
+class MmapEmbeddingStore:
+    """
+    Persistent tier in a local file of fixed-size slots, addressed by key
+    hash with a short linear probe. When all probed slots are taken the
+    first one is overwritten, so the file never grows.
+    """
+
+    PROBES = 4
+
+    def __init__(self, path: str, dimension: int, slots: int):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.slots = slots
+        self._lock = threading.Lock()
+        layout = {"slots": slots, "dimension": dimension}
+        mode = "r+" if self._read_layout(path) == layout else "w+"
+        if mode == "w+":
+            # Missing, or laid out for another slot count: start over rather than mis-address slots
+            logger.info(f"Creating embedding cache {path} with {slots} slots")
+            self._remove(path)
+        self._keys = np.memmap(f"{path}.keys", dtype=np.uint8, mode=mode, shape=(slots, 16))
+        self._vectors = np.memmap(f"{path}.vectors", dtype=np.float32, mode=mode, shape=(slots, dimension))
+        if mode == "w+":
+            # Written last, so a cache interrupted while being created is rebuilt on the next open
+            with open(f"{path}.meta", "w") as f:
+                json.dump(layout, f)
+
+    @staticmethod
+    def _read_layout(path: str) -> Optional[Dict]:
+        try:
+            with open(f"{path}.meta") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _remove(path: str):
+        for suffix in (".meta", ".keys", ".vectors"):
+            try:
+                os.remove(f"{path}{suffix}")
+            except FileNotFoundError:
+                pass
+
+    def _candidates(self, key: bytes) -> range:
+        start = int.from_bytes(key[:8], "little") % self.slots
+        return range(start, start + self.PROBES)
+
+    def get_many(self, keys: List[bytes]) -> List[Optional[bytes]]:
+        values = []
+        for key in keys:
+            value = None
+            for slot in self._candidates(key):
+                slot %= self.slots
+                if self._keys[slot].tobytes() == key:
+                    vector = self._vectors[slot].tobytes()
+                    # Re-check the key: another process may have overwritten the slot meanwhile
+                    if self._keys[slot].tobytes() == key:
+                        value = vector
+                    break
+            values.append(value)
+        return values
+
+    def put_many(self, items: Dict[bytes, bytes]):
+        with self._lock:
+            for key, value in items.items():
+                slots = [slot % self.slots for slot in self._candidates(key)]
+                target = slots[0]
+                for slot in slots:
+                    stored = self._keys[slot].tobytes()
+                    if stored == key or not any(stored):
+                        target = slot
+                        break
+                # Clear the key while the vector is rewritten so readers never match a torn slot
+                self._keys[target] = 0
+                self._vectors[target] = np.frombuffer(value, dtype=np.float32)
+                self._keys[target] = np.frombuffer(key, dtype=np.uint8)
+
+
+class EmbeddingCache:
+    """Thread-safe LRU of float32 vectors in front of an optional persistent store"""
+
+    def __init__(self, model_name: str, dimension: int, max_entries: int, store=None):
+        self.model_name = model_name
+        self.dimension = dimension
+        self.max_entries = max_entries
+        self._store = store
+        self._entries: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Cached vector per text, or None for misses"""
+        keys = [cache_key(self.model_name, text) for text in texts]
+        vectors: List[Optional[np.ndarray]] = [None] * len(keys)
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._entries.get(key)
+                if vector is None:
+                    missing.append(i)
+                else:
+                    self._entries.move_to_end(key)
+                    vectors[i] = vector
+
+        if missing and self._store is not None:
+            stored = self._store_call("get_many", [keys[i] for i in missing]) or [None] * len(missing)
+            found = {}
+            for i, value in zip(missing, stored):
+                if value is not None and len(value) == self.dimension * 4:
+                    vectors[i] = found[keys[i]] = np.frombuffer(value, dtype=np.float32)
+            self._remember(found)
+
+        hits = sum(vector is not None for vector in vectors)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(vectors) - hits
+        return vectors
+
+    def put_many(self, texts: List[str], vectors: np.ndarray):
+        items = {
+            cache_key(self.model_name, text): np.array(vector, dtype=np.float32)
+            for text, vector in zip(texts, vectors)
+        }
+        self._remember(items)
+        if self._store is not None:
+            self._store_call("put_many", {key: vector.tobytes() for key, vector in items.items()})
+
+    def _remember(self, items: Dict[bytes, np.ndarray]):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            for key, vector in items.items():
+                vector.flags.writeable = False
+                self._entries[key] = vector
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _store_call(self, method: str, *args):
+        """A failing persistent tier is dropped; the in-process tier keeps working"""
+        try:
+            return getattr(self._store, method)(*args)
+        except Exception as e:
+            logger.warning(f"Embedding cache store failed, continuing without it: {e}")
+            self._store = None
+            return None
+
+    def info(self) -> Dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "backend": settings.EMBEDDING_CACHE_BACKEND if self._store is not None else "none",
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+def create_embedding_cache(model_name: str, dimension: int) -> EmbeddingCache:
+    """Build the cache configured by the EMBEDDING_CACHE_* settings"""
+    backend = settings.EMBEDDING_CACHE_BACKEND
+    if backend not in CACHE_BACKENDS:
+        raise ValueError(f"Unknown embedding cache backend: {backend}. Expected one of {CACHE_BACKENDS}")
+
+    store = None
+    try:
+        if backend == "redis":
+            store = RedisEmbeddingStore(settings.REDIS_URL, settings.REDIS_DB, settings.EMBEDDING_CACHE_TTL)
+        elif backend == "mmap":
+            safe_name = model_name.replace("/", "_")
+            store = MmapEmbeddingStore(
+                os.path.join(settings.EMBEDDING_CACHE_PATH, f"{safe_name}-{dimension}"),
+                dimension,
+                settings.EMBEDDING_CACHE_MMAP_SLOTS
+            )
+    except Exception as e:
+        logger.warning(f"Could not open {backend} embedding cache: {e}. Continuing with the in-process cache only.")
+        store = None
+    return EmbeddingCache(model_name, dimension, settings.EMBEDDING_CACHE_SIZE, store)
@@ -0,0 +1,86 @@
+"""
+Process pool for bulk embedding (uploads, the bulk indexer). Each worker process
+loads its own copy of the model and runs on a share of the cores; workers
+write vectors straight into a shared-memory output buffer, so only the
+input texts cross the process boundary.
+"""
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Iterator, List
+import numpy as np
+from app.config import settings
+from app.services.helper_processes import EMBEDDING_WORKER_PREFIX, NamedSpawnContext
+import logging
+
+logger = logging.getLogger(__name__)
+
+_encoder = None
+
+
+def _init_worker(threads: int):
+    """Load the model once per worker, limited to its share of the cores"""
+    global _encoder
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    settings.EMBEDDING_ONNX_THREADS = threads
+    from app.services.embeddings import embedding_service
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads)
+    _encoder = embedding_service
+
+
+def _encode_into(buffer_name: str, shape: tuple, start: int, texts: List[str]) -> int:
+    buffer = SharedMemory(name=buffer_name)
+    try:
+        output = np.ndarray(shape, dtype=np.float32, buffer=buffer.buf)
+        output[start:start + len(texts)] = _encoder.compute(texts)
+        del output
+    finally:
+        buffer.close()
+    return len(texts)
+
+
+class EmbeddingPool:
+    def __init__(self, workers: int, dimension: int):
+        self.workers = workers
+        self.dimension = dimension
+        threads = max((os.cpu_count() or workers) // workers, 1)
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=NamedSpawnContext(EMBEDDING_WORKER_PREFIX),
+            initializer=_init_worker,
+            initargs=(threads,)
+        )
+        logger.info(f"Started embedding pool with {workers} workers x {threads} threads")
+
+    def imap(self, batches: List[List[str]]) -> Iterator[np.ndarray]:
+        """Embeddings for each batch of texts, yielded in order while later batches are still running"""
+        total = sum(len(batch) for batch in batches)
+        if total == 0:
+            for _ in batches:
+                yield np.empty((0, self.dimension), dtype=np.float32)
+            return
+
+        buffer = SharedMemory(create=True, size=total * self.dimension * 4)
+        output = np.ndarray((total, self.dimension), dtype=np.float32, buffer=buffer.buf)
+        offsets = np.concatenate([[0], np.cumsum([len(batch) for batch in batches])])
+        futures = [
+            self._executor.submit(_encode_into, buffer.name, output.shape, int(start), batch) if batch else None
+            for start, batch in zip(offsets, batches)
+        ]
+        try:
+            for start, end, future in zip(offsets[:-1], offsets[1:], futures):
+                if future is not None:
+                    future.result()
+                yield output[start:end].copy()
+        finally:
+            pending = [future for future in futures if future is not None and not future.cancel()]
+            for future in pending:
+                future.exception()  # wait, so no worker still writes to the buffer
+            del output
+            buffer.close()
+            buffer.unlink()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
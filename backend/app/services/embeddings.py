@@ -1,13 +1,23 @@
-from sentence_transformers import SentenceTransformer
 from app.config import settings
+from app.services.embedding_cache import create_embedding_cache
+from app.services.embedding_batcher import EmbeddingBatcher
+from concurrent.futures import Future
+from typing import Iterator
+import threading
 import logging
 import numpy as np
 
 logger = logging.getLogger(__name__)
 
+EMBEDDING_BACKENDS = ("torch", "onnx")
+
 class EmbeddingService:
     _instance = None
     _model = None
+    _cache = None
+    _batcher = None
+    _pool = None
+    _pool_lock = threading.Lock()
     
     def __new__(cls):
         if cls._instance is None:
@@ -17,22 +27,147 @@ class EmbeddingService:
     def __init__(self):
         if self._model is None:
             try:
-                logger.info(f"Loading embedding model: {settings.EMBEDDING_MODEL}")
-                self._model = SentenceTransformer(settings.EMBEDDING_MODEL)
+                logger.info(f"Loading embedding model: {settings.EMBEDDING_MODEL} ({settings.EMBEDDING_BACKEND})")
+                self._model = self._load_model()
                 logger.info("Embedding model loaded successfully")
+                self._cache = create_embedding_cache(self.model_id, self._model.get_sentence_embedding_dimension())
+                if settings.EMBEDDING_BATCH_MAX_WAIT_MS > 0:
+                    self._batcher = EmbeddingBatcher(
+                        self._embed, settings.EMBEDDING_BATCH_MAX_SIZE, settings.EMBEDDING_BATCH_MAX_WAIT_MS
+                    )
             except Exception as e:
                 logger.error(f"Error loading embedding model: {e}")
                 raise
     
+    @staticmethod
+    def _load_model():
+        backend = settings.EMBEDDING_BACKEND
+        if backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"Unknown embedding backend: {backend}. Expected one of {EMBEDDING_BACKENDS}")
+        if backend == "onnx":
+            from app.services.onnx_embeddings import load_onnx_encoder
+            return load_onnx_encoder(
+                settings.EMBEDDING_MODEL, settings.EMBEDDING_ONNX_QUANTIZE, settings.EMBEDDING_ONNX_THREADS
+            )
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(settings.EMBEDDING_MODEL)
+    
+    @property
+    def model_id(self) -> str:
+        """Model name plus backend variant; quantized vectors are cached apart from torch ones"""
+        if settings.EMBEDDING_BACKEND == "onnx":
+            return f"{settings.EMBEDDING_MODEL}:onnx{'-int8' if settings.EMBEDDING_ONNX_QUANTIZE else ''}"
+        return settings.EMBEDDING_MODEL
+    
+    @property
+    def max_tokens(self) -> int:
+        """Word-pieces per input the model keeps, excluding the special tokens it adds"""
+        return self._model.max_seq_length - 2
+    
+    def count_tokens(self, texts: list[str]) -> list[int]:
+        """Word-piece count of each text, without special tokens"""
+        if hasattr(self._model, "count_tokens"):
+            return self._model.count_tokens(texts)
+        if not texts:
+            return []
+        encoded = self._model.tokenizer(texts, add_special_tokens=False, verbose=False)["input_ids"]
+        return [len(ids) for ids in encoded]
+    
     def encode(self, texts: list[str] | str) -> np.ndarray:
         """Generate embeddings for text(s)"""
         if isinstance(texts, str):
             texts = [texts]
-        return self._model.encode(texts, convert_to_numpy=True)
+        cached = self._cache.get_many(texts)
+        # Embed each distinct missing text once, in a single batch
+        missing = self._missing(texts, cached)
+        return self._splice(texts, cached, missing, self._embed(missing) if missing else None)
+    
+    def encode_bulk(self, texts: list[str]) -> np.ndarray:
+        """Embeddings for a large batch, spread over the process pool when one is configured"""
+        chunks = list(self.iter_encode_bulk(texts))
+        if not chunks:
+            return np.empty((0, self._cache.dimension), dtype=np.float32)
+        return np.concatenate(chunks)
+    
+    def iter_encode_bulk(self, texts: list[str]) -> Iterator[np.ndarray]:
+        """
+        Embeddings for `texts` in order, one array per EMBEDDING_POOL_CHUNK_SIZE
+        texts, yielded as soon as each chunk is done while later ones run.
+        """
+        pool = self._get_pool() if len(texts) >= settings.EMBEDDING_POOL_MIN_TEXTS else None
+        size = settings.EMBEDDING_POOL_CHUNK_SIZE
+        chunks = [texts[i:i + size] for i in range(0, len(texts), size)]
+        if pool is None:
+            for chunk in chunks:
+                yield self.encode(chunk)
+            return
+        
+        lookups = [self._cache.get_many(chunk) for chunk in chunks]
+        missing = [self._missing(chunk, cached) for chunk, cached in zip(chunks, lookups)]
+        for chunk, cached, chunk_missing, computed in zip(chunks, lookups, missing, pool.imap(missing)):
+            if chunk_missing:
+                self._cache.put_many(chunk_missing, computed)
+            yield self._splice(chunk, cached, chunk_missing, computed)
+    
+    @staticmethod
+    def _missing(texts: list[str], cached: list) -> list[str]:
+        return list(dict.fromkeys(text for text, vector in zip(texts, cached) if vector is None))
+    
+    def _splice(self, texts: list[str], cached: list, missing: list[str], computed) -> np.ndarray:
+        """Cached vectors with the computed misses put back in input order"""
+        if missing:
+            by_text = dict(zip(missing, computed))
+            cached = [by_text[text] if vector is None else vector for text, vector in zip(texts, cached)]
+        if not cached:
+            return np.empty((0, self._cache.dimension), dtype=np.float32)
+        return np.stack(cached)
+    
+    def compute(self, texts: list[str]) -> np.ndarray:
+        """Run the model directly, without the cache"""
+        return self._model.encode(texts, convert_to_numpy=True).astype(np.float32)
+    
+    def _embed(self, texts: list[str]) -> np.ndarray:
+        """Run the model on texts known to be uncached and cache the results"""
+        computed = self.compute(texts)
+        self._cache.put_many(texts, computed)
+        return computed
+    
+    def _get_pool(self):
+        """The bulk-encoding process pool, started on first use; None when disabled"""
+        if settings.EMBEDDING_POOL_WORKERS <= 1:
+            return None
+        with self._pool_lock:
+            if self._pool is None:
+                from app.services.embedding_pool import EmbeddingPool
+                self._pool = EmbeddingPool(settings.EMBEDDING_POOL_WORKERS, self._cache.dimension)
+            return self._pool
+    
+    def submit_query(self, query: str) -> Future:
+        """
+        Embedding of one query as a future. Cache misses are batched with
+        other concurrent queries when micro-batching is enabled.
+        """
+        cached = self._cache.get_many([query])[0]
+        if cached is None and self._batcher is not None:
+            return self._batcher.submit(query)
+        future = Future()
+        try:
+            future.set_result(cached if cached is not None else self._embed([query])[0])
+        except Exception as e:
+            future.set_exception(e)
+        return future
     
     def encode_query(self, query: str) -> np.ndarray:
         """Generate embedding for a query"""
-        return self.encode(query)
+        return self.submit_query(query).result()[np.newaxis, :]
+    
+    def cache_info(self) -> dict:
+        """Embedding cache size and hit counts"""
+        return self._cache.info()
+    
+    def batcher_metrics(self) -> dict | None:
+        """Query micro-batching metrics, or None when batching is disabled"""
+        return self._batcher.metrics() if self._batcher is not None else None
 
 embedding_service = EmbeddingService()
 
@@ -0,0 +1,95 @@
+"""
+Incremental text extraction for ingestion. Documents are read as a stream
+of parts (PDF pages, or paragraph blocks of text files) so memory stays
+bounded by the part size rather than the file size. PDF parsing runs in a
+small pool of worker processes, a few pages per task, so it neither blocks
+the event loop nor holds the GIL of the API process.
+"""
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List
+from app.config import settings
+from app.services.helper_processes import PDF_WORKER_PREFIX, NamedSpawnContext
+import logging
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = (".pdf", ".txt", ".md")
+
+
+def is_supported(name: str) -> bool:
+    return name.lower().endswith(SUPPORTED_EXTENSIONS)
+
+
+def _pdf_page_count(path: str) -> int:
+    import PyPDF2
+    return len(PyPDF2.PdfReader(path).pages)
+
+
+def _pdf_pages(path: str, start: int, end: int) -> List[str]:
+    import PyPDF2
+    reader = PyPDF2.PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def iter_text_parts(path: str, part_chars: int) -> Iterator[str]:
+    """Paragraph-aligned blocks of roughly `part_chars` characters"""
+    block = []
+    size = 0
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            block.append(line)
+            size += len(line)
+            if size >= part_chars and not line.strip():
+                yield "".join(block)
+                block, size = [], 0
+            elif size >= 4 * part_chars:
+                # No paragraph break for a long stretch; cut at the line instead
+                yield "".join(block)
+                block, size = [], 0
+    if block:
+        yield "".join(block)
+
+
+class DocumentExtractor:
+    def __init__(self, workers: int):
+        self.workers = max(workers, 1)
+        self._executor = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=NamedSpawnContext(PDF_WORKER_PREFIX)
+            )
+        return self._executor
+
+    def parts(self, path: str) -> Iterator[str]:
+        """Text of a saved document, part by part"""
+        if path.lower().endswith(".pdf"):
+            return self.pdf_pages(path)
+        if is_supported(path):
+            return iter_text_parts(path, settings.RAG_EXTRACT_PART_CHARS)
+        raise ValueError(f"Unsupported file type: {os.path.basename(path)}")
+
+    def pdf_pages(self, path: str) -> Iterator[str]:
+        """Page texts in order; a bounded number of page ranges are parsed ahead in the pool"""
+        pool = self._pool()
+        pages = pool.submit(_pdf_page_count, path).result()
+        step = max(settings.RAG_EXTRACT_PAGES_PER_TASK, 1)
+        ranges = iter(range(0, pages, step))
+        in_flight = deque()
+        try:
+            for start in ranges:
+                in_flight.append(pool.submit(_pdf_pages, path, start, min(start + step, pages)))
+                if len(in_flight) >= 2 * self.workers:
+                    yield from in_flight.popleft().result()
+            while in_flight:
+                yield from in_flight.popleft().result()
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+
+document_extractor = DocumentExtractor(settings.RAG_EXTRACT_WORKERS)
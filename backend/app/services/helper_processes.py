@@ -0,0 +1,32 @@
+"""
+Naming for the helper processes the backend spawns (RAG shards, embedding
+and PDF workers). A spawned child re-imports the parent's main module, so
+modules that build heavy singletons at import time (the RAG engine) check
+`is_helper_process()` and skip them.
+"""
+import itertools
+import multiprocessing
+import multiprocessing.context
+
+SHARD_PREFIX = "rag-shard-"
+EMBEDDING_WORKER_PREFIX = "embedding-worker-"
+PDF_WORKER_PREFIX = "pdf-worker-"
+HELPER_PREFIXES = (SHARD_PREFIX, EMBEDDING_WORKER_PREFIX, PDF_WORKER_PREFIX)
+
+
+def is_helper_process() -> bool:
+    return multiprocessing.current_process().name.startswith(HELPER_PREFIXES)
+
+
+class NamedSpawnContext(multiprocessing.context.SpawnContext):
+    """Spawn context whose processes are named `<prefix><n>`, for process pools"""
+
+    def __init__(self, prefix: str):
+        super().__init__()
+        self.prefix = prefix
+        self._counter = itertools.count(1)
+
+    def Process(self, *args, **kwargs) -> multiprocessing.context.SpawnProcess:
+        process = multiprocessing.context.SpawnProcess(*args, **kwargs)
+        process.name = f"{self.prefix}{next(self._counter)}"
+        return process
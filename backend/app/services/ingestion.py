@@ -0,0 +1,277 @@
+"""
+Streaming ingestion of a saved document: extract part by part, chunk,
+and embed and index in fixed-size batches, so peak memory is bounded by
+the batch size rather than the document size.
+
+Uploads run as background jobs on their own small thread pool, separate
+from the retrieval workers, and report progress while they run.
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Iterable, Iterator, Optional, Tuple
+import numpy as np
+from app.services.rag_engine import rag_engine, embedding_service
+from app.services.chunker import chunk_text
+from app.services.extraction import document_extractor
+from app.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionJob:
+    """Status of one document ingestion, updated by the worker thread as it runs"""
+
+    def __init__(self, name: str):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.status = "queued"  # queued | running | committing | completed | failed
+        self.pages_parsed = 0
+        self.chunks_embedded = 0  # chunks indexed so far, embedded or reused
+        self.chunks_reused = 0
+        self.committed = False
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "filename": self.name,
+            "status": self.status,
+            "pages_parsed": self.pages_parsed,
+            "chunks_embedded": self.chunks_embedded,
+            "chunks_reused": self.chunks_reused,
+            "committed": self.committed,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+
+def file_hash(path: str) -> str:
+    """Content hash of a file, read in fixed-size blocks"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while block := f.read(1 << 20):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def indexed_version(name: str, content_hash: str) -> Tuple[List[Dict], bool]:
+    """
+    Chunks currently indexed for `name`, and whether they are the complete
+    set from the file with `content_hash`. The last chunk of a file carries
+    `chunk_count`; an ingestion cut short never wrote it.
+    """
+    previous = rag_engine.get_chunks_by_metadata("name", [name])
+    unchanged = (
+        bool(previous)
+        and all(chunk["metadata"].get("file_hash") == content_hash for chunk in previous)
+        and any(chunk["metadata"].get("chunk_count") == len(previous) for chunk in previous)
+    )
+    return previous, unchanged
+
+
+def reusable_vectors(previous: List[Dict]) -> Dict[str, int]:
+    """chunk_hash -> chunk id for indexed chunks whose vector can be reused"""
+    return {
+        chunk["metadata"]["chunk_hash"]: chunk["chunk_id"]
+        for chunk in previous if chunk["metadata"].get("chunk_hash")
+    }
+
+
+def embed_chunks(texts: List[str], reusable: Dict[str, int]) -> Tuple[np.ndarray, List[str], int]:
+    """
+    Vectors for chunk texts, copying the stored vector of any chunk in
+    `reusable` with the same text hash. Returns (vectors, chunk hashes,
+    number of texts actually embedded).
+    """
+    hashes = [chunk_hash(text) for text in texts]
+    stored = rag_engine.get_vectors_by_ids([reusable[h] for h in set(hashes) if h in reusable])
+    vectors = [stored.get(reusable.get(h)) for h in hashes]
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        for i, vector in zip(missing, embedding_service().encode_bulk([texts[i] for i in missing])):
+            vectors[i] = vector
+    return np.stack(vectors).astype("float32"), hashes, len(missing)
+
+
+def ingest_file(path: str, name: str, metadata: Dict, job: Optional[IngestionJob] = None) -> Dict:
+    """
+    Index the file at `path` as document `name`, replacing any previous
+    version, with work proportional to what changed:
+    - a file whose content hash matches the indexed version is skipped;
+    - chunks whose text hash matches a chunk of the previous version
+      reuse its stored vector instead of being embedded again;
+    - new chunks are staged out of sight and published in the same snapshot
+      swap that retires the previous version, so searches never mix them.
+    On failure, or when the file yields no text, the staged chunks are
+    discarded and the previous version stays.
+    """
+    job = job or IngestionJob(name)
+    content_hash = file_hash(path)
+    previous, unchanged = indexed_version(name, content_hash)
+    if unchanged:
+        job.committed = True
+        logger.info(f"Skipped {name}: unchanged since it was indexed")
+        return {"chunks": len(previous), "embedded": 0, "reused": len(previous), "replaced_chunks": 0, "unchanged": True}
+
+    reusable = reusable_vectors(previous)
+    added: List[int] = []
+    embedded = 0
+    batch: List[str] = []
+
+    def parts(source: Iterable[str]) -> Iterator[str]:
+        for part in source:
+            job.pages_parsed += 1
+            yield part
+
+    def flush(final: bool = False):
+        nonlocal embedded
+        vectors, hashes, batch_embedded = embed_chunks(batch, reusable)
+        embedded += batch_embedded
+        start = len(added)
+        documents = [
+            {
+                "text": text,
+                "metadata": {**metadata, "chunk_index": start + i, "file_hash": content_hash, "chunk_hash": hashes[i]}
+            }
+            for i, text in enumerate(batch)
+        ]
+        if final:
+            # Marks the file as completely indexed
+            documents[-1]["metadata"]["chunk_count"] = start + len(batch)
+        added.extend(rag_engine.add_embeddings(vectors, documents, staged=True))
+        job.chunks_embedded = len(added)
+        job.chunks_reused = len(added) - embedded
+        batch.clear()
+
+    try:
+        for chunk in chunk_text(parts(document_extractor.parts(path))):
+            # Flushed before appending, so the last chunk is always in the final flush
+            if len(batch) >= settings.RAG_INGEST_BATCH_CHUNKS:
+                flush()
+            batch.append(chunk)
+        if batch:
+            flush(final=True)
+    except Exception:
+        if added:
+            rag_engine.discard_staged(added)
+        raise
+
+    if not added and previous:
+        # An empty or unreadable upload must not wipe out the indexed version
+        raise ValueError(f"No text could be extracted from {name}; the indexed version is kept")
+
+    job.status = "committing"
+    removed = rag_engine.publish_chunks(added, [chunk["chunk_id"] for chunk in previous])
+    job.committed = True
+    logger.info(f"Ingested {name}: {len(added)} chunks ({embedded} embedded, {len(added) - embedded} reused), {removed} replaced")
+    return {
+        "chunks": len(added),
+        "embedded": embedded,
+        "reused": len(added) - embedded,
+        "replaced_chunks": removed,
+        "unchanged": False
+    }
+
+
+class IngestionJobManager:
+    """
+    Runs ingestion jobs with bounded concurrency. Jobs for the same document
+    run one at a time so each retires exactly the version before it, and a
+    delete waits for them. Job state lives in this process and the most
+    recent finished jobs are kept.
+    """
+
+    def __init__(self, concurrency: int, history: int):
+        self._executor = ThreadPoolExecutor(max_workers=max(concurrency, 1), thread_name_prefix="ingestion")
+        self.history = history
+        self._jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._name_locks: Dict[str, threading.Lock] = {}
+
+    def submit(self, staged_path: str, name: str, metadata: Dict) -> IngestionJob:
+        """
+        Queue ingestion of an uploaded file staged at `staged_path`; it is
+        moved to DOCUMENTS_PATH/name once indexed, or deleted on failure.
+        """
+        job = IngestionJob(name)
+        with self._lock:
+            self._jobs[job.id] = job
+            name_lock = self._name_locks.setdefault(name, threading.Lock())
+            self._trim()
+        self._executor.submit(self._run, job, name_lock, staged_path, metadata)
+        return job
+
+    async def delete(self, name: str) -> int:
+        """
+        Remove a document from search and its stored file once no job for the
+        same name is running, so a job cannot publish it back afterwards.
+        Returns the number of chunks removed.
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, self._delete, name)
+
+    def _delete(self, name: str) -> int:
+        with self._lock:
+            name_lock = self._name_locks.setdefault(name, threading.Lock())
+        with name_lock:
+            removed = rag_engine.delete_document(name)
+            file_path = os.path.join(settings.DOCUMENTS_PATH, os.path.basename(name))
+            if removed and os.path.exists(file_path):
+                os.remove(file_path)
+        return removed
+
+    def _run(self, job: IngestionJob, name_lock: threading.Lock, staged_path: str, metadata: Dict):
+        with name_lock:
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                job.result = ingest_file(staged_path, job.name, metadata, job)
+                os.replace(staged_path, os.path.join(settings.DOCUMENTS_PATH, job.name))
+                job.status = "completed"
+            except Exception as e:
+                logger.error(f"Ingestion job {job.id} for {job.name} failed: {e}")
+                job.error = str(e)
+                job.status = "failed"
+                if os.path.exists(staged_path):
+                    os.remove(staged_path)
+            finally:
+                job.finished_at = time.time()
+
+    def _trim(self):
+        """Forget the oldest finished jobs beyond the history limit. Caller holds the lock"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(len(finished) - self.history, 0)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        job = self._jobs.get(job_id)
+        return job.to_dict() if job else None
+
+    def list(self) -> List[Dict]:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job.to_dict() for job in reversed(jobs)]
+
+
+ingestion_jobs = IngestionJobManager(settings.RAG_INGEST_CONCURRENCY, settings.RAG_INGEST_JOB_HISTORY)
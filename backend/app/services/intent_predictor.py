@@ -1,5 +1,5 @@
-from openai import AsyncOpenAI
 from app.config import settings
+from app.services.llm_gateway import llm_gateway
 from typing import List, Dict
 import logging
 import json
@@ -7,15 +7,12 @@ import json
 logger = logging.getLogger(__name__)
 
 class IntentPredictor:
-    def __init__(self):
-        self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY) if settings.OPENAI_API_KEY else None
-    
     async def predict(self, messages: List[Dict]) -> Dict:
         """
         Predict the next question based on conversation history.
         Returns predictions with confidence scores.
         """
-        if not self.client:
+        if not llm_gateway.enabled:
             logger.warning("OpenAI client not configured, using fallback prediction")
             return self._fallback_predict(messages)
         
@@ -77,8 +74,8 @@ Return a JSON object with this structure:
 
 Only return valid JSON, no additional text."""
 
-            response = await self.client.chat.completions.create(
-                model=settings.LLM_MODEL,
+            response = await llm_gateway.complete(
+                "intent",
                 messages=[
                     {"role": "system", "content": "You are an expert at predicting user intent and next questions in technical conversations. Always respond with valid JSON only."},
                     {"role": "user", "content": prompt}
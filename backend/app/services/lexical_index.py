@@ -0,0 +1,160 @@
+"""
+In-memory BM25 inverted index over chunk texts, for exact identifiers,
+error codes and API names that embeddings tend to blur.
+"""
+import re
+import math
+from array import array
+from collections import Counter
+from typing import List, Dict, Iterable, Optional, Tuple
+import numpy as np
+
+# Compound tokens keep their inner punctuation (foo.bar, ERR-42, a::b)
+_TOKEN_RE = re.compile(r"\w+(?:[.\-:/]+\w+)*")
+_SPLIT_RE = re.compile(r"[.\-:/_]+")
+# A term that reads like an identifier rather than a word
+_IDENTIFIER_RE = re.compile(r"\d|_|\w[.\-:/]+\w|[a-z][A-Z]|^[A-Z]{2,}$")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms; compound identifiers are also indexed by their parts"""
+    terms = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        terms.append(token)
+        parts = [part for part in _SPLIT_RE.split(token) if part]
+        if len(parts) > 1:
+            terms.extend(parts)
+    return terms
+
+
+def looks_like_keyword_query(query: str, max_terms: int) -> bool:
+    """Short queries made only of identifier-like terms, e.g. `ERR_TIMEOUT` or `faiss.IndexIVFPQ`"""
+    terms = query.split()
+    if not terms or len(terms) > max_terms:
+        return False
+    return all(_IDENTIFIER_RE.search(term.strip("`'\"()[],;?")) for term in terms)
+
+
+class LexicalIndex:
+    """
+    Safe for one writer and concurrent readers without a lock: readers copy
+    postings atomically, and removals swap in new posting arrays.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        # term -> (ascending rows, term frequencies)
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._lengths = np.zeros(1024, dtype=np.int32)  # grown by replacement, never resized in place
+        self._documents = 0
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return self._documents
+
+    def add(self, rows: Iterable[int], texts: List[str]):
+        """Index newly appended rows; rows must be larger than any indexed so far"""
+        rows = [int(row) for row in rows]
+        counted = [Counter(tokenize(text)) for text in texts]
+        if rows and rows[-1] >= len(self._lengths):
+            lengths = np.zeros(max(2 * len(self._lengths), rows[-1] + 1), dtype=np.int32)
+            lengths[:len(self._lengths)] = self._lengths
+            self._lengths = lengths
+
+        # Lengths are set before postings, so a reader that finds a row in the postings can size it
+        for row, terms in zip(rows, counted):
+            length = sum(terms.values())
+            self._lengths[row] = length
+            self._documents += 1
+            self._total_length += length
+        for row, terms in zip(rows, counted):
+            for term, count in terms.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = (array("q"), array("i"))
+                postings[0].append(row)
+                postings[1].append(count)
+
+    def remove(self, rows: Iterable[int], texts: List[str]):
+        """Drop rows (e.g. deleted chunks) from the postings of their terms"""
+        dead_by_term: Dict[str, set] = {}
+        for row, text in zip(rows, texts):
+            row = int(row)
+            if row >= len(self._lengths) or self._lengths[row] == 0:
+                continue
+            self._documents -= 1
+            self._total_length -= int(self._lengths[row])
+            self._lengths[row] = 0
+            for term in set(tokenize(text)):
+                dead_by_term.setdefault(term, set()).add(row)
+
+        for term, dead in dead_by_term.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            kept = [(row, count) for row, count in zip(*postings) if row not in dead]
+            if kept:
+                self._postings[term] = (array("q", [row for row, _ in kept]), array("i", [count for _, count in kept]))
+            else:
+                del self._postings[term]
+
+    def search(
+        self,
+        query: str,
+        k: int,
+        allowed: Optional[np.ndarray] = None,
+        excluded: Optional[np.ndarray] = None,
+        end: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k (rows, BM25 scores), best first. `allowed` restricts and
+        `excluded` removes candidate rows; rows from `end` on are ignored.
+        """
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+        documents = self._documents
+        if documents <= 0:
+            return empty
+
+        avg_length = max(self._total_length / documents, 1.0)
+        hit_rows = []
+        hit_tfs = []
+        idfs = []
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            # tobytes() copies while holding the GIL; a numpy view would block the writer's appends
+            rows = np.frombuffer(postings[0].tobytes(), dtype=np.int64)
+            tf = np.frombuffer(postings[1].tobytes(), dtype=np.int32).astype(np.float32)[:len(rows)]
+            rows = rows[:len(tf)]
+            df = len(rows)
+            hit_rows.append(rows)
+            hit_tfs.append(tf)
+            idfs.append(math.log(1 + max(documents - df + 0.5, 0.5) / (df + 0.5)))
+        if not hit_rows:
+            return empty
+
+        lengths = self._lengths
+        hit_scores = []
+        for i, (rows, tf) in enumerate(zip(hit_rows, hit_tfs)):
+            if end is not None:
+                keep = rows < end
+                rows, tf = rows[keep], tf[keep]
+                hit_rows[i] = rows
+            norm = self.k1 * (1 - self.b + self.b * lengths[rows] / avg_length)
+            hit_scores.append(idfs[i] * tf * (self.k1 + 1) / (tf + norm))
+
+        rows, inverse = np.unique(np.concatenate(hit_rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(hit_scores)).astype(np.float32)
+        if allowed is not None:
+            mask = np.isin(rows, allowed)
+            rows, scores = rows[mask], scores[mask]
+        if excluded is not None and len(excluded):
+            mask = ~np.isin(rows, excluded)
+            rows, scores = rows[mask], scores[mask]
+        if len(rows) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return rows[order], scores[order]
@@ -0,0 +1,299 @@
+"""
+Single entry point for LLM calls. One pooled AsyncOpenAI client is shared by
+every caller, and each call is tagged with a purpose (chat, intent, topics,
+precompute, context) that selects its concurrency limit and deadline:
+
+- a global and a per-purpose semaphore bound the calls in flight, so
+  background work (prediction, precompute) cannot crowd out chat or overrun
+  the provider's rate limits;
+- the deadline covers queueing, every attempt and the backoff between them;
+- timeouts, connection errors, 429 and 5xx responses are retried with
+  jittered exponential backoff (honouring Retry-After);
+- latency, retries, failures and token usage are recorded per purpose.
+"""
+import asyncio
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Optional
+import httpx
+import numpy as np
+import openai
+from openai import AsyncOpenAI
+from app.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+LATENCY_WINDOW = 1000  # recent calls per purpose kept for latency percentiles
+
+
+class PurposeMetrics:
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.retries = 0
+        self.in_flight = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.queue_waits = deque(maxlen=LATENCY_WINDOW)
+        self.first_tokens = deque(maxlen=LATENCY_WINDOW)
+
+    def record_usage(self, usage):
+        if usage is not None:
+            self.prompt_tokens += usage.prompt_tokens or 0
+            self.completion_tokens += usage.completion_tokens or 0
+
+    def to_dict(self) -> Dict:
+        def ms(values, q):
+            return round(float(np.percentile(values, q)) * 1000, 1) if values else 0.0
+
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "retries": self.retries,
+            "in_flight": self.in_flight,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "latency_p50_ms": ms(self.latencies, 50),
+            "latency_p95_ms": ms(self.latencies, 95),
+            "queue_wait_p95_ms": ms(self.queue_waits, 95),
+            "first_token_p50_ms": ms(self.first_tokens, 50)
+        }
+
+
+def _retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError)):  # includes APITimeoutError
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def _retry_after(error: Exception) -> float:
+    """Seconds the provider asked us to wait, if it said"""
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after", 0)) if response is not None else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class LLMGateway:
+    def __init__(self):
+        self._loop = None
+        self._client: Optional[AsyncOpenAI] = None
+        self._global: Optional[asyncio.Semaphore] = None
+        self._purposes: Dict[str, asyncio.Semaphore] = {}
+        self._metrics: Dict[str, PurposeMetrics] = {}
+        self._closing = set()  # close tasks of clients left behind by another loop
+
+    @property
+    def enabled(self) -> bool:
+        return bool(settings.OPENAI_API_KEY)
+
+    def _bind(self):
+        """
+        The client's connection pool and the semaphores belong to one event
+        loop; they are built on first use and rebuilt if called from another
+        loop (e.g. a worker task running its own).
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        if self._client is not None:
+            self._discard(self._client, self._loop, loop)
+        self._loop = loop
+        self._client = AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            max_retries=0,  # retried here, within the deadline
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=settings.LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.LLM_MAX_CONNECTIONS
+                ),
+                timeout=settings.LLM_TIMEOUT_SECONDS
+            )
+        )
+        self._global = asyncio.Semaphore(max(settings.LLM_MAX_CONCURRENCY, 1))
+        self._purposes = {}
+
+    def _discard(self, client: AsyncOpenAI, client_loop, loop):
+        """Close the connection pool of a client built on another loop instead of leaking its sockets"""
+        if client_loop.is_running():
+            # Still serving in another thread
+            asyncio.run_coroutine_threadsafe(self._close_client(client), client_loop)
+            return
+        task = loop.create_task(self._close_client(client))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    @staticmethod
+    async def _close_client(client: AsyncOpenAI):
+        try:
+            await client.close()
+        except Exception as e:
+            logger.warning(f"Error closing LLM client: {e}")
+
+    async def close(self):
+        """
+        Close the connection pool bound to the running loop; call before a
+        loop that used the gateway ends. The next call builds a new one.
+        """
+        client, self._client, self._loop = self._client, None, None
+        if client is not None:
+            await self._close_client(client)
+
+    def _purpose_semaphore(self, purpose: str) -> asyncio.Semaphore:
+        if purpose not in self._purposes:
+            limit = settings.LLM_PURPOSE_CONCURRENCY.get(purpose, settings.LLM_MAX_CONCURRENCY)
+            self._purposes[purpose] = asyncio.Semaphore(max(limit, 1))
+        return self._purposes[purpose]
+
+    def _metrics_for(self, purpose: str) -> PurposeMetrics:
+        return self._metrics.setdefault(purpose, PurposeMetrics())
+
+    @staticmethod
+    def _timeout(purpose: str, timeout: Optional[float]) -> float:
+        return timeout or settings.LLM_PURPOSE_TIMEOUTS.get(purpose, settings.LLM_TIMEOUT_SECONDS)
+
+    @staticmethod
+    def _remaining(purpose: str, deadline: float) -> float:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"LLM {purpose} call exceeded its deadline")
+        return remaining
+
+    @asynccontextmanager
+    async def _slot(self, purpose: str, deadline: float, metrics: PurposeMetrics):
+        """Hold a per-purpose and a global slot, waiting no later than the deadline"""
+        self._bind()
+        queued = time.perf_counter()
+        purpose_semaphore = self._purpose_semaphore(purpose)
+        try:
+            await asyncio.wait_for(purpose_semaphore.acquire(), self._remaining(purpose, deadline))
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"LLM {purpose} call timed out waiting for a slot")
+        try:
+            try:
+                await asyncio.wait_for(self._global.acquire(), self._remaining(purpose, deadline))
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"LLM {purpose} call timed out waiting for a slot")
+            metrics.queue_waits.append(time.perf_counter() - queued)
+            metrics.in_flight += 1
+            try:
+                yield
+            finally:
+                metrics.in_flight -= 1
+                self._global.release()
+        finally:
+            purpose_semaphore.release()
+
+    async def _with_retries(self, purpose: str, deadline: float, metrics: PurposeMetrics, call: Callable):
+        """Run `call(timeout)` until it succeeds, fails permanently or the deadline passes"""
+        attempt = 0
+        while True:
+            remaining = self._remaining(purpose, deadline)
+            try:
+                return await asyncio.wait_for(call(remaining), remaining)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"LLM {purpose} call exceeded its deadline")
+            except Exception as e:
+                if attempt >= settings.LLM_MAX_RETRIES or not _retryable(e):
+                    raise
+                delay = max(random.uniform(0, settings.LLM_RETRY_BACKOFF_SECONDS * 2 ** attempt), _retry_after(e))
+                if time.monotonic() + delay >= deadline:
+                    raise
+                attempt += 1
+                metrics.retries += 1
+                logger.warning(f"LLM {purpose} call failed ({e}); retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def complete(self, purpose: str, messages: List[Dict], timeout: Optional[float] = None, **params):
+        """
+        Chat completion; returns the response object. `params` are passed to
+        chat.completions.create (model defaults to LLM_MODEL).
+        """
+        params.setdefault("model", settings.LLM_MODEL)
+        metrics = self._metrics_for(purpose)
+        metrics.calls += 1
+        started = time.perf_counter()
+        deadline = time.monotonic() + self._timeout(purpose, timeout)
+        try:
+            async with self._slot(purpose, deadline, metrics):
+                response = await self._with_retries(
+                    purpose, deadline, metrics,
+                    lambda remaining: self._client.chat.completions.create(messages=messages, timeout=remaining, **params)
+                )
+        except Exception as e:
+            metrics.failures += 1
+            if isinstance(e, TimeoutError):
+                metrics.timeouts += 1
+            raise
+        metrics.latencies.append(time.perf_counter() - started)
+        metrics.record_usage(response.usage)
+        return response
+
+    async def stream(self, purpose: str, messages: List[Dict], timeout: Optional[float] = None, **params) -> AsyncIterator[str]:
+        """
+        Chat completion streamed as text pieces. The deadline covers getting
+        the stream started (retried like `complete`); after that, each piece
+        must arrive within the purpose's timeout. The slot is held until the
+        stream is finished or abandoned.
+        """
+        params.setdefault("model", settings.LLM_MODEL)
+        metrics = self._metrics_for(purpose)
+        metrics.calls += 1
+        started = time.perf_counter()
+        idle_timeout = self._timeout(purpose, timeout)
+        deadline = time.monotonic() + idle_timeout
+        first_token = True
+        try:
+            async with self._slot(purpose, deadline, metrics):
+                stream = await self._with_retries(
+                    purpose, deadline, metrics,
+                    lambda remaining: self._client.chat.completions.create(
+                        messages=messages,
+                        stream=True,
+                        stream_options={"include_usage": True},
+                        timeout=remaining,
+                        **params
+                    )
+                )
+                try:
+                    chunks = stream.__aiter__()
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(chunks.__anext__(), idle_timeout)
+                        except StopAsyncIteration:
+                            break
+                        except asyncio.TimeoutError:
+                            raise TimeoutError(f"LLM {purpose} stream stalled")
+                        metrics.record_usage(getattr(chunk, "usage", None))
+                        token = chunk.choices[0].delta.content if chunk.choices else None
+                        if token:
+                            if first_token:
+                                metrics.first_tokens.append(time.perf_counter() - started)
+                                first_token = False
+                            yield token
+                finally:
+                    close = getattr(stream, "close", None)
+                    if close is not None:
+                        await close()
+        except Exception as e:
+            metrics.failures += 1
+            if isinstance(e, TimeoutError):
+                metrics.timeouts += 1
+            raise
+        metrics.latencies.append(time.perf_counter() - started)
+
+    def metrics(self) -> Dict:
+        return {
+            "max_concurrency": settings.LLM_MAX_CONCURRENCY,
+            "purposes": {purpose: metrics.to_dict() for purpose, metrics in self._metrics.items()}
+        }
+
+
+llm_gateway = LLMGateway()
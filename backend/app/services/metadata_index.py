@@ -0,0 +1,72 @@
+"""
+In-memory inverted index from metadata values to row ids.
+"""
+from typing import List, Dict, Any, Iterable
+import numpy as np
+
+
+class MetadataIndex:
+    def __init__(self, keys: List[str]):
+        self.keys = list(keys)
+        # key -> value -> ascending row ids
+        self._postings: Dict[str, Dict[Any, List[int]]] = {key: {} for key in self.keys}
+
+    def add(self, rows: Iterable[int], metadata: List[Dict]):
+        """Index newly appended rows; rows must be larger than any indexed so far"""
+        for row, meta in zip(rows, metadata):
+            for key in self.keys:
+                if key not in meta:
+                    continue
+                value = meta[key]
+                try:
+                    self._postings[key].setdefault(value, []).append(int(row))
+                except TypeError:
+                    # Unhashable values (lists, dicts) are not indexed
+                    continue
+
+    def add_segment(self, start: int, segment):
+        """Index a whole columnar segment whose first row is `start`"""
+        for key in self.keys:
+            for value, rows in segment.column_groups(key):
+                try:
+                    self._postings[key].setdefault(value, []).extend((rows + start).tolist())
+                except TypeError:
+                    continue
+
+    def rows(self, key: str, values: Iterable[Any]) -> np.ndarray:
+        """Ascending row ids whose `key` equals any of `values`"""
+        postings = self._postings[key]
+        # A concurrent remove() may drop a value at any point, so look each one up once
+        parts = [part for part in (postings.get(value) for value in values) if part is not None]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        if len(parts) == 1:
+            return np.asarray(parts[0], dtype=np.int64)
+        return np.unique(np.concatenate(parts)).astype(np.int64)
+
+    def values(self, key: str) -> List[Any]:
+        """Distinct indexed values of a key"""
+        return list(self._postings[key].keys())
+
+    def count(self, key: str, value: Any) -> int:
+        return len(self._postings[key].get(value, ()))
+
+    def remove(self, rows: Iterable[int], metadata: List[Dict]):
+        """Drop rows (e.g. deleted chunks) from the postings of their values"""
+        removed: Dict[str, Dict[Any, set]] = {key: {} for key in self.keys}
+        for row, meta in zip(rows, metadata):
+            for key in self.keys:
+                if key not in meta:
+                    continue
+                try:
+                    removed[key].setdefault(meta[key], set()).add(int(row))
+                except TypeError:
+                    continue
+        for key, by_value in removed.items():
+            postings = self._postings[key]
+            for value, dead in by_value.items():
+                remaining = [row for row in postings.get(value, []) if row not in dead]
+                if remaining:
+                    postings[value] = remaining
+                else:
+                    postings.pop(value, None)
@@ -1,6 +1,6 @@
-from openai import AsyncOpenAI
 from app.config import settings
-from app.services.rag_engine import rag_engine
+from app.services.llm_gateway import llm_gateway
+from app.services.retrieval import retrieval_service
 from typing import List, Dict
 import logging
 import json
@@ -8,12 +8,9 @@ import json
 logger = logging.getLogger(__name__)
 
 class NextAgent:
-    def __init__(self):
-        self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY) if settings.OPENAI_API_KEY else None
-    
     async def expand_topics(self, predicted_question: str) -> List[str]:
         """Expand predicted question into topic clusters"""
-        if not self.client:
+        if not llm_gateway.enabled:
             return self._extract_keywords(predicted_question)
         
         try:
@@ -26,8 +23,8 @@ Return a JSON object with a "topics" field containing an array of topic strings:
 
 Only return the JSON object, no additional text."""
 
-            response = await self.client.chat.completions.create(
-                model=settings.LLM_MODEL,
+            response = await llm_gateway.complete(
+                "topics",
                 messages=[
                     {"role": "system", "content": "You are an expert at extracting and expanding topics from questions. Always respond with valid JSON only."},
                     {"role": "user", "content": prompt}
@@ -47,16 +44,17 @@ Only return the JSON object, no additional text."""
     async def plan_rag_documents(self, predicted_question: str, topics: List[str]) -> List[str]:
         """Determine which documents to preload for RAG"""
         try:
-            # Search RAG engine for relevant documents
+            # Search RAG engine for the question plus each topic in one batch
             search_query = f"{predicted_question} {' '.join(topics)}"
-            results = rag_engine.search(search_query, k=settings.RAG_TOP_K)
+            batch_results = await retrieval_service.search_many([search_query, *topics], k=settings.RAG_TOP_K)
             
             # Extract document names from metadata
             doc_names = []
-            for result in results:
-                doc_name = result.get("metadata", {}).get("name", "")
-                if doc_name:
-                    doc_names.append(doc_name)
+            for results in batch_results:
+                for result in results:
+                    doc_name = result.get("metadata", {}).get("name", "")
+                    if doc_name and doc_name not in doc_names:
+                        doc_names.append(doc_name)
             
             return doc_names
             
@@ -0,0 +1,167 @@
+"""
+ONNX Runtime backend for EmbeddingService.
+
+`export_onnx_model` converts the transformer of a SentenceTransformer model
+to ONNX once (optionally with int8 dynamic quantization) and records its
+tokenizer and pooling setup. `OnnxEncoder` then runs it with onnxruntime and
+the `tokenizers` library only, without importing torch, and reproduces the
+SentenceTransformer pooling and normalization so its vectors can be searched
+against an index built with the torch model.
+"""
+import json
+import os
+from typing import List, Dict
+import numpy as np
+from app.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+CONFIG_FILE = "onnx_config.json"
+POOLING_MODES = ("mean", "cls", "max")
+
+
+def model_dir(model_name: str) -> str:
+    return os.path.join(settings.EMBEDDING_ONNX_PATH, model_name.replace("/", "_"))
+
+
+def model_file(quantize: bool) -> str:
+    return "model.int8.onnx" if quantize else "model.onnx"
+
+
+def export_onnx_model(model_name: str, output_dir: str, quantize: bool = True) -> Dict:
+    """Export `model_name` to `output_dir`; needs torch, sentence-transformers and onnx"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Transformer, Pooling, Normalize
+
+    model = SentenceTransformer(model_name, device="cpu")
+    modules = list(model)
+    if not isinstance(modules[0], Transformer) or not all(isinstance(m, (Pooling, Normalize)) for m in modules[1:]):
+        raise ValueError(f"{model_name}: only Transformer + Pooling (+ Normalize) models can be exported to ONNX")
+    pooling = next(m for m in modules if isinstance(m, Pooling)).get_pooling_mode_str()
+    if pooling not in POOLING_MODES:
+        raise ValueError(f"{model_name}: unsupported pooling mode {pooling}. Expected one of {POOLING_MODES}")
+
+    transformer = modules[0].auto_model.eval()
+    tokenizer = modules[0].tokenizer
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer.save_pretrained(output_dir)
+
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+
+    class TokenEmbeddings(torch.nn.Module):
+        def forward(self, *inputs):
+            return transformer(**dict(zip(input_names, inputs))).last_hidden_state
+
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in [*input_names, "token_embeddings"]}
+    fp32_path = os.path.join(output_dir, model_file(False))
+    logger.info(f"Exporting {model_name} to {fp32_path}")
+    with torch.no_grad():
+        torch.onnx.export(
+            TokenEmbeddings(),
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["token_embeddings"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14
+        )
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        logger.info(f"Quantizing {model_name} to int8")
+        quantize_dynamic(fp32_path, os.path.join(output_dir, model_file(True)), weight_type=QuantType.QInt8)
+
+    config = {
+        "model": model_name,
+        "inputs": input_names,
+        "pooling": pooling,
+        "normalize": any(isinstance(m, Normalize) for m in modules),
+        "max_seq_length": model.max_seq_length,
+        "dimension": model.get_sentence_embedding_dimension(),
+        "pad_token": tokenizer.pad_token,
+        "pad_token_id": tokenizer.pad_token_id
+    }
+    with open(os.path.join(output_dir, CONFIG_FILE), "w") as f:
+        json.dump(config, f, indent=2)
+    return config
+
+
+class OnnxEncoder:
+    """Drop-in for the SentenceTransformer methods EmbeddingService uses"""
+
+    def __init__(self, path: str, quantize: bool = True, threads: int = 0):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(path, CONFIG_FILE), "r") as f:
+            self.config = json.load(f)
+        self._tokenizer = Tokenizer.from_file(os.path.join(path, "tokenizer.json"))
+        self._counter = Tokenizer.from_file(os.path.join(path, "tokenizer.json"))
+        self._counter.no_truncation()
+        self._counter.no_padding()
+        self._tokenizer.enable_truncation(max_length=self.config["max_seq_length"])
+        self._tokenizer.enable_padding(pad_id=self.config["pad_token_id"], pad_token=self.config["pad_token"])
+
+        options = onnxruntime.SessionOptions()
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self._session = onnxruntime.InferenceSession(
+            os.path.join(path, model_file(quantize)), options, providers=["CPUExecutionProvider"]
+        )
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dimension"]
+
+    @property
+    def max_seq_length(self) -> int:
+        return self.config["max_seq_length"]
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        """Word-piece count of each text, without special tokens or truncation"""
+        if not texts:
+            return []
+        encodings = self._counter.encode_batch(texts, add_special_tokens=False)
+        return [len(encoding.ids) for encoding in encodings]
+
+    def encode(self, texts: list[str] | str, batch_size: int = 32, convert_to_numpy: bool = True, **kwargs) -> np.ndarray:
+        if isinstance(texts, str):
+            texts = [texts]
+        output = np.empty((len(texts), self.config["dimension"]), dtype=np.float32)
+        # Batch texts of similar length together to keep padding short, as SentenceTransformer does
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        for start in range(0, len(texts), batch_size):
+            rows = order[start:start + batch_size]
+            output[rows] = self._encode_batch([texts[i] for i in rows])
+        return output
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self._tokenizer.encode_batch(texts)
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64)
+        }
+        token_embeddings = self._session.run(None, {name: inputs[name] for name in self.config["inputs"]})[0]
+        mask = inputs["attention_mask"][..., np.newaxis].astype(np.float32)
+
+        pooling = self.config["pooling"]
+        if pooling == "cls":
+            pooled = token_embeddings[:, 0]
+        elif pooling == "max":
+            pooled = np.where(mask > 0, token_embeddings, -1e9).max(axis=1)
+        else:
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+        if self.config["normalize"]:
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype(np.float32)
+
+
+def load_onnx_encoder(model_name: str, quantize: bool = True, threads: int = 0) -> OnnxEncoder:
+    """Load the exported model, exporting it first if this is the first run"""
+    path = model_dir(model_name)
+    if not os.path.exists(os.path.join(path, CONFIG_FILE)) or not os.path.exists(os.path.join(path, model_file(quantize))):
+        export_onnx_model(model_name, path, quantize)
+    return OnnxEncoder(path, quantize, threads)
@@ -1,6 +1,6 @@
-from openai import AsyncOpenAI
 from app.config import settings
-from app.services.rag_engine import rag_engine
+from app.services.llm_gateway import llm_gateway
+from app.services.retrieval import retrieval_service
 from typing import List, Dict, Optional
 import logging
 import uuid
@@ -8,9 +8,6 @@ import uuid
 logger = logging.getLogger(__name__)
 
 class PrecomputeAgent:
-    def __init__(self):
-        self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY) if settings.OPENAI_API_KEY else None
-    
     async def precompute_answer(
         self,
         predicted_question: str,
@@ -35,7 +32,7 @@ class PrecomputeAgent:
             
             if rag_docs:
                 # Get documents by name
-                docs = rag_engine.get_documents_by_names(rag_docs)
+                docs = await retrieval_service.get_documents_by_names(rag_docs)
                 for doc in docs[:3]:  # Limit to top 3 docs
                     rag_context += f"\n\n{doc.get('text', '')[:1000]}"  # Limit context length
                     doc_name = doc.get("metadata", {}).get("name", "")
@@ -44,14 +41,14 @@ class PrecomputeAgent:
             
             # If no specific docs, search by question
             if not rag_context:
-                search_results = rag_engine.search(predicted_question, k=3)
+                search_results = await retrieval_service.search(predicted_question, k=3)
                 for result in search_results:
                     rag_context += f"\n\n{result.get('text', '')[:1000]}"
                     doc_name = result.get("metadata", {}).get("name", "")
                     if doc_name:
                         context_docs.append(doc_name)
             
-            if not self.client:
+            if not llm_gateway.enabled:
                 return {
                     "ready_answer": f"Based on the context about {', '.join(topics[:2])}, here's a comprehensive answer...",
                     "tokens": 100,
@@ -69,8 +66,8 @@ Relevant Context:
 
 Generate a comprehensive answer to this question."""
 
-            response = await self.client.chat.completions.create(
-                model=settings.LLM_MODEL,
+            response = await llm_gateway.complete(
+                "precompute",
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt}
@@ -0,0 +1,178 @@
+"""
+Precomputed answers indexed per session by the embedding of the predicted
+question they answer. Every sufficiently confident prediction (up to
+PRECOMPUTE_MAX_CANDIDATES, not only the top one) gets an answer generated
+ahead of time and stored in `precomputed_answers` with its question vector.
+A chat message is embedded once and compared by cosine similarity with all
+of the session's live candidates; the best one is served when it clears
+PRECOMPUTE_MATCH_THRESHOLD, which scripts/calibrate_precompute_threshold.py
+picks from labelled question pairs for the configured embedding model.
+"""
+import asyncio
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from app.config import settings
+from app.services.next_agent import next_agent
+from app.services.precompute_agent import precompute_agent
+from app.services.retrieval import retrieval_service
+from app.services.cache import CacheManager
+import logging
+
+logger = logging.getLogger(__name__)
+
+SCORE_WINDOW = 1000  # recent best-match scores kept for the metrics
+
+
+def unit_rows(vectors: np.ndarray) -> np.ndarray:
+    """Rows scaled to unit length, so dot products are cosine similarities"""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class PrecomputedAnswerIndex:
+    def __init__(self):
+        self._lookups = 0
+        self._hits = 0
+        self._scores = deque(maxlen=SCORE_WINDOW)
+
+    @staticmethod
+    async def ensure_indexes(db):
+        await db.precomputed_answers.create_index([("session_id", 1), ("created_at", -1)])
+        await db.precomputed_answers.create_index("answer_id", unique=True)
+        # Answers expire with their Redis copy
+        await db.precomputed_answers.create_index("created_at", expireAfterSeconds=settings.PRECOMPUTE_ANSWER_TTL_SECONDS)
+
+    async def add(self, db, session_id: str, question: str, answer: str, confidence: float,
+                  context_used: List[str]) -> str:
+        """Store an answer for a predicted question and index it by the question's embedding"""
+        answer_id = f"pre_{uuid.uuid4().hex[:8]}"
+        embedding = unit_rows(await retrieval_service.encode([question]))[0]
+        await CacheManager.set_precomputed_answer(
+            answer_id,
+            {"answer": answer, "question": question, "context_used": context_used},
+            ttl=settings.PRECOMPUTE_ANSWER_TTL_SECONDS
+        )
+        await db.precomputed_answers.insert_one({
+            "answer_id": answer_id,
+            "session_id": session_id,
+            "question": question,
+            "answer": answer,
+            "confidence": confidence,
+            "context_used": context_used,
+            "embedding": embedding.tolist(),
+            "created_at": datetime.utcnow()
+        })
+        return answer_id
+
+    async def match(self, db, session_id: str, message: str) -> Optional[Dict]:
+        """
+        The session's precomputed answer whose question is closest to
+        `message`, or None when none is within the threshold
+        """
+        candidates = await db.precomputed_answers.find(
+            {"session_id": session_id},
+            {"answer_id": 1, "answer": 1, "embedding": 1}
+        ).sort("created_at", -1).limit(settings.PRECOMPUTE_MATCH_CANDIDATES).to_list(length=settings.PRECOMPUTE_MATCH_CANDIDATES)
+        if not candidates:
+            return None
+
+        query = unit_rows(await retrieval_service.encode_query(message))[0]
+        scores = unit_rows([candidate["embedding"] for candidate in candidates]) @ query
+        best = int(np.argmax(scores))
+        score = float(scores[best])
+        self._lookups += 1
+        self._scores.append(score)
+        if score < settings.PRECOMPUTE_MATCH_THRESHOLD:
+            return None
+        self._hits += 1
+        return {
+            "answer": candidates[best]["answer"],
+            "precomputed_answer_id": candidates[best]["answer_id"],
+            "similarity": score
+        }
+
+    @staticmethod
+    async def get(db, answer_id: str) -> Optional[Dict]:
+        return await db.precomputed_answers.find_one({"answer_id": answer_id}, {"_id": 0, "embedding": 0})
+
+    def metrics(self) -> Dict:
+        scores = self._scores
+        return {
+            "threshold": settings.PRECOMPUTE_MATCH_THRESHOLD,
+            "lookups": self._lookups,
+            "hits": self._hits,
+            "hit_rate": round(self._hits / self._lookups, 3) if self._lookups else 0.0,
+            "best_score_p50": round(float(np.percentile(scores, 50)), 3) if scores else 0.0,
+            "best_score_p90": round(float(np.percentile(scores, 90)), 3) if scores else 0.0
+        }
+
+
+precomputed_answers = PrecomputedAnswerIndex()
+
+
+def precompute_candidates(prediction_result: Dict) -> List[Dict]:
+    """
+    The predicted questions (from the intent predictor's result) worth
+    answering ahead of time: confident enough, top one first, at most
+    PRECOMPUTE_MAX_CANDIDATES distinct questions
+    """
+    top = {"question": prediction_result["predicted_question"], "confidence": prediction_result["confidence"]}
+    candidates = {}
+    for prediction in [top] + list(prediction_result.get("predictions", [])):
+        question = prediction.get("question") or ""
+        if not question.strip():
+            continue
+        confidence = max(prediction.get("confidence", 0.0), candidates.get(question, {}).get("confidence", 0.0))
+        candidates[question] = {"question": question, "confidence": confidence}
+    confident = [c for c in candidates.values() if c["confidence"] >= settings.PREDICTION_CONFIDENCE_THRESHOLD]
+    return confident[:max(settings.PRECOMPUTE_MAX_CANDIDATES, 1)]
+
+
+async def precompute_prediction(db, session_id: str, question: str, confidence: float,
+                                topics: Optional[List[str]] = None,
+                                rag_docs: Optional[List[str]] = None) -> Optional[Dict]:
+    """
+    Generate and index the answer to one predicted question, expanding its
+    topics and planning its documents unless given. Returns the stored
+    answer (with its `answer_id`), or None when nothing was precomputed.
+    """
+    try:
+        if topics is None:
+            topics = await next_agent.expand_topics(question)
+        if rag_docs is None:
+            rag_docs = await next_agent.plan_rag_documents(question, topics)
+        precomputed = await precompute_agent.precompute_answer(question, topics, rag_docs)
+        if not precomputed.get("ready_answer"):
+            return None
+        answer_id = await precomputed_answers.add(
+            db, session_id, question, precomputed["ready_answer"], confidence, precomputed["context_used"]
+        )
+    except Exception as e:
+        logger.error(f"Precomputing an answer for session {session_id} failed: {e}")
+        return None
+    return {
+        "answer_id": answer_id,
+        "question": question,
+        "confidence": confidence,
+        "topics": topics,
+        "rag_docs": rag_docs,
+        "answer": precomputed["ready_answer"]
+    }
+
+
+async def precompute_predictions(db, session_id: str, candidates: List[Dict],
+                                 planned: Optional[Dict[str, Tuple[List[str], List[str]]]] = None) -> List[Optional[Dict]]:
+    """
+    Precompute every candidate concurrently (the LLM gateway bounds the
+    calls). `planned` maps questions whose topics and documents are already
+    known to (topics, rag_docs).
+    """
+    planned = planned or {}
+    return list(await asyncio.gather(*[
+        precompute_prediction(db, session_id, candidate["question"], candidate["confidence"], *planned.get(candidate["question"], (None, None)))
+        for candidate in candidates
+    ]))
@@ -2,112 +2,919 @@ import faiss
 import numpy as np
 import os
 import pickle
-from typing import List, Dict, Tuple
-from app.services.embeddings import embedding_service
+import threading
+from typing import List, Dict, Tuple, Optional, Any, Callable
+from app.services import vector_index
+from app.services.segment_store import SegmentStore, StoreView
+from app.services.metadata_index import MetadataIndex
+from app.services.lexical_index import LexicalIndex, looks_like_keyword_query
+from app.services.helper_processes import is_helper_process
 from app.config import settings
 import logging
 
 logger = logging.getLogger(__name__)
 
+SEARCH_MODES = ("vector", "lexical", "hybrid")
+
+def embedding_service():
+    """
+    The embedding model, imported on first use: shard processes only receive
+    precomputed vectors and never load it.
+    """
+    from app.services.embeddings import embedding_service
+    return embedding_service
+
+def check_search_mode(mode: Optional[str]) -> str:
+    mode = mode or settings.RAG_SEARCH_MODE
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown RAG search mode: {mode}")
+    return mode
+
+def prepare_documents(texts: List[str], metadata: List[Dict] = None) -> Tuple[np.ndarray, List[Dict]]:
+    """Embed texts and pair them with their metadata"""
+    if metadata is None:
+        metadata = [{}] * len(texts)
+    
+    embeddings = embedding_service().encode_bulk(texts).astype('float32')
+    documents = [
+        {
+            "text": text,
+            "metadata": metadata[i] if i < len(metadata) else {}
+        }
+        for i, text in enumerate(texts)
+    ]
+    return embeddings, documents
+
+def encode_queries(queries: List[str], single: bool) -> np.ndarray:
+    if single:
+        return embedding_service().encode_query(queries[0])
+    return embedding_service().encode(queries)
+
+def fuse_rankings(rankings: List[List[Dict]], k: int) -> List[Dict]:
+    """Reciprocal rank fusion of several ranked result lists, keyed by chunk id"""
+    fused: Dict[int, Dict] = {}
+    for results in rankings:
+        for rank, result in enumerate(results):
+            entry = fused.get(result["chunk_id"])
+            if entry is None:
+                entry = fused[result["chunk_id"]] = {**result, "score": 0.0}
+            else:
+                entry.update({key: value for key, value in result.items() if key not in entry})
+            entry["score"] += 1.0 / (settings.RAG_RRF_K + rank + 1)
+    return sorted(fused.values(), key=lambda result: result["score"], reverse=True)[:k]
+
+def run_search(
+    queries: List[str],
+    k: int,
+    mode: str,
+    lexical_search: Callable[[List[str], int], List[List[Dict]]],
+    vector_search: Callable[[List[str], int], List[List[Dict]]]
+) -> List[List[Dict]]:
+    """
+    The vector / lexical / hybrid flow, given `lexical_search(queries, depth)`
+    and `vector_search(queries, depth)` for the two rankings.
+    """
+    if mode == "vector":
+        return vector_search(queries, k)
+    
+    depth = max(k, settings.RAG_HYBRID_CANDIDATES)
+    lexical = lexical_search(queries, depth)
+    if mode == "lexical":
+        return [results[:k] for results in lexical]
+    
+    # Keyword lookups with lexical hits skip the embedding model entirely
+    all_results: List[Optional[List[Dict]]] = [
+        results[:k] if results and looks_like_keyword_query(query, settings.RAG_KEYWORD_MAX_TERMS) else None
+        for query, results in zip(queries, lexical)
+    ]
+    pending = [i for i, results in enumerate(all_results) if results is None]
+    if pending:
+        vector = vector_search([queries[i] for i in pending], depth)
+        for i, results in zip(pending, vector):
+            all_results[i] = fuse_rankings([results, lexical[i]], k)
+    return all_results
+
+class IndexSnapshot:
+    """
+    Everything a search reads, published as one unit. Writers build a new
+    snapshot and swap the reference, so readers never take a lock and never
+    see a half-applied change.
+    """
+    def __init__(
+        self,
+        index: faiss.Index,
+        view: StoreView,
+        deleted_rows: np.ndarray,
+        metadata_index: MetadataIndex,
+        lexical_index: Optional[LexicalIndex]
+    ):
+        self.index = index  # covers rows [0, index.ntotal); never mutated once published
+        self.view = view
+        self.deleted_rows = deleted_rows
+        # Shared with later snapshots: appended rows stay invisible (>= view.total)
+        # and removals happen only after the snapshot excluding them is published
+        self.metadata_index = metadata_index
+        self.lexical_index = lexical_index  # None until the first lexical or hybrid search builds it
+        # Rows written since the index was last extended are searched exactly
+        self.tail_vectors = view.read_vectors(index.ntotal)
+    
+    @property
+    def indexed(self) -> int:
+        return self.index.ntotal
+    
+    @property
+    def live_total(self) -> int:
+        return self.view.total - len(self.deleted_rows)
+
 class RAGEngine:
     def __init__(self):
-        self.index = None
-        self.documents: List[Dict] = []
         self.dimension = 384  # all-MiniLM-L6-v2 dimension
+        self.store = SegmentStore(settings.VECTOR_STORE_PATH, self.dimension)
+        self._snapshot: Optional[IndexSnapshot] = None
+        self._lock = threading.RLock()  # serializes writers; searches never take it
+        self._checkpoint_lock = threading.Lock()
+        self._lexical_lock = threading.Lock()  # one BM25 build at a time; purges wait for it
+        self._rebuild_thread: Optional[threading.Thread] = None
+        self._compact_thread: Optional[threading.Thread] = None
         self._load_or_create_index()
+        self._maybe_schedule_rebuild()
+        if settings.RAG_SEARCH_MODE != "vector":
+            threading.Thread(target=self._build_lexical_in_background, name="rag-lexical-index", daemon=True).start()
+    
+    @property
+    def index(self) -> faiss.Index:
+        return self._snapshot.index
+    
+    def snapshot(self) -> IndexSnapshot:
+        """The current read snapshot"""
+        return self._snapshot
+    
+    def _publish(
+        self,
+        index: Optional[faiss.Index] = None,
+        metadata_index: Optional[MetadataIndex] = None,
+        lexical_index: Optional[LexicalIndex] = None
+    ):
+        """Swap in a snapshot of the current store state; caller holds the lock"""
+        current = self._snapshot
+        view = self.store.view
+        self._snapshot = IndexSnapshot(
+            index if index is not None else current.index,
+            view,
+            self.store.deleted_rows(view),
+            metadata_index or current.metadata_index,
+            lexical_index or current.lexical_index
+        )
     
     def _load_or_create_index(self):
-        """Load existing FAISS index or create new one"""
-        index_path = os.path.join(settings.VECTOR_STORE_PATH, "faiss.index")
-        docs_path = os.path.join(settings.VECTOR_STORE_PATH, "documents.pkl")
-        
+        """Load the segmented store, replaying its write-ahead log, or create a new one"""
         os.makedirs(settings.VECTOR_STORE_PATH, exist_ok=True)
         
-        if os.path.exists(index_path) and os.path.exists(docs_path):
-            try:
-                self.index = faiss.read_index(index_path)
-                with open(docs_path, "rb") as f:
-                    self.documents = pickle.load(f)
-                logger.info(f"Loaded FAISS index with {len(self.documents)} documents")
-            except Exception as e:
-                logger.error(f"Error loading index: {e}")
-                self._create_new_index()
-        else:
-            self._create_new_index()
-    
-    def _create_new_index(self):
-        """Create a new FAISS index"""
-        self.index = faiss.IndexFlatL2(self.dimension)
-        self.documents = []
-        logger.info("Created new FAISS index")
-    
-    def add_documents(self, texts: List[str], metadata: List[Dict] = None):
-        """Add documents to the vector store"""
-        if metadata is None:
-            metadata = [{}] * len(texts)
+        if not self.store.exists():
+            self._migrate_legacy_index()
         
-        embeddings = embedding_service.encode(texts)
-        self.index.add(embeddings.astype('float32'))
+        # Documents stay on disk (mmap) and are materialized per hit
+        self.store.recover()
         
-        for i, text in enumerate(texts):
-            self.documents.append({
-                "text": text,
-                "metadata": metadata[i] if i < len(metadata) else {}
-            })
+        index, indexed = None, 0
+        try:
+            index, indexed = self.store.load_index_checkpoint()
+        except Exception as e:
+            logger.error(f"Error loading index checkpoint, rebuilding from segments: {e}")
+            index = None
+        if index is None:
+            index = self._create_new_index()
+            indexed = 0
         
-        self._save_index()
-        logger.info(f"Added {len(texts)} documents to vector store")
+        # Rows written after the last checkpoint only exist in the segments
+        tail = self.store.read_vectors(indexed)
+        if len(tail):
+            index.add(tail)
+        with self._lock:
+            view = self.store.view
+            deleted = self.store.deleted_rows(view)
+            self._snapshot = IndexSnapshot(
+                index,
+                view,
+                deleted,
+                self._build_metadata_index(view, deleted),
+                None
+            )
+        logger.info(f"Loaded FAISS index with {self.store.live_total} documents "
+                    f"({len(tail)} replayed from segments)")
     
-    def search(self, query: str, k: int = None) -> List[Dict]:
-        """Search for similar documents"""
-        if k is None:
-            k = settings.RAG_TOP_K
+    def _migrate_legacy_index(self):
+        """Import a faiss.index + documents.pkl store as the first segment"""
+        index_path = os.path.join(settings.VECTOR_STORE_PATH, "faiss.index")
+        docs_path = os.path.join(settings.VECTOR_STORE_PATH, "documents.pkl")
+        if not (os.path.exists(index_path) and os.path.exists(docs_path)):
+            return
         
-        if self.index.ntotal == 0:
+        try:
+            legacy_index = faiss.read_index(index_path)
+            with open(docs_path, "rb") as f:
+                documents = pickle.load(f)
+            vectors = vector_index.reconstruct(legacy_index, 0, legacy_index.ntotal)
+            self.store.append(vectors, documents)
+            self.store.checkpoint_index(legacy_index)
+            logger.info(f"Migrated {len(documents)} documents from faiss.index/documents.pkl "
+                        f"to segmented store, the old files can be removed")
+        except Exception as e:
+            logger.error(f"Error migrating legacy index: {e}")
+    
+    def _create_new_index(self) -> faiss.Index:
+        """Create a new FAISS index"""
+        index_type = settings.RAG_INDEX_TYPE
+        # Trained indexes start out flat until there is enough data to train on
+        if index_type in vector_index.TRAINED_INDEX_TYPES:
+            index_type = "flat"
+        logger.info(f"Created new FAISS index ({index_type})")
+        return vector_index.create_index(index_type, self.dimension)
+    
+    def _build_metadata_index(self, view: StoreView, deleted: np.ndarray) -> MetadataIndex:
+        """Index the metadata of every row of `view` except the `deleted` ones"""
+        metadata_index = MetadataIndex(settings.RAG_METADATA_INDEX_KEYS)
+        for start, segment in view.iter_segments():
+            metadata_index.add_segment(start, segment)
+        if len(deleted):
+            metadata_index.remove(deleted, [doc["metadata"] for doc in view.get_documents(deleted)])
+        return metadata_index
+    
+    def _build_lexical_index(self, view: StoreView, deleted: np.ndarray) -> LexicalIndex:
+        """Index the text of every row of `view` except the `deleted` ones"""
+        lexical_index = LexicalIndex(settings.RAG_BM25_K1, settings.RAG_BM25_B)
+        deleted = set(deleted.tolist())
+        for start, segment in view.iter_segments():
+            rows = [start + row for row in range(len(segment)) if start + row not in deleted]
+            lexical_index.add(rows, [segment.text(row - start) for row in rows])
+        return lexical_index
+    
+    def _ensure_lexical_index(self):
+        """
+        Build the BM25 index on first use, so vector-only deployments never
+        tokenize the corpus and startup does not wait for it
+        """
+        if self._snapshot.lexical_index is not None:
+            return
+        with self._lexical_lock:
+            snapshot = self._snapshot
+            if snapshot.lexical_index is not None:
+                return
+            deleted = self.store.deleted_rows(snapshot.view, staged=False)
+            lexical_index = self._build_lexical_index(snapshot.view, deleted)
+            with self._lock:
+                self._catch_up(snapshot.view, deleted, lexical_index=lexical_index)
+                self._publish(lexical_index=lexical_index)
+        logger.info(f"Built BM25 index over {len(lexical_index)} chunks")
+    
+    def _build_lexical_in_background(self):
+        try:
+            self._ensure_lexical_index()
+        except Exception as e:
+            logger.error(f"Error building BM25 index: {e}")
+    
+    def _append(
+        self,
+        embeddings: np.ndarray,
+        documents: List[Dict],
+        ids: Optional[List[int]] = None,
+        staged: bool = False
+    ) -> List[int]:
+        """Append a prepared batch; caller holds the lock and publishes afterwards"""
+        # Only the new batch is written; the FAISS index is extended in the background
+        snapshot = self._snapshot
+        start = self.store.total
+        ids = self.store.append(embeddings, documents, ids, staged)
+        rows = range(start, start + len(documents))
+        snapshot.metadata_index.add(rows, [doc["metadata"] for doc in documents])
+        if snapshot.lexical_index is not None:
+            snapshot.lexical_index.add(rows, [doc["text"] for doc in documents])
+        return ids.tolist()
+    
+    def add_documents(self, texts: List[str], metadata: List[Dict] = None) -> List[int]:
+        """Add documents to the vector store and return their chunk ids"""
+        if not texts:
             return []
+        return self.add_embeddings(*prepare_documents(texts, metadata))
+    
+    def add_embeddings(
+        self,
+        embeddings: np.ndarray,
+        documents: List[Dict],
+        ids: Optional[List[int]] = None,
+        staged: bool = False
+    ) -> List[int]:
+        """
+        Add already embedded documents; `ids` assigns chunk ids (ascending, unused).
+        `staged` chunks stay out of searches until `publish_chunks`.
+        """
+        if not documents:
+            return []
+        with self._lock:
+            ids = self._append(embeddings, documents, ids, staged)
+            self._publish()
+        logger.info(f"{'Staged' if staged else 'Added'} {len(documents)} documents to vector store")
+        self._after_write()
+        return ids
+    
+    def publish_chunks(self, chunk_ids: List[int], retired_ids: List[int]) -> int:
+        """
+        Make staged chunks searchable and tombstone `retired_ids` in one snapshot
+        swap, so searches see either the old or the new version of a document,
+        never both or neither. Returns the number of chunks retired.
+        """
+        with self._lock:
+            snapshot = self._snapshot
+            rows = np.setdiff1d(snapshot.view.rows_for_ids(retired_ids), snapshot.deleted_rows)
+            documents = snapshot.view.get_documents(rows)
+            self.store.publish(chunk_ids, snapshot.view.ids_for_rows(rows))
+            self._publish()
+            self._retire(rows, documents)
+        logger.info(f"Published {len(chunk_ids)} staged chunks, retired {len(rows)}")
+        self._after_write()
+        return len(rows)
+    
+    def discard_staged(self, chunk_ids: List[int]) -> int:
+        """Drop staged chunks that will not be published; compaction reclaims them"""
+        with self._lock:
+            snapshot = self._snapshot
+            rows = snapshot.view.rows_for_ids(self.store.discard_staged(chunk_ids))
+            self._retire(rows, snapshot.view.get_documents(rows))
+        self._maybe_schedule_compaction()
+        return len(rows)
+    
+    def delete_document(self, name: str) -> int:
+        """Tombstone every chunk of a document; returns the number of chunks removed"""
+        with self._lock:
+            retired = self._delete_rows(self._rows_for(self._snapshot, "name", [name]))
+            self._publish()
+            self._retire(*retired)
+        removed = len(retired[0])
+        if removed:
+            logger.info(f"Deleted document {name} ({removed} chunks)")
+            self._maybe_schedule_compaction()
+        return removed
+    
+    def delete_chunks(self, chunk_ids: List[int]) -> int:
+        """Tombstone chunks by id; returns the number of chunks removed"""
+        with self._lock:
+            retired = self._delete_rows(self._snapshot.view.rows_for_ids(chunk_ids))
+            self._publish()
+            self._retire(*retired)
+        if len(retired[0]):
+            self._maybe_schedule_compaction()
+        return len(retired[0])
+    
+    def _delete_rows(self, rows: np.ndarray) -> Tuple[np.ndarray, List[Dict]]:
+        """Tombstone rows; the next published snapshot excludes them. Caller holds the lock"""
+        snapshot = self._snapshot
+        rows = np.setdiff1d(rows, snapshot.deleted_rows)
+        if not len(rows):
+            return rows, []
+        self.store.delete(snapshot.view.ids_for_rows(rows))
+        return rows, snapshot.view.get_documents(rows)
+    
+    def _retire(self, rows: np.ndarray, documents: List[Dict]):
+        """Drop published deletions from the shared metadata and lexical indexes"""
+        if not len(rows):
+            return
+        snapshot = self._snapshot
+        snapshot.metadata_index.remove(rows, [doc["metadata"] for doc in documents])
+        if snapshot.lexical_index is not None:
+            snapshot.lexical_index.remove(rows, [doc["text"] for doc in documents])
+    
+    def _after_write(self):
+        self._maybe_schedule_rebuild()
+        self._maybe_schedule_fold()
+        self._maybe_schedule_compaction()
+    
+    def search(
+        self,
+        query: str,
+        k: int = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        mode: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Search for similar documents.
+        `nprobe` (IVF) and `ef_search` (HNSW) trade recall for latency per query.
+        `filters` maps metadata keys to a value or list of values, e.g.
+        {"name": ["a.md", "b.md"], "type": "text/markdown"}; keys are ANDed.
+        `mode` is "vector", "lexical" (BM25) or "hybrid" (both, fused by reciprocal rank).
+        """
+        return self._search([query], k, nprobe, ef_search, filters, mode, single=True)[0]
+    
+    def search_many(
+        self,
+        queries: List[str],
+        k: int = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        mode: Optional[str] = None
+    ) -> List[List[Dict]]:
+        """Search for several queries with one embedding batch and one index search"""
+        return self._search(queries, k, nprobe, ef_search, filters, mode, single=False)
+    
+    def _search(
+        self,
+        queries: List[str],
+        k: Optional[int],
+        nprobe: Optional[int],
+        ef_search: Optional[int],
+        filters: Optional[Dict[str, Any]],
+        mode: Optional[str],
+        single: bool
+    ) -> List[List[Dict]]:
+        mode = check_search_mode(mode)
+        if not queries:
+            return []
+        if mode != "vector":
+            self._ensure_lexical_index()
+        # One snapshot for the whole query, however many writers publish meanwhile
+        snapshot = self._snapshot
+        if snapshot.live_total == 0:
+            return [[] for _ in queries]
+        if k is None:
+            k = settings.RAG_TOP_K
         
-        query_embedding = embedding_service.encode_query(query)
-        query_embedding = query_embedding.reshape(1, -1).astype('float32')
-        
-        distances, indices = self.index.search(query_embedding, k)
-        
-        results = []
-        for i, idx in enumerate(indices[0]):
-            if idx < len(self.documents):
+        return run_search(
+            queries,
+            k,
+            mode,
+            lambda queries, depth: self._lexical_search(snapshot, queries, depth, filters),
+            lambda queries, depth: self._search_embeddings(
+                encode_queries(queries, single), depth, nprobe, ef_search, filters, snapshot
+            )
+        )
+    
+    def search_vectors(
+        self,
+        query_embeddings: np.ndarray,
+        k: int,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[List[Dict]]:
+        """Vector ranking for already embedded queries"""
+        return self._search_embeddings(query_embeddings, k, nprobe, ef_search, filters)
+    
+    def search_lexical(self, queries: List[str], k: int, filters: Optional[Dict[str, Any]] = None) -> List[List[Dict]]:
+        """BM25 ranking"""
+        self._ensure_lexical_index()
+        return self._lexical_search(self._snapshot, queries, k, filters)
+    
+    def _lexical_search(
+        self,
+        snapshot: IndexSnapshot,
+        queries: List[str],
+        k: int,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[List[Dict]]:
+        """BM25 search over the rows visible in `snapshot`"""
+        view = snapshot.view
+        allowed = self._resolve_filters(snapshot, filters) if filters else None
+        all_results = []
+        for query in queries:
+            rows, scores = snapshot.lexical_index.search(query, k, allowed, snapshot.deleted_rows, view.total)
+            results = []
+            for row, score in zip(rows.tolist(), scores.tolist()):
+                document = view.get_document(row)
                 results.append({
-                    "text": self.documents[idx]["text"],
-                    "metadata": self.documents[idx]["metadata"],
-                    "distance": float(distances[0][i]),
-                    "similarity": 1 - float(distances[0][i])  # Simple similarity
+                    "chunk_id": int(view.ids_for_rows([row])[0]),
+                    "text": document["text"],
+                    "metadata": document["metadata"],
+                    "bm25": score
                 })
+            all_results.append(results)
+        return all_results
+    
+    def _search_embeddings(
+        self,
+        query_embeddings: np.ndarray,
+        k: int = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        snapshot: Optional[IndexSnapshot] = None
+    ) -> List[List[Dict]]:
+        """Run a matrix search and build one result list per query row"""
+        if k is None:
+            k = settings.RAG_TOP_K
+        snapshot = snapshot or self._snapshot
+        indexed = snapshot.indexed
         
-        # Filter by similarity threshold
-        results = [r for r in results if r["similarity"] >= settings.RAG_SIMILARITY_THRESHOLD]
+        query_embeddings = query_embeddings.reshape(-1, self.dimension).astype('float32')
         
-        return results
+        selector = None
+        excluded = None
+        if filters:
+            rows = self._resolve_filters(snapshot, filters)
+            if len(rows) == 0:
+                return [[] for _ in range(len(query_embeddings))]
+            if len(rows) <= settings.RAG_FILTER_EXACT_MAX_ROWS:
+                # Small candidate sets are cheaper to scan exactly than to search the index
+                distances, indices = self._exact_search(
+                    query_embeddings, rows, snapshot.view.get_vectors(rows), k
+                )
+                return self._build_results(snapshot.view, distances, indices)
+            index_rows, tail_rows = rows[rows < indexed], rows[rows >= indexed]
+            selector = faiss.IDSelectorBatch(index_rows)
+        else:
+            deleted = snapshot.deleted_rows
+            tail_rows = np.setdiff1d(np.arange(indexed, snapshot.view.total), deleted, assume_unique=True)
+            index_rows = None
+            deleted = deleted[deleted < indexed]
+            if len(deleted):
+                # Tombstoned chunks stay in the index until compaction purges them
+                excluded = faiss.IDSelectorBatch(deleted)
+                selector = faiss.IDSelectorNot(excluded)
+        
+        hits = []
+        if index_rows is None or len(index_rows):
+            hits.append(self._index_search(snapshot, query_embeddings, k, nprobe, ef_search, selector))
+        if len(tail_rows):
+            hits.append(self._exact_search(
+                query_embeddings, tail_rows, snapshot.tail_vectors[tail_rows - indexed], k
+            ))
+        distances, indices = self._merge_hits(hits, k)
+        return self._build_results(snapshot.view, distances, indices)
+    
+    def _index_search(
+        self,
+        snapshot: IndexSnapshot,
+        query_embeddings: np.ndarray,
+        k: int,
+        nprobe: Optional[int],
+        ef_search: Optional[int],
+        selector: Optional[faiss.IDSelector]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Search the snapshot's FAISS index, re-ranking compressed hits exactly"""
+        index = snapshot.index
+        # Compressed codes only approximate distances; re-rank a wider candidate set exactly
+        rerank = (
+            settings.RAG_RERANK_FACTOR > 1
+            and vector_index.index_type_of(index) in vector_index.LOSSY_INDEX_TYPES
+        )
+        fetch = k * settings.RAG_RERANK_FACTOR if rerank else k
+        params = vector_index.search_params(index, nprobe, ef_search, selector)
+        distances, indices = index.search(query_embeddings, fetch, params=params)
+        if rerank:
+            distances, indices = self._rerank(snapshot.view, query_embeddings, indices, k)
+        return distances, indices
+    
+    @staticmethod
+    def _merge_hits(hits: List[Tuple[np.ndarray, np.ndarray]], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Combine per-source (distances, rows) matrices into the overall top k"""
+        if len(hits) == 1:
+            return hits[0]
+        distances = np.concatenate([hit[0] for hit in hits], axis=1)
+        indices = np.concatenate([hit[1] for hit in hits], axis=1)
+        order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(indices, order, axis=1)
+    
+    @staticmethod
+    def _exact_search(
+        query_embeddings: np.ndarray,
+        rows: np.ndarray,
+        vectors: np.ndarray,
+        k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Brute-force squared L2 search over `vectors`, the stored vectors of `rows`"""
+        distances = np.maximum(
+            (query_embeddings ** 2).sum(axis=1)[:, None]
+            + (vectors ** 2).sum(axis=1)[None, :]
+            - 2 * query_embeddings @ vectors.T,
+            0
+        )
+        k = min(k, len(rows))
+        top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        top_distances = np.take_along_axis(distances, top, axis=1)
+        order = np.argsort(top_distances, axis=1)
+        return np.take_along_axis(top_distances, order, axis=1), rows[np.take_along_axis(top, order, axis=1)]
+    
+    def _rerank(
+        self,
+        view: StoreView,
+        query_embeddings: np.ndarray,
+        indices: np.ndarray,
+        k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact distances from the on-disk float32 vectors for each query's candidates"""
+        distances = np.full((len(indices), k), np.inf, dtype="float32")
+        reranked = np.full((len(indices), k), -1, dtype=np.int64)
+        for row in range(len(indices)):
+            candidates = indices[row][indices[row] >= 0]
+            if not len(candidates):
+                continue
+            top_distances, top_rows = self._exact_search(
+                query_embeddings[row:row + 1], candidates, view.get_vectors(candidates), k
+            )
+            distances[row, :top_rows.shape[1]] = top_distances[0]
+            reranked[row, :top_rows.shape[1]] = top_rows[0]
+        return distances, reranked
+    
+    def _build_results(self, view: StoreView, distances: np.ndarray, indices: np.ndarray) -> List[List[Dict]]:
+        """Materialize hit rows into result dicts, one list per query"""
+        total = view.total
+        all_results = []
+        for row in range(len(indices)):
+            results = []
+            for i, idx in enumerate(indices[row]):
+                if 0 <= idx < total:
+                    document = view.get_document(int(idx))
+                    results.append({
+                        "chunk_id": int(view.ids_for_rows([idx])[0]),
+                        "text": document["text"],
+                        "metadata": document["metadata"],
+                        "distance": float(distances[row][i]),
+                        "similarity": 1 - float(distances[row][i])  # Simple similarity
+                    })
+            
+            # Filter by similarity threshold
+            results = [r for r in results if r["similarity"] >= settings.RAG_SIMILARITY_THRESHOLD]
+            all_results.append(results)
+        
+        return all_results
+    
+    def _resolve_filters(self, snapshot: IndexSnapshot, filters: Dict[str, Any]) -> np.ndarray:
+        """Resolve a filter expression to the ascending live rows of `snapshot` that satisfy it"""
+        rows = None
+        for key, values in filters.items():
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            matched = self._rows_for(snapshot, key, values)
+            rows = matched if rows is None else np.intersect1d(rows, matched, assume_unique=True)
+            if len(rows) == 0:
+                break
+        if rows is None:
+            return np.empty(0, dtype=np.int64)
+        return np.setdiff1d(rows[rows < snapshot.view.total], snapshot.deleted_rows, assume_unique=True)
+    
+    @staticmethod
+    def _rows_for(snapshot: IndexSnapshot, key: str, values: List) -> np.ndarray:
+        """Rows matching one metadata key; may include deleted rows and rows beyond the view"""
+        if key in snapshot.metadata_index.keys:
+            return snapshot.metadata_index.rows(key, values)
+        return snapshot.view.rows_where(key, values)
     
     def get_documents_by_names(self, doc_names: List[str]) -> List[Dict]:
         """Retrieve documents by their names/metadata"""
-        results = []
-        for doc in self.documents:
-            doc_name = doc.get("metadata", {}).get("name", "")
-            if doc_name in doc_names:
-                results.append(doc)
-        return results
-    
-    def _save_index(self):
-        """Save index and documents to disk"""
+        return self.get_documents_by_metadata("name", doc_names)
+    
+    def get_documents_by_metadata(self, key: str, values: List) -> List[Dict]:
+        """Retrieve documents whose metadata `key` equals any of `values`"""
+        snapshot = self._snapshot
+        rows = self._resolve_filters(snapshot, {key: list(values)})
+        return snapshot.view.get_documents(rows)
+    
+    def get_chunk_ids_by_metadata(self, key: str, values: List) -> List[int]:
+        """Chunk ids of the live chunks whose metadata `key` equals any of `values`"""
+        snapshot = self._snapshot
+        rows = self._resolve_filters(snapshot, {key: list(values)})
+        return snapshot.view.ids_for_rows(rows).tolist()
+    
+    def get_chunks_by_metadata(self, key: str, values: List) -> List[Dict]:
+        """Like get_documents_by_metadata, with each chunk's id"""
+        snapshot = self._snapshot
+        rows = self._resolve_filters(snapshot, {key: list(values)})
+        ids = snapshot.view.ids_for_rows(rows)
+        return [
+            {"chunk_id": int(chunk_id), **document}
+            for chunk_id, document in zip(ids, snapshot.view.get_documents(rows))
+        ]
+    
+    def get_vectors_by_ids(self, chunk_ids: List[int]) -> Dict[int, np.ndarray]:
+        """Stored vectors of the given chunks; ids no longer in the store are left out"""
+        view = self._snapshot.view
+        rows = view.rows_for_ids(set(chunk_ids))
+        return {int(chunk_id): vector for chunk_id, vector in zip(view.ids_for_rows(rows), view.get_vectors(rows))}
+    
+    def list_document_names(self) -> List[str]:
+        """Distinct document names in the store"""
+        snapshot = self._snapshot
+        if "name" in snapshot.metadata_index.keys:
+            names = snapshot.metadata_index.values("name")
+        else:
+            names = snapshot.view.column_values("name")
+        return [name for name in names if name]
+    
+    @property
+    def document_count(self) -> int:
+        return self._snapshot.live_total
+    
+    @property
+    def version(self) -> int:
+        """Changes whenever documents are added or deleted"""
+        return self.store.version
+    
+    @property
+    def next_chunk_id(self) -> int:
+        return self.store.next_chunk_id
+    
+    def _maybe_schedule_rebuild(self):
+        """Start a background rebuild once the configured index type can be built"""
+        target = settings.RAG_INDEX_TYPE
+        snapshot = self._snapshot
+        if vector_index.index_type_of(snapshot.index) == target:
+            return
+        if snapshot.view.total < vector_index.training_threshold(target):
+            return
+        self.rebuild_index(target)
+    
+    def rebuild_index(self, index_type: Optional[str] = None) -> bool:
+        """
+        Rebuild the index in a background thread and swap it in when ready.
+        Returns False if a rebuild is already running.
+        """
+        index_type = index_type or settings.RAG_INDEX_TYPE
+        if index_type not in vector_index.INDEX_TYPES:
+            raise ValueError(f"Unknown RAG index type: {index_type}")
+        return self._start_index_thread(self._rebuild, index_type)
+    
+    def _maybe_schedule_fold(self):
+        """Extend a copy of the index with the tail once exact tail scans get expensive"""
+        snapshot = self._snapshot
+        if snapshot.view.total - snapshot.indexed < settings.RAG_INDEX_TAIL_MAX_ROWS:
+            return
+        self._start_index_thread(self._fold)
+    
+    def _start_index_thread(self, target, *args) -> bool:
+        """Rebuilds and folds share one background slot; False if it is busy"""
+        with self._lock:
+            if self._rebuild_thread and self._rebuild_thread.is_alive():
+                return False
+            self._rebuild_thread = threading.Thread(
+                target=target,
+                args=args,
+                name="rag-index-rebuild",
+                daemon=True
+            )
+            self._rebuild_thread.start()
+        return True
+    
+    def _swap_index(self, source: faiss.Index, new_index: faiss.Index) -> bool:
+        """Publish `new_index` unless a purge replaced `source` meanwhile (rows would not line up)"""
+        with self._lock:
+            if self._snapshot.index is not source:
+                logger.warning("FAISS index changed while it was being rebuilt, discarding result")
+                return False
+            self._publish(index=new_index)
+        return True
+    
+    def _rebuild(self, index_type: str):
+        """Train and fill a new index off the query path, then swap it in"""
         try:
-            index_path = os.path.join(settings.VECTOR_STORE_PATH, "faiss.index")
-            docs_path = os.path.join(settings.VECTOR_STORE_PATH, "documents.pkl")
+            snapshot = self._snapshot
+            # Build from the original vectors in the segments, not lossy reconstructions
+            vectors = snapshot.view.read_vectors(0)
+            
+            logger.info(f"Rebuilding FAISS index as {index_type} over {len(vectors)} vectors")
+            new_index = vector_index.build_index(index_type, self.dimension, vectors)
             
-            faiss.write_index(self.index, index_path)
-            with open(docs_path, "wb") as f:
-                pickle.dump(self.documents, f)
+            # Rows added meanwhile stay in the exact-search tail until the next fold
+            if self._swap_index(snapshot.index, new_index):
+                logger.info(f"Swapped in rebuilt {index_type} index with {new_index.ntotal} vectors")
+                self._checkpoint()
+                self._maybe_schedule_fold()
         except Exception as e:
-            logger.error(f"Error saving index: {e}")
-
-rag_engine = RAGEngine()
-
+            logger.error(f"Error rebuilding index: {e}")
+    
+    def _fold(self):
+        """Copy-on-write: add the tail to a clone of the index, leaving the published one untouched"""
+        try:
+            # Writes may keep the tail growing while we fold, so repeat until it is short
+            while True:
+                snapshot = self._snapshot
+                if snapshot.view.total - snapshot.indexed < settings.RAG_INDEX_TAIL_MAX_ROWS:
+                    return
+                new_index = faiss.clone_index(snapshot.index)
+                new_index.add(snapshot.tail_vectors)
+                if not self._swap_index(snapshot.index, new_index):
+                    return
+                logger.info(f"Folded {len(snapshot.tail_vectors)} rows into the FAISS index")
+                self._checkpoint()
+        except Exception as e:
+            logger.error(f"Error extending index: {e}")
+    
+    def _maybe_schedule_compaction(self):
+        """Merge segments or purge deleted chunks in the background once worthwhile"""
+        mergeable = self.store.merge_run(settings.RAG_SEGMENT_COMPACT_THRESHOLD) is not None
+        if not (mergeable or self._too_many_deleted()):
+            return
+        with self._lock:
+            if self._compact_thread and self._compact_thread.is_alive():
+                return
+            self._compact_thread = threading.Thread(
+                target=self._compact,
+                name="rag-segment-compaction",
+                daemon=True
+            )
+            self._compact_thread.start()
+    
+    def _too_many_deleted(self) -> bool:
+        deleted = len(self.store.tombstones) - len(self.store.staged)
+        return deleted > settings.RAG_TOMBSTONE_COMPACT_RATIO * self.store.total
+    
+    def _compact(self):
+        """Merge similar-sized segments, purge deleted chunks and checkpoint the index so startup replays less"""
+        plan = None
+        try:
+            plan = self.store.prepare_compaction(settings.RAG_SEGMENT_COMPACT_THRESHOLD, self._too_many_deleted())
+            if plan is None:
+                return
+            if plan["purged"]:
+                self._commit_purge(plan)
+            else:
+                # Row numbers are unchanged, the published index stays valid
+                with self._lock:
+                    self.store.commit_compaction(plan)
+                    self._publish()
+            plan = None
+            self._checkpoint()
+            self._maybe_schedule_rebuild()
+            self._maybe_schedule_fold()
+        except Exception as e:
+            logger.error(f"Error compacting vector store: {e}")
+            if plan is not None:
+                self.store.abort_compaction(plan)
+    
+    def _commit_purge(self, plan: Dict):
+        """Build an index over the purged rows off the query path, then publish both together"""
+        view = self.store.compaction_view(plan)
+        vectors = view.read_vectors(0)
+        index_type = vector_index.index_type_of(self._snapshot.index)
+        if len(vectors) < vector_index.training_threshold(index_type):
+            index_type = "flat"
+        new_index = vector_index.build_index(index_type, self.dimension, vectors)
+        
+        with self._lexical_lock:
+            # Row numbers change, so the metadata and BM25 indexes are rebuilt for the new layout here too
+            deleted = self.store.deleted_rows(view, staged=False)
+            metadata_index = self._build_metadata_index(view, deleted)
+            lexical_index = self._build_lexical_index(view, deleted) \
+                if self._snapshot.lexical_index is not None else None
+            
+            # Readers keep using the old snapshot (and its mmaps) until the swap
+            with self._checkpoint_lock, self._lock:
+                self.store.commit_compaction(plan)
+                self._catch_up(view, deleted, metadata_index, lexical_index)
+                self._publish(index=new_index, metadata_index=metadata_index, lexical_index=lexical_index)
+    
+    def _catch_up(
+        self,
+        built: StoreView,
+        deleted: np.ndarray,
+        metadata_index: Optional[MetadataIndex] = None,
+        lexical_index: Optional[LexicalIndex] = None
+    ):
+        """
+        Apply writes made since indexes were built from `built` (whose rows are
+        a prefix of the current view, `deleted` excluded); caller holds the lock.
+        Staged rows stay indexed, hidden by the snapshot, so publishing needs no reindexing
+        """
+        view = self.store.view
+        appended = np.arange(built.total, view.total)
+        if len(appended):
+            documents = view.get_documents(appended)
+            if metadata_index is not None:
+                metadata_index.add(appended, [doc["metadata"] for doc in documents])
+            if lexical_index is not None:
+                lexical_index.add(appended, [doc["text"] for doc in documents])
+        removed = np.setdiff1d(self.store.deleted_rows(view, staged=False), deleted)
+        if len(removed):
+            documents = view.get_documents(removed)
+            if metadata_index is not None:
+                metadata_index.remove(removed, [doc["metadata"] for doc in documents])
+            if lexical_index is not None:
+                lexical_index.remove(removed, [doc["text"] for doc in documents])
+    
+    def _checkpoint(self):
+        """Persist the published index; it is immutable, so no copy is needed"""
+        with self._checkpoint_lock:
+            self.store.checkpoint_index(self._snapshot.index)
+    
+    def index_info(self) -> Dict:
+        """Describe the live index"""
+        snapshot = self._snapshot
+        return {
+            "index_type": vector_index.index_type_of(snapshot.index),
+            "configured_index_type": settings.RAG_INDEX_TYPE,
+            "vectors": snapshot.indexed,
+            "unindexed_rows": snapshot.view.total - snapshot.indexed,
+            "deleted_chunks": len(snapshot.deleted_rows),
+            "rebuilding": bool(self._rebuild_thread and self._rebuild_thread.is_alive())
+        }
 
+def _create_engine():
+    if is_helper_process():
+        # Helper processes re-import the parent's main module on spawn; shards build their own engine
+        return None
+    if settings.RAG_SHARDS > 1:
+        from app.services.rag_shards import ShardedRAGEngine
+        return ShardedRAGEngine(settings.RAG_SHARDS)
+    return RAGEngine()
 
+rag_engine = _create_engine()
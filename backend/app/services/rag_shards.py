@@ -0,0 +1,361 @@
+"""
+Sharded RAG engine: chunks are partitioned across local shard processes,
+each running its own RAGEngine (FAISS index, segment store, metadata and
+BM25 indexes) under VECTOR_STORE_PATH/shard_NN.
+
+The coordinator embeds texts once, assigns global chunk ids and routes each
+chunk to shard `chunk_id % N`. Searches fan out to every shard and the
+per-shard top k are merged; hybrid fusion runs on the merged rankings.
+Shard processes serve several requests at once, so concurrent queries use
+all shards' cores.
+"""
+import itertools
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Dict, Optional, Any
+import numpy as np
+from app.config import settings
+from app.services.helper_processes import SHARD_PREFIX
+import logging
+
+logger = logging.getLogger(__name__)
+
+SHARDS_FILE = "shards.json"
+# Errors callers handle by type (e.g. ValueError -> HTTP 400); any other shard error arrives as RuntimeError
+FORWARDED_ERRORS = {error.__name__: error for error in (ValueError, KeyError, TypeError, TimeoutError)}
+
+
+def serve_shard(path: str, connection):
+    """Shard process entry point: load the shard's engine and answer calls"""
+    settings.VECTOR_STORE_PATH = path
+    from app.services.rag_engine import RAGEngine
+    rag_engine = RAGEngine()
+
+    send_lock = threading.Lock()
+    executor = ThreadPoolExecutor(max_workers=settings.RAG_SHARD_THREADS)
+
+    def handle(request_id: int, method: str, args: tuple):
+        try:
+            attribute = getattr(rag_engine, method)
+            reply = (request_id, True, attribute(*args) if callable(attribute) else attribute)
+        except Exception as e:
+            reply = (request_id, False, (type(e).__name__, str(e)))
+        with send_lock:
+            connection.send(reply)
+
+    connection.send((None, True, "ready"))
+    while True:
+        try:
+            request_id, method, args = connection.recv()
+        except (EOFError, OSError):
+            break
+        executor.submit(handle, request_id, method, args)
+    executor.shutdown(wait=True)
+
+
+class ShardClient:
+    """Coordinator-side handle to one shard process; calls may be concurrent"""
+
+    def __init__(self, shard_id: int, path: str):
+        self.shard_id = shard_id
+        context = multiprocessing.get_context("spawn")
+        self._connection, child_connection = context.Pipe()
+        self._process = context.Process(
+            target=serve_shard,
+            args=(path, child_connection),
+            name=f"{SHARD_PREFIX}{shard_id}",
+            daemon=True
+        )
+        self._process.start()
+        child_connection.close()
+
+        self._send_lock = threading.Lock()
+        self._pending: Dict[int, Future] = {}
+        self._ids = itertools.count()
+        self._ready = Future()
+        threading.Thread(target=self._receive, name=f"rag-shard-{shard_id}-reader", daemon=True).start()
+
+    def _receive(self):
+        while True:
+            try:
+                request_id, ok, result = self._connection.recv()
+            except (EOFError, OSError):
+                break
+            future = self._ready if request_id is None else self._pending.pop(request_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                name, message = result
+                error = FORWARDED_ERRORS.get(name, RuntimeError)
+                future.set_exception(error(f"RAG shard {self.shard_id}: {message}"))
+
+        error = RuntimeError(f"RAG shard {self.shard_id} exited")
+        if not self._ready.done():
+            self._ready.set_exception(error)
+        for future in list(self._pending.values()):
+            future.set_exception(error)
+        self._pending.clear()
+
+    def wait_ready(self):
+        self._ready.result()
+
+    def submit(self, method: str, *args) -> Future:
+        future = Future()
+        with self._send_lock:
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+            self._connection.send((request_id, method, args))
+        return future
+
+    def call(self, method: str, *args) -> Any:
+        return self.submit(method, *args).result()
+
+
+class ShardedRAGEngine:
+    """Same interface as RAGEngine, backed by shard processes"""
+
+    def __init__(self, shards: int):
+        os.makedirs(settings.VECTOR_STORE_PATH, exist_ok=True)
+        self._check_layout(shards)
+        self.shards = [
+            ShardClient(i, os.path.join(settings.VECTOR_STORE_PATH, f"shard_{i:02d}"))
+            for i in range(shards)
+        ]
+        for shard in self.shards:
+            shard.wait_ready()
+        self._lock = threading.Lock()
+        self._next_chunk_id = max(self._gather("next_chunk_id"))
+        # Kept here so cache keys never need a round trip to the shards; every write goes through this process
+        self._version = sum(self._gather("version"))
+        logger.info(f"Started {shards} RAG shards with {self.document_count} documents")
+
+    def _check_layout(self, shards: int):
+        """Chunks are routed by id modulo the shard count, so it cannot change silently"""
+        path = os.path.join(settings.VECTOR_STORE_PATH, SHARDS_FILE)
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                existing = json.load(f)["shards"]
+            if existing != shards:
+                raise ValueError(
+                    f"Vector store was created with {existing} shards, RAG_SHARDS is {shards}; "
+                    f"re-index into an empty VECTOR_STORE_PATH to change it"
+                )
+            return
+        with open(path, "w") as f:
+            json.dump({"shards": shards}, f)
+
+    def _gather(self, method: str, *args) -> List[Any]:
+        """Call every shard in parallel and return their results in shard order"""
+        futures = [shard.submit(method, *args) for shard in self.shards]
+        return [future.result() for future in futures]
+
+    def _allocate_ids(self, count: int) -> np.ndarray:
+        with self._lock:
+            ids = np.arange(self._next_chunk_id, self._next_chunk_id + count, dtype=np.int64)
+            self._next_chunk_id += count
+        return ids
+
+    def _route(self, embeddings: np.ndarray, documents: List[Dict], ids: Optional[List[int]] = None) -> List[tuple]:
+        """Split a batch into per-shard (embeddings, documents, ids) by chunk id"""
+        ids = self._allocate_ids(len(documents)) if ids is None else self._claim_ids(ids, len(documents))
+        routed = []
+        for shard_id in range(len(self.shards)):
+            positions = np.nonzero(ids % len(self.shards) == shard_id)[0]
+            routed.append((
+                embeddings[positions] if len(positions) else None,
+                [documents[i] for i in positions],
+                ids[positions].tolist()
+            ))
+        return routed
+
+    def _claim_ids(self, ids: List[int], count: int) -> np.ndarray:
+        """Explicit chunk ids, checked like SegmentStore.append checks them"""
+        ids = np.asarray(list(ids), dtype=np.int64)
+        with self._lock:
+            if len(ids) != count or ids[0] < self._next_chunk_id or np.any(np.diff(ids) <= 0):
+                raise ValueError("Chunk ids must be new, ascending and one per document")
+            self._next_chunk_id = int(ids[-1]) + 1
+        return ids
+
+    def _bump_version(self):
+        with self._lock:
+            self._version += 1
+
+    def _split(self, chunk_ids: List[int]) -> List[List[int]]:
+        """Chunk ids grouped by the shard that owns them"""
+        by_shard = [[] for _ in self.shards]
+        for chunk_id in chunk_ids:
+            by_shard[int(chunk_id) % len(self.shards)].append(int(chunk_id))
+        return by_shard
+
+    def add_documents(self, texts: List[str], metadata: List[Dict] = None) -> List[int]:
+        """Add documents to the vector store and return their chunk ids"""
+        from app.services.rag_engine import prepare_documents
+        if not texts:
+            return []
+        return self.add_embeddings(*prepare_documents(texts, metadata))
+
+    def add_embeddings(
+        self,
+        embeddings: np.ndarray,
+        documents: List[Dict],
+        ids: Optional[List[int]] = None,
+        staged: bool = False
+    ) -> List[int]:
+        """Add already embedded documents and return their chunk ids; see RAGEngine.add_embeddings"""
+        if not documents:
+            return []
+        routed = self._route(embeddings, documents, ids)
+        futures = [
+            shard.submit("add_embeddings", embeddings, documents, ids, staged)
+            for shard, (embeddings, documents, ids) in zip(self.shards, routed) if documents
+        ]
+        try:
+            return sorted(itertools.chain.from_iterable(future.result() for future in futures))
+        finally:
+            self._bump_version()
+
+    def publish_chunks(self, chunk_ids: List[int], retired_ids: List[int]) -> int:
+        """
+        Publish staged chunks and retire old ones. Each shard swaps its part
+        atomically; the shards are updated in parallel, not as one transaction.
+        """
+        futures = [
+            shard.submit("publish_chunks", staged, retired)
+            for shard, staged, retired in zip(self.shards, self._split(chunk_ids), self._split(retired_ids))
+            if staged or retired
+        ]
+        try:
+            return sum(future.result() for future in futures)
+        finally:
+            self._bump_version()
+
+    def discard_staged(self, chunk_ids: List[int]) -> int:
+        futures = [shard.submit("discard_staged", ids) for shard, ids in zip(self.shards, self._split(chunk_ids)) if ids]
+        return sum(future.result() for future in futures)
+
+    def delete_document(self, name: str) -> int:
+        try:
+            return sum(self._gather("delete_document", name))
+        finally:
+            self._bump_version()
+
+    def delete_chunks(self, chunk_ids: List[int]) -> int:
+        futures = [shard.submit("delete_chunks", ids) for shard, ids in zip(self.shards, self._split(chunk_ids)) if ids]
+        try:
+            return sum(future.result() for future in futures)
+        finally:
+            self._bump_version()
+
+    def search(
+        self,
+        query: str,
+        k: int = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        mode: Optional[str] = None
+    ) -> List[Dict]:
+        return self._search([query], k, nprobe, ef_search, filters, mode, single=True)[0]
+
+    def search_many(
+        self,
+        queries: List[str],
+        k: int = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        mode: Optional[str] = None
+    ) -> List[List[Dict]]:
+        return self._search(queries, k, nprobe, ef_search, filters, mode, single=False)
+
+    def _search(
+        self,
+        queries: List[str],
+        k: Optional[int],
+        nprobe: Optional[int],
+        ef_search: Optional[int],
+        filters: Optional[Dict[str, Any]],
+        mode: Optional[str],
+        single: bool
+    ) -> List[List[Dict]]:
+        from app.services.rag_engine import check_search_mode, encode_queries, run_search
+        mode = check_search_mode(mode)
+        if not queries:
+            return []
+        if k is None:
+            k = settings.RAG_TOP_K
+
+        def vector_search(queries: List[str], depth: int) -> List[List[Dict]]:
+            embeddings = encode_queries(queries, single).reshape(len(queries), -1).astype("float32")
+            per_shard = self._gather("search_vectors", embeddings, depth, nprobe, ef_search, filters)
+            return self._merge(per_shard, depth, key=lambda result: result["distance"])
+
+        def lexical_search(queries: List[str], depth: int) -> List[List[Dict]]:
+            per_shard = self._gather("search_lexical", queries, depth, filters)
+            # Each shard scores with its own term statistics; hash routing keeps them close
+            return self._merge(per_shard, depth, key=lambda result: -result["bm25"])
+
+        return run_search(queries, k, mode, lexical_search, vector_search)
+
+    @staticmethod
+    def _merge(per_shard: List[List[List[Dict]]], k: int, key) -> List[List[Dict]]:
+        """Merge per-shard result lists (one per query) into the overall top k"""
+        return [
+            sorted(itertools.chain.from_iterable(results), key=key)[:k]
+            for results in zip(*per_shard)
+        ]
+
+    def get_documents_by_names(self, doc_names: List[str]) -> List[Dict]:
+        return self.get_documents_by_metadata("name", doc_names)
+
+    def get_documents_by_metadata(self, key: str, values: List) -> List[Dict]:
+        return list(itertools.chain.from_iterable(self._gather("get_documents_by_metadata", key, values)))
+
+    def get_chunk_ids_by_metadata(self, key: str, values: List) -> List[int]:
+        return sorted(itertools.chain.from_iterable(self._gather("get_chunk_ids_by_metadata", key, values)))
+
+    def get_chunks_by_metadata(self, key: str, values: List) -> List[Dict]:
+        return list(itertools.chain.from_iterable(self._gather("get_chunks_by_metadata", key, values)))
+
+    def get_vectors_by_ids(self, chunk_ids: List[int]) -> Dict[int, np.ndarray]:
+        futures = [shard.submit("get_vectors_by_ids", ids) for shard, ids in zip(self.shards, self._split(chunk_ids)) if ids]
+        vectors = {}
+        for future in futures:
+            vectors.update(future.result())
+        return vectors
+
+    def list_document_names(self) -> List[str]:
+        names = []
+        for shard_names in self._gather("list_document_names"):
+            names.extend(name for name in shard_names if name not in names)
+        return names
+
+    @property
+    def document_count(self) -> int:
+        return sum(self._gather("document_count"))
+
+    @property
+    def version(self) -> int:
+        """Changes whenever documents are added or deleted on any shard"""
+        return self._version
+
+    def rebuild_index(self, index_type: Optional[str] = None) -> bool:
+        return any(self._gather("rebuild_index", index_type))
+
+    def index_info(self) -> Dict:
+        shards = self._gather("index_info")
+        return {
+            "index_type": shards[0]["index_type"],
+            "configured_index_type": settings.RAG_INDEX_TYPE,
+            "vectors": sum(info["vectors"] for info in shards),
+            "unindexed_rows": sum(info["unindexed_rows"] for info in shards),
+            "deleted_chunks": sum(info["deleted_chunks"] for info in shards),
+            "rebuilding": any(info["rebuilding"] for info in shards),
+            "shards": shards
+        }
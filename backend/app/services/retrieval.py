@@ -0,0 +1,77 @@
+"""
+Async facade over the RAG engine and the embedding model.
+
+Searches and embeddings are synchronous and CPU-bound; awaiting them here
+runs them on a bounded thread pool so the event loop keeps serving other
+requests. FAISS and the embedding model release the GIL while they work,
+so threads give real parallelism without copying the index into other
+processes.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Any
+import numpy as np
+from app.services.rag_engine import rag_engine
+from app.services.embeddings import embedding_service
+from app.config import settings
+
+
+class RetrievalService:
+    def __init__(self, max_workers: int):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rag-worker")
+
+    async def _run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    async def search(
+        self,
+        query: str,
+        k: int = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        mode: Optional[str] = None
+    ) -> List[Dict]:
+        return await self._run(rag_engine.search, query, k, nprobe, ef_search, filters, mode)
+
+    async def search_many(
+        self,
+        queries: List[str],
+        k: int = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        mode: Optional[str] = None
+    ) -> List[List[Dict]]:
+        return await self._run(rag_engine.search_many, queries, k, nprobe, ef_search, filters, mode)
+
+    async def get_documents_by_names(self, doc_names: List[str]) -> List[Dict]:
+        return await self._run(rag_engine.get_documents_by_names, doc_names)
+
+    async def add_documents(self, texts: List[str], metadata: List[Dict] = None) -> List[int]:
+        return await self._run(rag_engine.add_documents, texts, metadata)
+
+    async def list_documents(self) -> Dict:
+        # With RAG_SHARDS these are round trips to every shard process
+        return await self._run(lambda: {
+            "documents": rag_engine.list_document_names(),
+            "total_documents": rag_engine.document_count
+        })
+
+    async def index_info(self) -> Dict:
+        return await self._run(rag_engine.index_info)
+
+    async def rebuild_index(self, index_type: Optional[str] = None) -> bool:
+        return await self._run(rag_engine.rebuild_index, index_type)
+
+    async def encode(self, texts: List[str]) -> np.ndarray:
+        return await self._run(embedding_service.encode, texts)
+
+    async def encode_query(self, query: str) -> np.ndarray:
+        # Awaits the micro-batcher directly instead of holding a worker thread
+        row = await asyncio.wrap_future(embedding_service.submit_query(query))
+        return row[np.newaxis, :]
+
+retrieval_service = RetrievalService(settings.RAG_EXECUTOR_WORKERS)
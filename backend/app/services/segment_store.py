@@ -0,0 +1,585 @@
+"""
+Append-only on-disk layout for the RAG vector store.
+
+Every `add_documents` batch becomes one immutable segment: vectors.npy and
+ids.npy files plus a columnar document store (see document_store). Each chunk
+gets a stable, monotonically increasing chunk id; the row number of a chunk
+is its position across the live segments and may shift when compaction
+purges deleted chunks.
+
+The list of live segments and the tombstoned chunk ids are kept in
+`manifest.json`; changes made since the manifest was last written are
+recorded in `wal.log` and replayed on startup. The FAISS index is
+checkpointed separately and only covers a prefix of the rows, anything after
+it is re-added from the segments on load.
+"""
+import faiss
+import numpy as np
+import os
+import json
+import threading
+from typing import List, Dict, Tuple, Optional, Iterable, Set, Any
+from app.services.document_store import DocumentSegment, write_documents, fsync_write, SUFFIXES
+import logging
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+WAL_FILE = "wal.log"
+SEGMENTS_DIR = "segments"
+VECTOR_SUFFIXES = ("vectors.npy", "ids.npy")
+
+
+def size_tier(count: int, fanout: int) -> int:
+    """Segments whose sizes are within a factor of `fanout` share a tier"""
+    tier = 0
+    while count >= fanout:
+        count //= fanout
+        tier += 1
+    return tier
+
+
+class StoreView:
+    """
+    Immutable row layout of the live segments at one point in time.
+    Readers holding a view keep seeing consistent rows while appends and
+    compactions publish newer views; the mmaps stay valid even after
+    compaction unlinks the underlying files.
+    """
+
+    def __init__(self, dimension: int, segments: List[Dict], readers: Dict[str, DocumentSegment],
+                 vectors: Dict[str, np.ndarray], segment_ids: Dict[str, np.ndarray]):
+        self.dimension = dimension
+        self._readers = [readers[segment["name"]] for segment in segments]
+        self._vectors = [vectors[segment["name"]] for segment in segments]
+        segment_ids = [segment_ids[segment["name"]] for segment in segments]
+        counts = [segment["count"] for segment in segments]
+        self.total = int(sum(counts))
+        self.ids = np.concatenate(segment_ids).astype(np.int64) \
+            if segment_ids else np.zeros(0, dtype=np.int64)  # chunk id of every row, ascending
+        self.starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64) \
+            if counts else np.zeros(0, dtype=np.int64)  # first row of each segment
+
+    def ids_for_rows(self, rows: np.ndarray) -> np.ndarray:
+        return self.ids[np.asarray(rows, dtype=np.int64)]
+
+    def rows_for_ids(self, ids: Iterable[int]) -> np.ndarray:
+        """Rows of the given chunk ids (ids not in this view are dropped)"""
+        ids = np.asarray(sorted(ids), dtype=np.int64)
+        rows = np.searchsorted(self.ids, ids)
+        found = rows < len(self.ids)
+        rows, ids = rows[found], ids[found]
+        return rows[self.ids[rows] == ids]
+
+    def read_vectors(self, start: int = 0, end: Optional[int] = None) -> np.ndarray:
+        """Vectors of rows [start, end)"""
+        end = self.total if end is None else end
+        parts = []
+        for offset, vectors in zip(self.starts, self._vectors):
+            lo, hi = max(start - offset, 0), min(end - offset, len(vectors))
+            if lo < hi:
+                parts.append(vectors[lo:hi])
+        if not parts:
+            return np.empty((0, self.dimension), dtype="float32")
+        return np.ascontiguousarray(np.concatenate(parts), dtype="float32")
+
+    def iter_segments(self) -> List[Tuple[int, DocumentSegment]]:
+        """(first row, reader) for every segment"""
+        return [(int(start), reader) for start, reader in zip(self.starts, self._readers)]
+
+    def _locate(self, rows: Iterable[int]) -> List[Tuple[DocumentSegment, int]]:
+        """Map global row numbers to (segment reader, local row)"""
+        rows = np.asarray(list(rows), dtype=np.int64)
+        positions = np.searchsorted(self.starts, rows, side="right") - 1
+        return [
+            (self._readers[position], int(row - self.starts[position]))
+            for row, position in zip(rows, positions)
+        ]
+
+    def get_vectors(self, rows: np.ndarray) -> np.ndarray:
+        """Stored float32 vectors of the given rows, in the given order"""
+        rows = np.asarray(rows, dtype=np.int64)
+        result = np.empty((len(rows), self.dimension), dtype="float32")
+        positions = np.searchsorted(self.starts, rows, side="right") - 1
+        for position in np.unique(positions):
+            mask = positions == position
+            result[mask] = self._vectors[position][rows[mask] - self.starts[position]]
+        return result
+
+    def get_document(self, row: int) -> Dict:
+        reader, local_row = self._locate([row])[0]
+        return reader.get(local_row)
+
+    def get_documents(self, rows: Iterable[int]) -> List[Dict]:
+        """Materialize only the requested rows"""
+        return [reader.get(local_row) for reader, local_row in self._locate(rows)]
+
+    def rows_where(self, key: str, values: Iterable[Any]) -> np.ndarray:
+        """Global rows whose metadata `key` equals any of `values`, deleted rows included"""
+        values = list(values)
+        parts = [reader.rows_where(key, values) + start for reader, start in zip(self._readers, self.starts)]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(parts)
+
+    def column_values(self, key: str) -> Set[Any]:
+        """Distinct values of a metadata key across all segments, deleted rows included"""
+        values = set()
+        for reader in self._readers:
+            values.update(reader.column_values(key))
+        return values
+
+
+class SegmentStore:
+    def __init__(self, path: str, dimension: int):
+        self.path = path
+        self.dimension = dimension
+        self.segments_path = os.path.join(path, SEGMENTS_DIR)
+        self.manifest_path = os.path.join(path, MANIFEST_FILE)
+        self.wal_path = os.path.join(path, WAL_FILE)
+
+        self.segments: List[Dict] = []  # [{"name": ..., "count": ...}]
+        self.next_segment = 1
+        self.next_chunk_id = 0
+        self.tombstones: Set[int] = set()  # deleted chunk ids not yet purged
+        self.staged: Set[int] = set()  # tombstoned ids of staged appends awaiting `publish`, never purged
+        self.version = 0  # bumped on every add/delete, usable as a cache key
+        self.index_checkpoint: Optional[str] = None
+        self.indexed_vectors = 0
+        self._pending = set()  # files being written, not yet committed to the log
+        self._readers: Dict[str, DocumentSegment] = {}
+        self._vectors: Dict[str, np.ndarray] = {}
+        self._segment_ids: Dict[str, np.ndarray] = {}
+        self.view = StoreView(dimension, [], {}, {}, {})  # replaced, never mutated
+        self._lock = threading.RLock()
+
+        os.makedirs(self.segments_path, exist_ok=True)
+
+    @property
+    def total(self) -> int:
+        return self.view.total
+
+    @property
+    def live_total(self) -> int:
+        return self.total - len(self.tombstones)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.manifest_path) or os.path.exists(self.wal_path)
+
+    def recover(self):
+        """Load the manifest and replay the write-ahead log on top of it"""
+        with self._lock:
+            if os.path.exists(self.manifest_path):
+                with open(self.manifest_path, "r") as f:
+                    manifest = json.load(f)
+                self.segments = manifest.get("segments", [])
+                self.next_segment = manifest.get("next_segment", 1)
+                self.next_chunk_id = manifest.get("next_chunk_id", 0)
+                self.tombstones = set(manifest.get("tombstones", []))
+                self.version = manifest.get("version", 0)
+                self.index_checkpoint = manifest.get("index_checkpoint")
+                self.indexed_vectors = manifest.get("indexed_vectors", 0)
+
+            replayed = 0
+            torn = False
+            if os.path.exists(self.wal_path):
+                with open(self.wal_path, "r") as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except json.JSONDecodeError:
+                            # Torn write at the tail of the log, nothing after it was committed
+                            logger.warning("Ignoring incomplete record at end of RAG write-ahead log")
+                            torn = True
+                            break
+                        self._apply(record)
+                        replayed += 1
+
+            self._remove_orphans()
+            self._refresh_layout()
+            if replayed or torn:
+                logger.info(f"Replayed {replayed} write-ahead log records")
+                self._write_manifest()
+
+    def _apply(self, record: Dict):
+        """Apply one log record to the in-memory state (idempotent)"""
+        names = [segment["name"] for segment in self.segments]
+        if record["op"] == "add":
+            if record["segment"]["name"] not in names:
+                self.segments.append(record["segment"])
+                # Staged appends that were never published stay deleted and are purged later
+                self.tombstones.update(record.get("deleted", []))
+        elif record["op"] == "delete":
+            self.tombstones.update(record["ids"])
+            self.tombstones.difference_update(record.get("restored", []))
+        elif record["op"] == "compact":
+            # Older records merged a prefix of the segments into one
+            merges = record.get("merges") or [{"segments": record["segments"], "into": record["into"]}]
+            applied = [self._replace_run(merge["segments"], merge["into"]) for merge in merges]
+            if any(applied):
+                self.tombstones.difference_update(record.get("purged", []))
+                if record.get("purged"):
+                    self.index_checkpoint = None
+                    self.indexed_vectors = 0
+        self.next_segment = max(self.next_segment, record.get("next_segment", 0))
+        self.next_chunk_id = max(self.next_chunk_id, record.get("next_chunk_id", 0))
+        self.version = max(self.version, record.get("version", 0))
+
+    def _replace_run(self, merged: List[str], into: Dict) -> bool:
+        """Swap a contiguous run of segments for the one they were merged into"""
+        names = [segment["name"] for segment in self.segments]
+        if not merged or merged[0] not in names:
+            return False
+        start = names.index(merged[0])
+        if names[start:start + len(merged)] != merged:
+            return False
+        self.segments = self.segments[:start] + [into] + self.segments[start + len(merged):]
+        return True
+
+    def _log(self, record: Dict):
+        """Durably append one record to the write-ahead log"""
+        record = {
+            **record,
+            "next_segment": self.next_segment,
+            "next_chunk_id": self.next_chunk_id,
+            "version": self.version
+        }
+        with open(self.wal_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_manifest(self):
+        """Fold the log into a new manifest and truncate the log"""
+        manifest = {
+            "segments": self.segments,
+            "next_segment": self.next_segment,
+            "next_chunk_id": self.next_chunk_id,
+            "tombstones": sorted(self.tombstones),
+            "version": self.version,
+            "index_checkpoint": self.index_checkpoint,
+            "indexed_vectors": self.indexed_vectors
+        }
+        fsync_write(self.manifest_path, json.dumps(manifest).encode("utf-8"))
+        open(self.wal_path, "w").close()
+
+    def _remove_orphans(self):
+        """Delete files left behind by writes or compactions interrupted by a crash"""
+        live = {segment["name"] for segment in self.segments} | self._pending
+        for filename in os.listdir(self.segments_path):
+            if filename.split(".", 1)[0] not in live:
+                os.remove(os.path.join(self.segments_path, filename))
+        for filename in os.listdir(self.path):
+            if filename.startswith("index_") and filename.split(".", 1)[0] not in live \
+                    and filename != self.index_checkpoint:
+                os.remove(os.path.join(self.path, filename))
+
+    def _remove_segment_files(self, name: str):
+        for suffix in VECTOR_SUFFIXES + SUFFIXES:
+            path = self._segment_file(name, suffix)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _reserve_name(self, prefix: str) -> str:
+        name = f"{prefix}_{self.next_segment:06d}"
+        self.next_segment += 1
+        self._pending.add(name)
+        return name
+
+    def _segment_file(self, name: str, suffix: str) -> str:
+        return os.path.join(self.segments_path, f"{name}.{suffix}")
+
+    def _write_segment(self, name: str, vectors: np.ndarray, ids: np.ndarray, documents: List[Dict]):
+        for suffix, array in (("vectors.npy", np.ascontiguousarray(vectors, dtype="float32")),
+                              ("ids.npy", np.asarray(ids, dtype=np.int64))):
+            with open(self._segment_file(name, suffix), "wb") as f:
+                np.save(f, array)
+                f.flush()
+                os.fsync(f.fileno())
+        write_documents(os.path.join(self.segments_path, name), documents)
+
+    def _open_segment(self, name: str) -> Tuple[DocumentSegment, np.ndarray, np.ndarray]:
+        return (
+            DocumentSegment(os.path.join(self.segments_path, name)),
+            np.load(self._segment_file(name, "vectors.npy"), mmap_mode="r"),
+            np.load(self._segment_file(name, "ids.npy"), mmap_mode="r")
+        )
+
+    def _refresh_layout(self):
+        """Open readers for the live segments and publish a new view of their rows"""
+        readers = {}
+        vectors = {}
+        segment_ids = {}
+        for segment in self.segments:
+            name = segment["name"]
+            if name in self._readers:
+                readers[name] = self._readers[name]
+                vectors[name] = self._vectors[name]
+                segment_ids[name] = self._segment_ids[name]
+            else:
+                readers[name], vectors[name], segment_ids[name] = self._open_segment(name)
+        self._readers = readers
+        self._vectors = vectors
+        self._segment_ids = segment_ids
+        self.view = StoreView(self.dimension, self.segments, readers, vectors, segment_ids)
+
+    def append(self, vectors: np.ndarray, documents: List[Dict], ids: Optional[Iterable[int]] = None,
+               staged: bool = False) -> np.ndarray:
+        """
+        Write a batch as a new segment, commit it to the log and return its chunk ids.
+        `ids` assigns the chunk ids explicitly (e.g. globally across shards); they
+        must be ascending and larger than any id used so far. A `staged` batch is
+        committed already tombstoned and becomes live with `publish`.
+        """
+        with self._lock:
+            if ids is None:
+                ids = np.arange(self.next_chunk_id, self.next_chunk_id + len(documents), dtype=np.int64)
+            else:
+                ids = np.asarray(list(ids), dtype=np.int64)
+                if len(ids) != len(documents) or ids[0] < self.next_chunk_id or np.any(np.diff(ids) <= 0):
+                    raise ValueError("Chunk ids must be new, ascending and one per document")
+            name = self._reserve_name("seg")
+            self.next_chunk_id = int(ids[-1]) + 1
+
+        # Segment files are written outside the lock, they are not visible until logged
+        self._write_segment(name, vectors, ids, documents)
+
+        with self._lock:
+            segment = {"name": name, "count": len(documents)}
+            self.version += 1
+            if staged:
+                self._log({"op": "add", "segment": segment, "deleted": ids.tolist()})
+                self.tombstones.update(ids.tolist())
+                self.staged.update(ids.tolist())
+            else:
+                self._log({"op": "add", "segment": segment})
+            self.segments.append(segment)
+            self._pending.discard(name)
+            self._refresh_layout()
+        return ids
+
+    def delete(self, ids: Iterable[int]) -> List[int]:
+        """Tombstone chunk ids; returns the ids that were live"""
+        with self._lock:
+            ids = [int(chunk_id) for chunk_id in ids if int(chunk_id) not in self.tombstones]
+            if not ids:
+                return []
+            self.version += 1
+            self._log({"op": "delete", "ids": ids})
+            self.tombstones.update(ids)
+        return ids
+
+    def publish(self, staged: Iterable[int], retired: Iterable[int]) -> List[int]:
+        """
+        Make staged chunk ids live and tombstone `retired` with one log record,
+        so a crash applies both or neither; returns the retired ids that were live
+        """
+        with self._lock:
+            restored = [int(chunk_id) for chunk_id in staged if int(chunk_id) in self.staged]
+            retired = [int(chunk_id) for chunk_id in retired if int(chunk_id) not in self.tombstones]
+            if not restored and not retired:
+                return []
+            self.version += 1
+            self._log({"op": "delete", "ids": retired, "restored": restored})
+            self.tombstones.update(retired)
+            self.tombstones.difference_update(restored)
+            self.staged.difference_update(restored)
+        return retired
+
+    def discard_staged(self, ids: Iterable[int]) -> List[int]:
+        """Give up on staged chunk ids; they stay deleted and compaction purges them"""
+        with self._lock:
+            ids = [int(chunk_id) for chunk_id in ids if int(chunk_id) in self.staged]
+            self.staged.difference_update(ids)
+        return ids
+
+    def ids_for_rows(self, rows: np.ndarray) -> np.ndarray:
+        return self.view.ids_for_rows(rows)
+
+    def rows_for_ids(self, ids: Iterable[int]) -> np.ndarray:
+        """Current rows of the given chunk ids (ids that no longer exist are dropped)"""
+        return self.view.rows_for_ids(ids)
+
+    def deleted_rows(self, view: Optional[StoreView] = None, staged: bool = True) -> np.ndarray:
+        """Rows of tombstoned chunks in `view` (default: the current view), optionally leaving out staged ones"""
+        with self._lock:
+            tombstones = self.tombstones if staged else self.tombstones - self.staged
+            tombstones = list(tombstones)
+            view = view or self.view
+        return view.rows_for_ids(tombstones)
+
+    def read_vectors(self, start: int = 0) -> np.ndarray:
+        """Vectors of all rows from `start` onwards"""
+        return self.view.read_vectors(start)
+
+    def iter_segments(self) -> List[Tuple[int, DocumentSegment]]:
+        """(first row, reader) for every live segment"""
+        return self.view.iter_segments()
+
+    def get_vectors(self, rows: np.ndarray) -> np.ndarray:
+        """Stored float32 vectors of the given rows, in the given order"""
+        return self.view.get_vectors(rows)
+
+    def get_document(self, row: int) -> Dict:
+        return self.view.get_document(row)
+
+    def get_documents(self, rows: Iterable[int]) -> List[Dict]:
+        """Materialize only the requested rows"""
+        return self.view.get_documents(rows)
+
+    def rows_where(self, key: str, values: Iterable[Any]) -> np.ndarray:
+        """Global rows whose metadata `key` equals any of `values`, deleted rows included"""
+        return self.view.rows_where(key, values)
+
+    def column_values(self, key: str) -> Set[Any]:
+        """Distinct values of a metadata key across all segments, deleted rows included"""
+        return self.view.column_values(key)
+
+    def merge_run(self, fanout: int) -> Optional[Tuple[int, int]]:
+        """
+        [start, end) positions of the first run of at least `fanout` adjacent
+        segments in the same size tier, or None. Merging such a run moves it
+        up a tier, so each chunk is rewritten about log_fanout(total) times.
+        """
+        fanout = max(fanout, 2)
+        with self._lock:
+            tiers = [size_tier(segment["count"], fanout) for segment in self.segments]
+        start = 0
+        for end in range(1, len(tiers) + 1):
+            if end == len(tiers) or tiers[end] != tiers[start]:
+                if end - start >= fanout:
+                    return start, end
+                start = end
+        return None
+
+    def prepare_compaction(self, fanout: int, purge: bool) -> Optional[Dict]:
+        """
+        Write the new (uncommitted) segments of a compaction: the first run of
+        `fanout` similar-sized segments is merged into one, and with `purge`
+        every segment holding tombstoned chunks is rewritten without them.
+        Only the segments involved are read. Appends and deletes may continue
+        meanwhile; the result is published by `commit_compaction`.
+        """
+        with self._lock:
+            layout = [dict(segment) for segment in self.segments]
+            run = self.merge_run(fanout)
+            tombstones = np.asarray(sorted(self.tombstones - self.staged), dtype=np.int64) \
+                if purge else np.zeros(0, dtype=np.int64)
+            groups = [run] if run else []
+            if len(tombstones):
+                for position, segment in enumerate(layout):
+                    if run and run[0] <= position < run[1]:
+                        continue
+                    if np.isin(self._segment_ids[segment["name"]], tombstones).any():
+                        groups.append((position, position + 1))
+            if not groups:
+                return None
+            groups.sort()
+            merges = []
+            for start, end in groups:
+                merged = [segment["name"] for segment in layout[start:end]]
+                merges.append({
+                    "segments": merged,
+                    "name": self._reserve_name("seg"),
+                    "sources": [(self._readers[name], self._vectors[name], self._segment_ids[name]) for name in merged]
+                })
+
+        plan = {"merges": merges, "layout": layout, "purged": []}
+        try:
+            for merge in merges:
+                vectors = []
+                ids = []
+                documents = []
+                for reader, segment_vectors, segment_ids in merge.pop("sources"):
+                    keep = ~np.isin(segment_ids, tombstones)
+                    vectors.append(np.asarray(segment_vectors)[keep])
+                    ids.append(np.asarray(segment_ids)[keep])
+                    documents.extend(reader.get(int(row)) for row in np.nonzero(keep)[0])
+                    plan["purged"].extend(np.asarray(segment_ids)[~keep].tolist())
+                self._write_segment(merge["name"], np.concatenate(vectors), np.concatenate(ids), documents)
+                merge["count"] = len(documents)
+        except Exception:
+            self.abort_compaction(plan)
+            raise
+        return plan
+
+    def compaction_view(self, plan: Dict) -> StoreView:
+        """Rows of the segments that existed when `plan` was prepared, as they will be once it is committed"""
+        with self._lock:
+            readers, vectors, segment_ids = dict(self._readers), dict(self._vectors), dict(self._segment_ids)
+        by_first = {merge["segments"][0]: merge for merge in plan["merges"]}
+        segments = []
+        merged = set()
+        for segment in plan["layout"]:
+            name = segment["name"]
+            if name in merged:
+                continue
+            merge = by_first.get(name)
+            if merge is None:
+                segments.append(segment)
+                continue
+            merged.update(merge["segments"])
+            segments.append({"name": merge["name"], "count": merge["count"]})
+            readers[merge["name"]], vectors[merge["name"]], segment_ids[merge["name"]] = self._open_segment(merge["name"])
+        return StoreView(self.dimension, segments, readers, vectors, segment_ids)
+
+    def commit_compaction(self, plan: Dict):
+        """Publish a prepared compaction; purging rows invalidates the index checkpoint"""
+        merges = [
+            {"segments": merge["segments"], "into": {"name": merge["name"], "count": merge["count"]}}
+            for merge in plan["merges"]
+        ]
+        with self._lock:
+            self._log({"op": "compact", "merges": merges, "purged": plan["purged"]})
+            for merge in merges:
+                self._replace_run(merge["segments"], merge["into"])
+                self._pending.discard(merge["into"]["name"])
+            self.tombstones.difference_update(plan["purged"])
+            previous_checkpoint = None
+            if plan["purged"]:
+                previous_checkpoint = self.index_checkpoint
+                self.index_checkpoint = None
+                self.indexed_vectors = 0
+            self._refresh_layout()
+            self._write_manifest()
+        for merge in merges:
+            for name in merge["segments"]:
+                self._remove_segment_files(name)
+        if previous_checkpoint:
+            os.remove(os.path.join(self.path, previous_checkpoint))
+        logger.info(f"Compacted {sum(len(merge['segments']) for merge in merges)} segments into {len(merges)}, "
+                    f"purged {len(plan['purged'])} deleted chunks")
+
+    def abort_compaction(self, plan: Dict):
+        """Discard the files of a prepared compaction that will not be committed"""
+        with self._lock:
+            live = {segment["name"] for segment in self.segments}
+            names = [merge["name"] for merge in plan["merges"] if merge["name"] not in live]
+            self._pending.difference_update(names)
+        for name in names:
+            self._remove_segment_files(name)
+
+    def load_index_checkpoint(self) -> Tuple[Optional[faiss.Index], int]:
+        """Return the checkpointed FAISS index and how many rows it covers"""
+        if not self.index_checkpoint:
+            return None, 0
+        index = faiss.read_index(os.path.join(self.path, self.index_checkpoint))
+        return index, self.indexed_vectors
+
+    def checkpoint_index(self, index: faiss.Index):
+        """Persist the FAISS index; it must cover exactly the first `index.ntotal` rows"""
+        with self._lock:
+            name = self._reserve_name("index")
+        filename = f"{name}.faiss"
+        tmp_path = os.path.join(self.path, f"{filename}.tmp")
+        faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, os.path.join(self.path, filename))
+
+        with self._lock:
+            previous = self.index_checkpoint
+            self.index_checkpoint = filename
+            self.indexed_vectors = index.ntotal
+            self._pending.discard(name)
+            self._write_manifest()
+        if previous:
+            os.remove(os.path.join(self.path, previous))
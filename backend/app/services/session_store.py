@@ -0,0 +1,226 @@
+"""
+Chat session storage. A session document keeps a capped window of its most
+recent messages (`messages`, the last CHAT_RECENT_MESSAGES) with a title and
+message count, so reading it stays cheap however long the conversation gets
+and it never approaches the document size limit. Every message is also
+written to the `chat_messages` collection, one document each, which holds the
+full history and is read a page at a time.
+"""
+from app.config import settings
+from app.db.mongo import get_database
+from app.services.write_behind import chat_write_behind
+from bson import ObjectId
+from pymongo import InsertOne, UpdateOne, ReturnDocument
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional, Tuple
+import asyncio
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+MIGRATION_LEASE_SECONDS = 300  # a claim on a legacy session older than this is taken over
+MIGRATION_WAIT_SECONDS = 30  # longest an append waits for another worker to migrate its session
+
+
+class SessionStore:
+    _legacy_migrated = False  # set once no session is left in the pre-history format
+
+    @staticmethod
+    async def ensure_indexes():
+        db = await get_database()
+        await db.chat_sessions.create_index("session_id", unique=True)
+        await db.chat_sessions.create_index("updated_at")
+        await db.chat_messages.create_index([("session_id", 1), ("_id", -1)])
+
+    @staticmethod
+    async def migrate_legacy_sessions() -> int:
+        """
+        Move the full message arrays of sessions stored before the history
+        collection existed into it, leaving the recent window behind.
+        Duplicate documents of one session (left by the old read-then-insert
+        race, and blocking the unique index) are merged first. Each session
+        is claimed before it is moved, so several workers can run this at
+        once. Until it has completed, appends move their own session first.
+        """
+        db = await get_database()
+        await SessionStore._merge_duplicate_sessions(db)
+        migrated = 0
+        async for session in db.chat_sessions.find({"message_count": {"$exists": False}}, {"_id": 1}):
+            if await SessionStore._migrate_session(db, session["_id"]):
+                migrated += 1
+        if migrated:
+            logger.info(f"Moved the message history of {migrated} chat sessions to chat_messages")
+        if not await db.chat_sessions.find_one({"message_count": {"$exists": False}}, {"_id": 1}):
+            SessionStore._legacy_migrated = True
+        return migrated
+
+    @staticmethod
+    async def _merge_duplicate_sessions(db):
+        duplicates = db.chat_sessions.aggregate([
+            {"$match": {"message_count": {"$exists": False}}},
+            {"$group": {"_id": "$session_id", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}}
+        ])
+        async for group in duplicates:
+            sessions = await db.chat_sessions.find({"_id": {"$in": group["ids"]}}).sort("_id", 1).to_list(length=None)
+            messages = sorted(
+                (message for session in sessions for message in session.get("messages", [])),
+                key=lambda message: message.get("timestamp") or datetime.min
+            )
+            await db.chat_sessions.update_one(
+                {"_id": sessions[0]["_id"], "message_count": {"$exists": False}},
+                {"$set": {
+                    "messages": messages,
+                    "created_at": min(session.get("created_at") or datetime.utcnow() for session in sessions),
+                    "updated_at": max(session.get("updated_at") or datetime.min for session in sessions)
+                }}
+            )
+            await db.chat_sessions.delete_many({"_id": {"$in": [session["_id"] for session in sessions[1:]]}})
+            logger.info(f"Merged {len(sessions)} documents of chat session {group['_id']}")
+
+    @staticmethod
+    async def _migrate_session(db, document_id) -> bool:
+        """Move one legacy session's messages; False if it is migrated or claimed by another worker"""
+        now = datetime.utcnow()
+        session = await db.chat_sessions.find_one_and_update(
+            {
+                "_id": document_id,
+                "message_count": {"$exists": False},
+                "$or": [
+                    {"migrating_since": {"$exists": False}},
+                    {"migrating_since": {"$lt": now - timedelta(seconds=MIGRATION_LEASE_SECONDS)}}
+                ]
+            },
+            {"$set": {"migrating_since": now}},
+            return_document=ReturnDocument.AFTER
+        )
+        if session is None:
+            return False
+        session_id = session["session_id"]
+        messages = session.get("messages", [])
+        # Rows left by an interrupted earlier run are rewritten
+        await db.chat_messages.delete_many({"session_id": session_id})
+        if messages:
+            await db.chat_messages.insert_many([{"session_id": session_id, **message} for message in messages])
+        await db.chat_sessions.update_one(
+            {"_id": document_id},
+            {
+                "$set": {
+                    "messages": messages[-settings.CHAT_RECENT_MESSAGES:],
+                    "message_count": len(messages),
+                    "title": messages[0].get("content", "")[:50] if messages else ""
+                },
+                "$unset": {"migrating_since": ""}
+            }
+        )
+        return True
+
+    @staticmethod
+    async def _ensure_migrated(db, session_id: str):
+        """
+        Move a legacy session's history out before anything is appended
+        (which would trim it), waiting for another worker that is moving it
+        """
+        if SessionStore._legacy_migrated:
+            return
+        deadline = time.monotonic() + MIGRATION_WAIT_SECONDS
+        while True:
+            legacy = await db.chat_sessions.find_one({"session_id": session_id, "message_count": {"$exists": False}}, {"_id": 1})
+            if legacy is None:
+                return
+            if await SessionStore._migrate_session(db, legacy["_id"]):
+                continue  # a duplicate document of the session may be left
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Chat session {session_id} is still being migrated")
+            await asyncio.sleep(0.1)
+
+    @staticmethod
+    async def append_user_message(session_id: str, content: str, tail: int) -> List[Dict]:
+        """
+        Append a user message and return the session's last `tail` messages
+        (ending with it) in one atomic upsert, creating the session if needed.
+        The history row goes through the write-behind batcher.
+        """
+        db = await get_database()
+        await SessionStore._ensure_migrated(db, session_id)
+        # Queued writes for this session (the previous answer) must land first
+        await chat_write_behind.flush_session(session_id)
+        now = datetime.utcnow()
+        message = {"role": "user", "content": content, "timestamp": now}
+        session = await db.chat_sessions.find_one_and_update(
+            {"session_id": session_id},
+            {
+                "$push": {"messages": {"$each": [message], "$slice": -settings.CHAT_RECENT_MESSAGES}},
+                "$inc": {"message_count": 1},
+                "$set": {"updated_at": now},
+                "$setOnInsert": {"title": content[:50], "created_at": now}
+            },
+            projection={"_id": 0, "messages": {"$slice": -tail}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        await chat_write_behind.submit(session_id, [("chat_messages", SessionStore._history_row(session_id, message))])
+        return session.get("messages", [])
+
+    @staticmethod
+    async def append_message(session_id: str, role: str, content: str) -> Dict:
+        """Append a message (e.g. the assistant's answer) through the write-behind batcher"""
+        now = datetime.utcnow()
+        message = {"role": role, "content": content, "timestamp": now}
+        await chat_write_behind.submit(session_id, [
+            ("chat_sessions", UpdateOne(
+                {"session_id": session_id},
+                {
+                    "$push": {"messages": {"$each": [message], "$slice": -settings.CHAT_RECENT_MESSAGES}},
+                    "$inc": {"message_count": 1},
+                    "$set": {"updated_at": now}
+                }
+            )),
+            ("chat_messages", SessionStore._history_row(session_id, message))
+        ])
+        return message
+
+    @staticmethod
+    def _history_row(session_id: str, message: Dict) -> InsertOne:
+        # The id is assigned now, so history order is submission order however writes are batched
+        return InsertOne({"_id": ObjectId(), "session_id": session_id, **message})
+
+    @staticmethod
+    async def get_session(session_id: str) -> Optional[Dict]:
+        """Session summary (title, count, timestamps) without its messages"""
+        db = await get_database()
+        await chat_write_behind.flush_session(session_id)
+        return await db.chat_sessions.find_one({"session_id": session_id}, {"_id": 0, "messages": 0})
+
+    @staticmethod
+    async def history_page(session_id: str, before: Optional[str] = None,
+                           limit: Optional[int] = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Up to `limit` messages older than the `before` cursor (the newest
+        ones when None), oldest first, and the cursor for the page before
+        them (None once the start of the conversation is reached).
+        """
+        db = await get_database()
+        await chat_write_behind.flush_session(session_id)
+        limit = limit or settings.CHAT_HISTORY_PAGE_SIZE
+        query = {"session_id": session_id}
+        if before:
+            query["_id"] = {"$lt": ObjectId(before)}
+        # One extra row tells whether an older page exists
+        rows = await db.chat_messages.find(query, {"session_id": 0}).sort("_id", -1).limit(limit + 1).to_list(length=limit + 1)
+        next_before = str(rows[limit - 1]["_id"]) if len(rows) > limit else None
+        messages = []
+        for row in reversed(rows[:limit]):
+            row["id"] = str(row.pop("_id"))
+            messages.append(row)
+        return messages, next_before
+
+    @staticmethod
+    async def delete_session(session_id: str) -> bool:
+        db = await get_database()
+        await chat_write_behind.flush_session(session_id)
+        result = await db.chat_sessions.delete_one({"session_id": session_id})
+        await db.chat_messages.delete_many({"session_id": session_id})
+        return result.deleted_count > 0
@@ -0,0 +1,133 @@
+"""
+FAISS index construction and per-query tuning for the RAG vector store.
+"""
+import faiss
+import numpy as np
+from typing import Optional
+from app.config import settings
+
+INDEX_TYPES = ("flat", "fp16", "sq8", "ivf_flat", "ivf_sq8", "ivf_pq", "hnsw")
+TRAINED_INDEX_TYPES = ("sq8", "ivf_flat", "ivf_sq8", "ivf_pq")
+IVF_INDEX_TYPES = ("ivf_flat", "ivf_sq8", "ivf_pq")
+# Types whose stored codes only approximate the original vectors
+LOSSY_INDEX_TYPES = ("fp16", "sq8", "ivf_sq8", "ivf_pq")
+
+_SCALAR_QUANTIZERS = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "sq8": faiss.ScalarQuantizer.QT_8bit
+}
+
+
+def create_index(index_type: str, dimension: int) -> faiss.Index:
+    """Create an empty index of the given type"""
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dimension)
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, settings.RAG_HNSW_M)
+        index.hnsw.efConstruction = settings.RAG_HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = settings.RAG_HNSW_EF_SEARCH
+        return index
+
+    if index_type in _SCALAR_QUANTIZERS:
+        return faiss.IndexScalarQuantizer(dimension, _SCALAR_QUANTIZERS[index_type], faiss.METRIC_L2)
+
+    if index_type in IVF_INDEX_TYPES:
+        quantizer = faiss.IndexFlatL2(dimension)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dimension, settings.RAG_IVF_NLIST)
+        elif index_type == "ivf_sq8":
+            index = faiss.IndexIVFScalarQuantizer(
+                quantizer,
+                dimension,
+                settings.RAG_IVF_NLIST,
+                faiss.ScalarQuantizer.QT_8bit,
+                faiss.METRIC_L2
+            )
+        else:
+            index = faiss.IndexIVFPQ(
+                quantizer,
+                dimension,
+                settings.RAG_IVF_NLIST,
+                settings.RAG_PQ_M,
+                settings.RAG_PQ_NBITS
+            )
+        index.nprobe = settings.RAG_IVF_NPROBE
+        return index
+
+    raise ValueError(f"Unknown RAG index type: {index_type}")
+
+
+def index_type_of(index: faiss.Index) -> str:
+    """Return the configured type name of an existing index"""
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVFScalarQuantizer):
+        return "ivf_sq8"
+    if isinstance(index, faiss.IndexIVFFlat):
+        return "ivf_flat"
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "fp16" if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def training_threshold(index_type: str) -> int:
+    """Number of vectors required before an index of this type is built"""
+    if index_type not in TRAINED_INDEX_TYPES:
+        return 0
+    if index_type == "sq8":
+        # Enough samples for stable per-dimension value ranges
+        return settings.RAG_INDEX_TRAIN_MIN_VECTORS or 1000
+    if settings.RAG_INDEX_TRAIN_MIN_VECTORS > 0:
+        return max(settings.RAG_INDEX_TRAIN_MIN_VECTORS, settings.RAG_IVF_NLIST)
+    # FAISS warns below 39 training points per centroid
+    threshold = 39 * settings.RAG_IVF_NLIST
+    if index_type == "ivf_pq":
+        threshold = max(threshold, 2 ** settings.RAG_PQ_NBITS)
+    return threshold
+
+
+def build_index(index_type: str, dimension: int, vectors: np.ndarray) -> faiss.Index:
+    """Create, train (if needed) and fill an index from a vector matrix"""
+    index = create_index(index_type, dimension)
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    if not index.is_trained:
+        index.train(vectors)
+    if len(vectors):
+        index.add(vectors)
+    return index
+
+
+def reconstruct(index: faiss.Index, start: int, count: int) -> np.ndarray:
+    """Read back `count` stored vectors starting at `start`"""
+    if count <= 0:
+        return np.empty((0, index.d), dtype="float32")
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    return index.reconstruct_n(start, count)
+
+
+def search_params(
+    index: faiss.Index,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    selector: Optional[faiss.IDSelector] = None
+) -> Optional[faiss.SearchParameters]:
+    """
+    Per-query search parameters, so concurrent queries can use different settings.
+    `selector` restricts the search to a subset of ids inside FAISS.
+    The caller must keep `selector` alive until the search returns.
+    """
+    if isinstance(index, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF(nprobe=min(nprobe or settings.RAG_IVF_NPROBE, index.nlist))
+    elif isinstance(index, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(efSearch=ef_search or settings.RAG_HNSW_EF_SEARCH)
+    elif selector is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+    if selector is not None:
+        params.sel = selector
+    return params
@@ -0,0 +1,187 @@
+"""
+Write-behind batching for chat writes. Operations from many sessions are
+queued and applied together, one ordered `bulk_write` per collection, when
+the batch fills up or at the latest every CHAT_WRITE_BEHIND_MAX_DELAY_MS.
+
+Durability is set by CHAT_WRITE_BEHIND:
+- "off": every write is applied before the caller continues, unbatched;
+- "ack": writes are batched, but callers wait until their batch is
+  acknowledged with the configured write concern;
+- "async": callers continue immediately; writes still queued when the
+  process dies are lost (at most one delay window's worth).
+
+Writes for a session are applied in submission order, and `flush_session`
+lets a reader see a session's queued writes before reading it.
+"""
+import asyncio
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+from pymongo import WriteConcern
+from app.config import settings
+from app.db.mongo import get_database
+import logging
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND_MODES = ("off", "ack", "async")
+FLUSH_SESSION_TIMEOUT_SECONDS = 5.0  # longest a reader waits for a session's queued writes
+
+
+def _write_concern() -> WriteConcern:
+    w = settings.CHAT_WRITE_CONCERN
+    return WriteConcern(w=int(w) if w.isdigit() else w, j=settings.CHAT_WRITE_JOURNAL or None)
+
+
+class WriteBehindBatcher:
+    def __init__(self, mode: str, max_batch: int, max_delay_ms: float):
+        if mode not in WRITE_BEHIND_MODES:
+            raise ValueError(f"Unknown write-behind mode: {mode}. Expected one of {WRITE_BEHIND_MODES}")
+        self.mode = mode
+        self.max_batch = max(max_batch, 1)
+        self.max_delay = max_delay_ms / 1000
+        self._loop = None
+        self._pending: List[Tuple[str, object, str, asyncio.Future]] = []
+        self._queued: Dict[str, int] = defaultdict(int)  # session -> writes not yet applied
+        self._flush_lock = None
+        self._wake = None
+        self._task = None
+        self._batches = 0
+        self._writes = 0
+        self._failed = 0
+
+    def _bind(self):
+        """Lock, wake event and flusher task belong to the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._flush_lock = asyncio.Lock()
+            self._wake = asyncio.Event()
+            self._task = None
+            self._pending = []
+            self._queued.clear()
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+
+    async def submit(self, session_id: str, writes: List[Tuple[str, object]]):
+        """
+        Queue (collection, pymongo write operation) pairs for a session;
+        returns once they are applied unless the mode is "async"
+        """
+        if self.mode == "off":
+            db = await get_database()
+            for collection, operation in writes:
+                await db[collection].bulk_write([operation])
+            return
+
+        self._bind()
+        futures = []
+        for collection, operation in writes:
+            future = self._loop.create_future()
+            self._pending.append((collection, operation, session_id, future))
+            self._queued[session_id] += 1
+            futures.append(future)
+        if len(self._pending) >= self.max_batch:
+            self._wake.set()
+        if self.mode == "ack":
+            await asyncio.gather(*futures)
+
+    async def flush_session(self, session_id: str):
+        """
+        Apply any queued writes for the session (read-your-writes before
+        reading it), giving up after FLUSH_SESSION_TIMEOUT_SECONDS
+        """
+        deadline = time.monotonic() + FLUSH_SESSION_TIMEOUT_SECONDS
+        while self._queued.get(session_id):
+            try:
+                # Shielded: a flush the reader stops waiting for still completes
+                await asyncio.wait_for(asyncio.shield(self.flush()), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                logger.warning(f"Gave up waiting for queued writes of session {session_id}")
+                return
+
+    async def flush(self):
+        """Apply everything queued so far; batches are applied one at a time, in order"""
+        if self._flush_lock is None:
+            return
+        async with self._flush_lock:
+            batch, self._pending = self._pending, []
+            if not batch:
+                return
+            by_collection: Dict[str, list] = defaultdict(list)
+            for entry in batch:
+                by_collection[entry[0]].append(entry)
+
+            pending = list(by_collection.values())
+            try:
+                db = await get_database()
+                while pending:
+                    entries = pending[0]
+                    collection = entries[0][0]
+                    try:
+                        await db[collection].with_options(write_concern=_write_concern()).bulk_write(
+                            [operation for _, operation, _, _ in entries], ordered=True
+                        )
+                        error = None
+                    except Exception as e:
+                        logger.error(f"Write-behind flush of {len(entries)} writes to {collection} failed: {e}")
+                        error = e
+                    pending.pop(0)
+                    self._settle(entries, error)
+            finally:
+                # No database or cancelled mid-flush: the rest count as failed, so no session waits on them
+                for entries in pending:
+                    self._settle(entries, RuntimeError(f"Write-behind flush of {len(entries)} writes to {entries[0][0]} did not run"))
+            self._batches += 1
+            self._writes += len(batch)
+
+    def _settle(self, entries: List[Tuple[str, object, str, asyncio.Future]], error: Optional[Exception]):
+        """Release the queued counts of applied (or failed) writes and resolve their callers"""
+        if error is not None:
+            self._failed += len(entries)
+        for _, _, session_id, future in entries:
+            self._queued[session_id] -= 1
+            if self._queued[session_id] <= 0:
+                del self._queued[session_id]
+            if not future.done():
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+                    future.exception()  # retrieved here so "async" callers don't leave it unobserved
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind flush failed: {e}")
+
+    async def close(self):
+        """Apply queued writes and stop the flusher (on shutdown)"""
+        await self.flush()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def metrics(self) -> Dict:
+        return {
+            "mode": self.mode,
+            "queued": len(self._pending),
+            "batches": self._batches,
+            "writes": self._writes,
+            "failed_writes": self._failed,
+            "avg_batch_size": round(self._writes / self._batches, 2) if self._batches else 0.0
+        }
+
+
+chat_write_behind = WriteBehindBatcher(
+    settings.CHAT_WRITE_BEHIND,
+    settings.CHAT_WRITE_BEHIND_MAX_BATCH,
+    settings.CHAT_WRITE_BEHIND_MAX_DELAY_MS
+)
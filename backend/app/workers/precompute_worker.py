@@ -4,13 +4,9 @@ This can be run as a Celery task or as a standalone async worker.
 """
 from celery import Celery
 from app.config import settings
-from app.services.intent_predictor import intent_predictor
-from app.services.next_agent import next_agent
-from app.services.precompute_agent import precompute_agent
-from app.services.cache import CacheManager
-from app.db.mongo import get_database
+from app.services.precomputed_answers import precompute_prediction
+from app.services.llm_gateway import llm_gateway
 from datetime import datetime
-import uuid
 import logging
 
 logger = logging.getLogger(__name__)
@@ -39,57 +35,38 @@ def precompute_answer_task(session_id: str, predicted_question: str, confidence:
     import asyncio
     
     async def _precompute():
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(settings.MONGODB_URL)
+        db = client[settings.MONGODB_DB_NAME]
         try:
-            # Expand topics
-            topics = await next_agent.expand_topics(predicted_question)
+            # Topics, documents and answer, indexed by question for /chat to match
+            precomputed = await precompute_prediction(db, session_id, predicted_question, confidence)
+            if not precomputed:
+                return None
             
-            # Plan RAG documents
-            rag_docs = await next_agent.plan_rag_documents(predicted_question, topics)
+            prediction_doc = {
+                "session_id": session_id,
+                "predicted_question": predicted_question,
+                "confidence": confidence,
+                "likely_topics": precomputed["topics"],
+                "required_rag_docs": precomputed["rag_docs"],
+                "precomputed_answer": precomputed["answer"],
+                "precomputed_answer_id": precomputed["answer_id"],
+                "precomputed_answer_ids": [precomputed["answer_id"]],
+                "created_at": datetime.utcnow()
+            }
+            await db.predictions.insert_one(prediction_doc)
             
-            # Precompute answer
-            precomputed = await precompute_agent.precompute_answer(
-                predicted_question,
-                topics,
-                rag_docs
-            )
-            
-            if precomputed.get("ready_answer"):
-                precomputed_answer_id = f"pre_{uuid.uuid4().hex[:8]}"
-                
-                # Store in cache
-                await CacheManager.set_precomputed_answer(
-                    precomputed_answer_id,
-                    {
-                        "answer": precomputed["ready_answer"],
-                        "question": predicted_question,
-                        "context_used": precomputed["context_used"]
-                    }
-                )
-                
-                # Store in MongoDB
-                from motor.motor_asyncio import AsyncIOMotorClient
-                client = AsyncIOMotorClient(settings.MONGODB_URL)
-                db = client[settings.MONGODB_DB_NAME]
-                
-                prediction_doc = {
-                    "session_id": session_id,
-                    "predicted_question": predicted_question,
-                    "confidence": confidence,
-                    "likely_topics": topics,
-                    "required_rag_docs": rag_docs,
-                    "precomputed_answer": precomputed["ready_answer"],
-                    "precomputed_answer_id": precomputed_answer_id,
-                    "created_at": datetime.utcnow()
-                }
-                await db.predictions.insert_one(prediction_doc)
-                client.close()
-                
-                logger.info(f"Precomputed answer {precomputed_answer_id} for session {session_id}")
-                return precomputed_answer_id
+            logger.info(f"Precomputed answer {precomputed['answer_id']} for session {session_id}")
+            return precomputed["answer_id"]
             
         except Exception as e:
             logger.error(f"Error in precompute task: {e}")
             return None
+        finally:
+            client.close()
+            # The task's loop ends here; its LLM connection pool must not outlive it
+            await llm_gateway.close()
     
     # Run async function
     loop = asyncio.get_event_loop()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Parity and throughput report for the ONNX embedding backend against the
+torch SentenceTransformer path. Uses paragraphs from DOCUMENTS_PATH (or
+generated sentences when it is empty) and exports the ONNX models first
+if needed.
+
+Usage: python scripts/benchmark_embeddings.py [--texts 512] [--batch-size 32] [--k 5]
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.config import settings
+from app.services.onnx_embeddings import load_onnx_encoder
+
+
+def load_texts(count: int) -> list[str]:
+    """Paragraphs from the documents folder, or generated sentences"""
+    texts = []
+    for path in sorted(Path(settings.DOCUMENTS_PATH).glob("**/*")):
+        if path.suffix.lower() in (".md", ".txt"):
+            texts.extend(p.strip() for p in path.read_text(errors="ignore").split("\n\n") if len(p.strip()) > 20)
+    if len(texts) >= count:
+        print(f"Using {count} paragraphs from {settings.DOCUMENTS_PATH}")
+        return texts[:count]
+
+    print(f"Not enough documents, using {count} generated sentences")
+    rng = np.random.default_rng(0)
+    words = ("index vector query latency cache model token batch shard search recall memory "
+             "document chunk embedding quantized throughput answer session predict").split()
+    return [" ".join(rng.choice(words, size=rng.integers(5, 40))) for _ in range(count)]
+
+
+def timed(fn, *args) -> tuple:
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def neighbour_overlap(reference: np.ndarray, candidate: np.ndarray, k: int) -> float:
+    """Share of each text's top-k neighbours (by the reference vectors) that the candidate also finds"""
+    queries = min(len(reference), 100)
+
+    def top_k(vectors):
+        distances = ((vectors[:queries, np.newaxis] - vectors[np.newaxis]) ** 2).sum(axis=2)
+        return np.argsort(distances, axis=1)[:, 1:k + 1]
+
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(top_k(reference), top_k(candidate))]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=512)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--k", type=int, default=settings.RAG_TOP_K)
+    args = parser.parse_args()
+
+    texts = load_texts(args.texts)
+    queries = texts[:min(len(texts), 100)]
+
+    from sentence_transformers import SentenceTransformer
+    backends = {}
+    backends["torch"] = timed(SentenceTransformer, settings.EMBEDDING_MODEL)
+    backends["onnx"] = timed(load_onnx_encoder, settings.EMBEDDING_MODEL, False, settings.EMBEDDING_ONNX_THREADS)
+    backends["onnx-int8"] = timed(load_onnx_encoder, settings.EMBEDDING_MODEL, True, settings.EMBEDDING_ONNX_THREADS)
+
+    reference = None
+    print(f"\n{'backend':<11}{'load s':>8}{'texts/s':>10}{'query ms':>10}{'min cos':>10}{'mean cos':>10}"
+          f"{'top-' + str(args.k) + ' overlap':>16}")
+    for name, (model, load_seconds) in backends.items():
+        model.encode(texts[:args.batch_size])  # warm up
+        vectors, seconds = timed(lambda: model.encode(texts, batch_size=args.batch_size))
+        start = time.perf_counter()
+        for query in queries:
+            model.encode([query])
+        query_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if reference is None:
+            reference = vectors
+        cosine = (vectors * reference).sum(axis=1) / (
+            np.linalg.norm(vectors, axis=1) * np.linalg.norm(reference, axis=1)
+        )
+        print(f"{name:<11}{load_seconds:>8.2f}{len(texts) / seconds:>10.1f}{query_ms:>10.2f}"
+              f"{cosine.min():>10.4f}{cosine.mean():>10.4f}{neighbour_overlap(reference, vectors, args.k):>16.3f}")
+
+    print("\nCosine and overlap are measured against the torch vectors; load time includes a first-run export.")
+
+
+if __name__ == "__main__":
+    main()
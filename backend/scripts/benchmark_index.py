@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Recall/latency report for the vector index encodings.
+Builds every index type over the vectors in the vector store (or random
+vectors when the store is empty) and compares it against exact search.
+
+Usage: python scripts/benchmark_index.py [--types flat,sq8,ivf_pq] [--queries 200] [--k 5]
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.config import settings
+from app.services import vector_index
+from app.services.segment_store import SegmentStore
+
+DIMENSION = 384
+
+
+def load_vectors(count: int) -> np.ndarray:
+    """Vectors from the vector store, or random unit vectors if it is empty"""
+    store = SegmentStore(settings.VECTOR_STORE_PATH, DIMENSION)
+    if store.exists():
+        store.recover()
+        if store.total:
+            print(f"Using {store.total} vectors from {settings.VECTOR_STORE_PATH}")
+            return np.ascontiguousarray(store.read_vectors(0))
+
+    print(f"Vector store is empty, using {count} random vectors")
+    vectors = np.random.default_rng(0).standard_normal((count, DIMENSION)).astype("float32")
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def make_queries(vectors: np.ndarray, count: int) -> np.ndarray:
+    """Perturbed copies of stored vectors, so every query has real neighbours"""
+    rng = np.random.default_rng(1)
+    picks = vectors[rng.choice(len(vectors), size=min(count, len(vectors)), replace=False)]
+    noise = rng.standard_normal(picks.shape).astype("float32") * 0.05
+    return np.ascontiguousarray(picks + noise, dtype="float32")
+
+
+def exact_rerank(queries: np.ndarray, vectors: np.ndarray, indices: np.ndarray, k: int) -> np.ndarray:
+    """Re-order candidates by exact L2 distance, as the engine does from disk"""
+    reranked = np.full((len(queries), k), -1, dtype=np.int64)
+    for row, candidates in enumerate(indices):
+        candidates = candidates[candidates >= 0]
+        distances = ((vectors[candidates] - queries[row]) ** 2).sum(axis=1)
+        top = candidates[np.argsort(distances)[:k]]
+        reranked[row, :len(top)] = top
+    return reranked
+
+
+def recall(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f[f >= 0]) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--types", default=",".join(vector_index.INDEX_TYPES))
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=settings.RAG_TOP_K)
+    parser.add_argument("--vectors", type=int, default=20000, help="random vectors to use if the store is empty")
+    args = parser.parse_args()
+
+    vectors = load_vectors(args.vectors)
+    queries = make_queries(vectors, args.queries)
+    k = args.k
+    factor = max(settings.RAG_RERANK_FACTOR, 1)
+
+    truth = faiss.IndexFlatL2(DIMENSION)
+    truth.add(vectors)
+    _, expected = truth.search(queries, k)
+
+    print(f"\n{'index':<10}{'bytes/vec':>10}{'recall@' + str(k):>12}{'ms/query':>10}"
+          f"{'rerank recall':>15}{'rerank ms':>11}")
+    for index_type in args.types.split(","):
+        if len(vectors) < vector_index.training_threshold(index_type):
+            print(f"{index_type:<10} skipped: needs {vector_index.training_threshold(index_type)} vectors")
+            continue
+
+        index = vector_index.build_index(index_type, DIMENSION, vectors)
+        size = len(faiss.serialize_index(index)) / len(vectors)
+        params = vector_index.search_params(index)
+
+        start = time.perf_counter()
+        _, found = index.search(queries, k, params=params)
+        latency = (time.perf_counter() - start) * 1000 / len(queries)
+
+        start = time.perf_counter()
+        _, candidates = index.search(queries, k * factor, params=params)
+        reranked = exact_rerank(queries, vectors, candidates, k)
+        rerank_latency = (time.perf_counter() - start) * 1000 / len(queries)
+
+        print(f"{index_type:<10}{size:>10.0f}{recall(found, expected):>12.3f}{latency:>10.3f}"
+              f"{recall(reranked, expected):>15.3f}{rerank_latency:>11.3f}")
+
+    print(f"\nRe-rank fetches k * {factor} candidates (RAG_RERANK_FACTOR).")
+
+
+if __name__ == "__main__":
+    main()
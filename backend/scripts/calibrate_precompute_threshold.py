@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Pick PRECOMPUTE_MATCH_THRESHOLD for the configured embedding model from
+labelled question pairs: a predicted question, the question actually asked,
+and whether the precomputed answer to the first answers the second.
+
+Pairs are read from a JSONL file, one per line:
+    {"predicted": "How do I reset my password?", "asked": "how can I change my password", "match": true}
+
+The recommended threshold is the lowest cosine similarity at which served
+precomputed answers are still right at least --precision of the time, so
+it maximises hits for that precision.
+
+Usage: python scripts/calibrate_precompute_threshold.py pairs.jsonl [--precision 0.95]
+"""
+
+import sys
+import json
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.config import settings
+from app.services.embeddings import embedding_service
+from app.services.precomputed_answers import unit_rows
+
+
+def load_pairs(path: str):
+    pairs = []
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                pairs.append((row["predicted"], row["asked"], bool(row["match"])))
+    return pairs
+
+
+def precision_recall(scores: np.ndarray, labels: np.ndarray, threshold: float):
+    served = scores >= threshold
+    correct = int(np.sum(served & labels))
+    precision = correct / int(served.sum()) if served.any() else 1.0
+    recall = correct / int(labels.sum()) if labels.any() else 0.0
+    return precision, recall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pairs", help="JSONL file of labelled question pairs")
+    parser.add_argument("--precision", type=float, default=0.95,
+                        help="minimum share of served precomputed answers that must be right")
+    args = parser.parse_args()
+
+    pairs = load_pairs(args.pairs)
+    labels = np.array([match for _, _, match in pairs])
+    if not labels.any() or labels.all():
+        print("Need both matching and non-matching pairs to calibrate")
+        return
+
+    predicted = unit_rows(embedding_service.encode([p for p, _, _ in pairs]))
+    asked = unit_rows(embedding_service.encode([a for _, a, _ in pairs]))
+    scores = np.sum(predicted * asked, axis=1)
+    print(f"{len(pairs)} pairs ({int(labels.sum())} matching), model {settings.EMBEDDING_MODEL}")
+    print(f"  matching similarity:     median {np.median(scores[labels]):.3f}, min {scores[labels].min():.3f}")
+    print(f"  non-matching similarity: median {np.median(scores[~labels]):.3f}, max {scores[~labels].max():.3f}")
+
+    print(f"\n{'threshold':>9} {'precision':>9} {'recall':>7}")
+    for threshold in np.arange(0.5, 1.0, 0.05):
+        precision, recall = precision_recall(scores, labels, threshold)
+        print(f"{threshold:9.2f} {precision:9.3f} {recall:7.3f}")
+
+    recommended = None
+    for threshold in np.unique(scores):
+        precision, recall = precision_recall(scores, labels, threshold)
+        if precision >= args.precision:
+            recommended = (float(threshold), precision, recall)
+            break
+    if recommended is None:
+        print(f"\nNo threshold reaches precision {args.precision}")
+        return
+    threshold, precision, recall = recommended
+    print(f"\nLowest threshold with precision >= {args.precision}: {threshold:.3f} "
+          f"(precision {precision:.3f}, recall {recall:.3f}); currently {settings.PRECOMPUTE_MATCH_THRESHOLD}")
+    print(f"PRECOMPUTE_MATCH_THRESHOLD={threshold:.3f}")
+
+
+if __name__ == "__main__":
+    main()
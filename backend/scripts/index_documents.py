@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Bulk indexer for a directory tree of documents (.md, .txt, .pdf).
+
+Files are extracted and chunked on a pool of threads (PDF pages are parsed
+in worker processes) while the main thread embeds the chunks in batches that
+span files and appends them to the vector store. After each batch a
+checkpoint records the files fully committed so far. Files that are already
+indexed unchanged are skipped, so an interrupted run picks up where it
+stopped, and chunks whose text is unchanged reuse their stored vectors.
+Large files are read a batch of chunks at a time rather than all at once.
+
+Each document is indexed under its path relative to the root, replacing the
+chunks indexed under that name before.
+
+Usage: python scripts/index_documents.py [root] [--workers 4] [--batch-size 512] [--restart]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from collections import deque
+from itertools import chain, islice
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.config import settings
+from app.services.rag_engine import rag_engine
+from app.services.chunker import chunk_text
+from app.services.document_store import fsync_write
+from app.services.extraction import DocumentExtractor, is_supported
+from app.services.ingestion import file_hash, indexed_version, reusable_vectors, embed_chunks
+
+FILE_TYPES = {".md": "markdown", ".txt": "text", ".pdf": "pdf"}
+
+
+class Checkpoint:
+    """Documents committed by earlier runs (name -> file hash), rewritten after every batch"""
+
+    def __init__(self, path: str, restart: bool):
+        self.path = path
+        self.files: Dict[str, str] = {}
+        if os.path.exists(path) and not restart:
+            with open(path, "r") as f:
+                self.files = json.load(f)["files"]
+
+    def committed(self, name: str, content_hash: str) -> bool:
+        return self.files.get(name) == content_hash
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fsync_write(self.path, json.dumps({"files": self.files}).encode("utf-8"))
+
+
+def find_documents(root: str) -> List[str]:
+    """Supported files under `root`, skipping hidden directories such as the upload staging area"""
+    paths = []
+    for directory, subdirectories, filenames in os.walk(root):
+        subdirectories[:] = sorted(d for d in subdirectories if not d.startswith("."))
+        paths.extend(os.path.join(directory, filename) for filename in sorted(filenames) if is_supported(filename))
+    return paths
+
+
+class BulkIndexer:
+    def __init__(self, root: str, workers: int, batch_size: int, checkpoint: Checkpoint):
+        self.root = root
+        self.workers = max(workers, 1)
+        self.batch_size = max(batch_size, 1)
+        self.checkpoint = checkpoint
+        self.extractor = DocumentExtractor(self.workers)
+        self.stats = {"documents": 0, "skipped": 0, "failed": 0, "chunks": 0, "embedded": 0}
+        self._batch: List[tuple] = []  # (document, chunk index, text)
+        self._completed: List[Dict] = []  # documents whose last chunk is in the batch
+        self._started = time.perf_counter()
+
+    def prepare(self, path: str) -> Optional[Dict]:
+        """
+        Hash a file and extract its first batch of chunks (runs on the worker
+        threads); None if already indexed. The rest of the chunks are pulled
+        batch by batch as they are embedded.
+        """
+        name = Path(path).relative_to(self.root).as_posix()
+        content_hash = file_hash(path)
+        previous, unchanged = indexed_version(name, content_hash)
+        # The checkpoint only covers what the store cannot tell, e.g. files without any text
+        if unchanged or (not previous and self.checkpoint.committed(name, content_hash)):
+            return None
+        chunks = chunk_text(self.extractor.parts(path))
+        return {
+            "name": name,
+            "hash": content_hash,
+            "metadata": {"name": name, "type": FILE_TYPES[Path(path).suffix.lower()]},
+            "previous": previous,
+            "head": list(islice(chunks, self.batch_size)),
+            "chunks": chunks
+        }
+
+    def run(self):
+        paths = find_documents(self.root)
+        print(f"Found {len(paths)} document(s) under {self.root}")
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="indexer") as pool:
+            # Extraction runs a bounded number of files ahead of embedding
+            in_flight = deque()
+            for path in paths:
+                in_flight.append((path, pool.submit(self.prepare, path)))
+                if len(in_flight) >= 2 * self.workers:
+                    self._add(*in_flight.popleft())
+            while in_flight:
+                self._add(*in_flight.popleft())
+        self._flush()
+        self._report(final=True)
+
+    def _add(self, path: str, future):
+        try:
+            document = future.result()
+        except Exception as e:
+            print(f"✗ {path}: {e}")
+            self.stats["failed"] += 1
+            return
+        if document is None:
+            self.stats["skipped"] += 1
+            return
+        chunks = chain(document.pop("head"), document.pop("chunks"))
+        count = 0
+        while True:
+            try:
+                text = next(chunks)
+            except StopIteration:
+                break
+            except Exception as e:
+                # Extraction failed part way: drop what was read of this file so far
+                self._batch = [entry for entry in self._batch if entry[0] is not document]
+                if document.get("added"):
+                    rag_engine.discard_staged(document["added"])
+                print(f"✗ {path}: {e}")
+                self.stats["failed"] += 1
+                return
+            # Flushed before appending, so the last chunk is always in a later flush
+            if len(self._batch) >= self.batch_size:
+                self._flush()
+            self._batch.append((document, count, text))
+            count += 1
+        document["chunk_count"] = count
+        self._completed.append(document)
+
+    def _flush(self):
+        """
+        Embed and stage the batch, then publish finished documents in place of
+        their previous versions and checkpoint them
+        """
+        if self._batch:
+            reusable = {}
+            for document in {id(document): document for document, _, _ in self._batch}.values():
+                reusable.update(reusable_vectors(document["previous"]))
+            vectors, hashes, embedded = embed_chunks([text for _, _, text in self._batch], reusable)
+            documents = []
+            for n, (document, i, text) in enumerate(self._batch):
+                metadata = {**document["metadata"], "chunk_index": i, "file_hash": document["hash"], "chunk_hash": hashes[n]}
+                if i == document.get("chunk_count", 0) - 1:
+                    metadata["chunk_count"] = document["chunk_count"]  # the file is complete once this chunk is in
+                documents.append({"text": text, "metadata": metadata})
+            ids = rag_engine.add_embeddings(vectors, documents, staged=True)
+            for (document, _, _), chunk_id in zip(self._batch, ids):
+                document.setdefault("added", []).append(chunk_id)
+            self.stats["chunks"] += len(self._batch)
+            self.stats["embedded"] += embedded
+            self._batch = []
+
+        if self._completed:
+            published = 0
+            for document in self._completed:
+                if not document.get("added") and document["previous"]:
+                    print(f"✗ {document['name']}: no text could be extracted, kept the indexed version")
+                    self.stats["failed"] += 1
+                    continue
+                rag_engine.publish_chunks(document.get("added", []), [chunk["chunk_id"] for chunk in document["previous"]])
+                self.checkpoint.files[document["name"]] = document["hash"]
+                published += 1
+            self.stats["documents"] += published
+            self._completed = []
+            self.checkpoint.save()
+            self._report()
+
+    def _report(self, final: bool = False):
+        elapsed = max(time.perf_counter() - self._started, 1e-9)
+        stats = self.stats
+        print(f"{'✓ Done:' if final else '  checkpoint:'} {stats['documents']} docs ({stats['documents'] / elapsed:.1f} docs/s), "
+              f"{stats['chunks']} chunks ({stats['chunks'] / elapsed:.1f} chunks/s), "
+              f"{stats['embedded']} embedded, {stats['chunks'] - stats['embedded']} reused, "
+              f"{stats['skipped']} unchanged, {stats['failed']} failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root", nargs="?", default=settings.DOCUMENTS_PATH)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="files extracted in parallel (and PDF worker processes)")
+    parser.add_argument("--batch-size", type=int, default=settings.RAG_INGEST_BATCH_CHUNKS,
+                        help="chunks embedded and committed per batch")
+    parser.add_argument("--checkpoint", default=os.path.join(settings.VECTOR_STORE_PATH, "bulk_indexer_checkpoint.json"))
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint of an earlier run")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.root):
+        print(f"Documents directory not found: {args.root}")
+        return
+
+    indexer = BulkIndexer(args.root, args.workers, args.batch_size, Checkpoint(args.checkpoint, args.restart))
+    try:
+        indexer.run()
+    except KeyboardInterrupt:
+        print("\nInterrupted; run again to resume from the last checkpoint")
+        sys.exit(1)
+    print(f"✓ Vector store now contains {rag_engine.document_count} vectors")
+
+
+if __name__ == "__main__":
+    main()
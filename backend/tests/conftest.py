@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+# Settings are read at import time; point storage at a scratch directory before any app module loads
+_scratch = tempfile.mkdtemp(prefix="nextmind-tests-")
+os.environ.setdefault("VECTOR_STORE_PATH", os.path.join(_scratch, "vector_store"))
+os.environ.setdefault("DOCUMENTS_PATH", os.path.join(_scratch, "documents"))
+os.environ.setdefault("EMBEDDING_CACHE_BACKEND", "none")
@@ -0,0 +1,41 @@
+import asyncio
+import threading
+
+import numpy as np
+
+from app.services.embedding_batcher import EmbeddingBatcher
+
+
+def test_cancelled_waiter_does_not_stop_the_batcher():
+    release = threading.Event()
+
+    def encode(texts):
+        release.wait(5)
+        return np.ones((len(texts), 4), dtype=np.float32)
+
+    batcher = EmbeddingBatcher(encode, max_batch_size=8, max_wait_ms=1)
+
+    async def cancel_while_queued():
+        # The first query occupies the thread so the second is still queued when cancelled
+        first = batcher.submit("first")
+        waiter = asyncio.ensure_future(asyncio.wrap_future(batcher.submit("cancelled")))
+        await asyncio.sleep(0.05)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.wrap_future(first)
+
+    asyncio.run(cancel_while_queued())
+
+    later = batcher.submit("later")
+    assert later.result(timeout=5).shape == (4,)
+    assert batcher._thread.is_alive()
+
+
+def test_thread_restarts_after_it_dies():
+    batcher = EmbeddingBatcher(lambda texts: np.zeros((len(texts), 2), dtype=np.float32), 4, 1)
+    batcher.submit("a").result(timeout=5)
+    batcher._thread = threading.Thread(target=lambda: None)
+    batcher._thread.start()
+    batcher._thread.join()
+    assert batcher.submit("b").result(timeout=5).shape == (2,)
@@ -0,0 +1,19 @@
+import numpy as np
+
+from app.services.embedding_cache import MmapEmbeddingStore
+
+DIMENSION = 4
+
+
+def test_mmap_store_is_rebuilt_when_the_slot_count_changes(tmp_path):
+    path = str(tmp_path / "cache")
+    key, vector = b"k" * 16, np.ones(DIMENSION, dtype=np.float32).tobytes()
+    MmapEmbeddingStore(path, DIMENSION, 8).put_many({key: vector})
+    assert MmapEmbeddingStore(path, DIMENSION, 8).get_many([key]) == [vector]
+
+    resized = MmapEmbeddingStore(path, DIMENSION, 16)
+
+    assert resized.get_many([key]) == [None]
+    assert (tmp_path / "cache.keys").stat().st_size == 16 * 16
+    resized.put_many({key: vector})
+    assert MmapEmbeddingStore(path, DIMENSION, 16).get_many([key]) == [vector]
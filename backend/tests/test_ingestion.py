@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+
+from app.services import ingestion
+from app.services.rag_engine import rag_engine
+
+
+class FakeEmbeddings:
+    def __init__(self):
+        self.embedded = 0
+
+    def encode_bulk(self, texts):
+        self.embedded += len(texts)
+        return np.stack([np.full(rag_engine.dimension, len(text), dtype=np.float32) for text in texts])
+
+
+@pytest.fixture
+def document(tmp_path, monkeypatch):
+    embeddings = FakeEmbeddings()
+    monkeypatch.setattr(ingestion, "embedding_service", lambda: embeddings)
+    monkeypatch.setattr(ingestion, "chunk_text", lambda parts: (p for part in parts for p in part.split("\n\n") if p))
+    monkeypatch.setattr(ingestion.settings, "RAG_INGEST_BATCH_CHUNKS", 2)
+    path = tmp_path / "partial.md"
+    path.write_text("\n\n".join(f"paragraph {i} " + "x" * i for i in range(10)))
+    yield str(path), embeddings
+    rag_engine.delete_document("partial.md")
+
+
+def test_interrupted_ingest_is_not_treated_as_unchanged(document, monkeypatch):
+    path, embeddings = document
+    add_embeddings = rag_engine.add_embeddings
+    calls = []
+
+    def killed_after_first_batch(vectors, documents, **kwargs):
+        if calls:
+            # Not an Exception: like a killed process, the cleanup path does not run
+            raise KeyboardInterrupt
+        calls.append(len(documents))
+        return add_embeddings(vectors, documents, **kwargs)
+
+    monkeypatch.setattr(rag_engine, "add_embeddings", killed_after_first_batch)
+    with pytest.raises(KeyboardInterrupt):
+        ingestion.ingest_file(path, "partial.md", {"name": "partial.md"})
+    monkeypatch.setattr(rag_engine, "add_embeddings", add_embeddings)
+    # The batch that made it in was staged and never published
+    assert rag_engine.get_chunks_by_metadata("name", ["partial.md"]) == []
+
+    result = ingestion.ingest_file(path, "partial.md", {"name": "partial.md"})
+    assert not result["unchanged"]
+    assert result["chunks"] == 10
+    assert len(rag_engine.get_chunks_by_metadata("name", ["partial.md"])) == 10
+
+    again = ingestion.ingest_file(path, "partial.md", {"name": "partial.md"})
+    assert again["unchanged"]
+
+
+def test_replacement_is_published_in_one_swap(document, monkeypatch):
+    path, _ = document
+    ingestion.ingest_file(path, "partial.md", {"name": "partial.md"})
+    first = ingestion.file_hash(path)
+    with open(path, "a") as f:
+        f.write("\n\nappended paragraph")
+    add_embeddings = rag_engine.add_embeddings
+    visible = []
+
+    def add_and_look(vectors, documents, **kwargs):
+        ids = add_embeddings(vectors, documents, **kwargs)
+        visible.append({chunk["metadata"]["file_hash"] for chunk in rag_engine.get_chunks_by_metadata("name", ["partial.md"])})
+        return ids
+
+    monkeypatch.setattr(rag_engine, "add_embeddings", add_and_look)
+    result = ingestion.ingest_file(path, "partial.md", {"name": "partial.md"})
+
+    assert len(visible) > 1 and all(hashes == {first} for hashes in visible)
+    chunks = rag_engine.get_chunks_by_metadata("name", ["partial.md"])
+    assert result["replaced_chunks"] == 10
+    assert len(chunks) == 11 and {chunk["metadata"]["file_hash"] for chunk in chunks} == {ingestion.file_hash(path)}
+
+
+def test_file_without_text_keeps_the_indexed_version(document, tmp_path):
+    path, _ = document
+    ingestion.ingest_file(path, "partial.md", {"name": "partial.md"})
+    empty = tmp_path / "empty.md"
+    empty.write_text("")
+
+    with pytest.raises(ValueError):
+        ingestion.ingest_file(str(empty), "partial.md", {"name": "partial.md"})
+
+    assert len(rag_engine.get_chunks_by_metadata("name", ["partial.md"])) == 10
+
+
+def test_delete_waits_for_a_running_job_of_the_same_name(document, monkeypatch):
+    import asyncio
+    import os
+    import threading
+    from app.config import settings
+
+    path, _ = document
+    os.makedirs(settings.DOCUMENTS_PATH, exist_ok=True)
+    manager = ingestion.IngestionJobManager(concurrency=1, history=10)
+    add_embeddings = rag_engine.add_embeddings
+    staging = threading.Event()
+    release = threading.Event()
+
+    def slow_add(vectors, documents, **kwargs):
+        staging.set()
+        release.wait(5)
+        return add_embeddings(vectors, documents, **kwargs)
+
+    monkeypatch.setattr(rag_engine, "add_embeddings", slow_add)
+    job = manager.submit(path, "partial.md", {"name": "partial.md"})
+    assert staging.wait(5)
+
+    async def delete_mid_job():
+        deleting = asyncio.ensure_future(manager.delete("partial.md"))
+        await asyncio.sleep(0.1)
+        assert not deleting.done()
+        release.set()
+        return await deleting
+
+    assert asyncio.run(delete_mid_job()) == 10
+    assert manager.get(job.id)["status"] == "completed"
+    assert rag_engine.get_chunks_by_metadata("name", ["partial.md"]) == []
@@ -0,0 +1,23 @@
+import asyncio
+
+from app.config import settings
+from app.services.llm_gateway import LLMGateway
+
+
+def test_client_of_a_finished_loop_is_closed(monkeypatch):
+    monkeypatch.setattr(settings, "OPENAI_API_KEY", "sk-test")
+    gateway = LLMGateway()
+    clients = []
+
+    async def task(close: bool):
+        gateway._bind()
+        clients.append(gateway._client)
+        await asyncio.sleep(0.01)
+        if close:
+            await gateway.close()
+
+    # Like a worker running each task on its own loop
+    asyncio.run(task(close=False))
+    asyncio.run(task(close=True))
+
+    assert len(clients) == 2 and all(client.is_closed() for client in clients)
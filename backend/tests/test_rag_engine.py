@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from app.config import settings
+from app.services.rag_engine import RAGEngine
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "VECTOR_STORE_PATH", str(tmp_path))
+    engine = RAGEngine()
+    # Compactions are driven by the tests
+    monkeypatch.setattr(engine, "_maybe_schedule_compaction", lambda: None)
+    return engine
+
+
+def add(engine, name, count):
+    vectors = np.random.rand(count, engine.dimension).astype("float32")
+    documents = [{"text": f"{name} chunk {i}", "metadata": {"name": name}} for i in range(count)]
+    return engine.add_embeddings(vectors, documents)
+
+
+def test_purge_keeps_writes_made_while_its_indexes_were_built(engine, monkeypatch):
+    for name in ("a", "b", "c"):
+        add(engine, name, 4)
+    engine.delete_document("a")
+    engine.search_lexical(["chunk"], 1)  # the purge rebuilds a BM25 index only once one exists
+    build_lexical_index = engine._build_lexical_index
+
+    def build_while_writing(view, deleted):
+        # Runs without the writer lock: these land between the build and the swap
+        add(engine, "d", 3)
+        engine.delete_document("b")
+        return build_lexical_index(view, deleted)
+
+    monkeypatch.setattr(engine, "_build_lexical_index", build_while_writing)
+    monkeypatch.setattr(settings, "RAG_TOMBSTONE_COMPACT_RATIO", 0.0)
+    engine._compact()
+
+    assert engine.store.total == 11  # only "a" was purged
+    assert sorted(engine.list_document_names()) == ["c", "d"]
+    assert len(engine.get_chunks_by_metadata("name", ["d"])) == 3
+    assert engine.search_lexical(["chunk"], 20)[0] and all(
+        result["metadata"]["name"] in ("c", "d") for result in engine.search_lexical(["chunk"], 20)[0]
+    )
+
+
+def test_bm25_index_is_built_on_first_lexical_search(engine):
+    add(engine, "a", 2)
+    assert engine.snapshot().lexical_index is None
+    engine.delete_document("a")
+    add(engine, "b", 2)
+
+    results = engine.search("b chunk", k=5, mode="lexical")
+
+    assert engine.snapshot().lexical_index is not None
+    assert [result["metadata"]["name"] for result in results] == ["b", "b"]
@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+
+from app.services.segment_store import SegmentStore
+
+DIMENSION = 4
+
+
+def append(store, count):
+    vectors = np.random.rand(count, DIMENSION).astype("float32")
+    documents = [{"text": f"chunk {i}", "metadata": {"name": "doc"}} for i in range(count)]
+    return store.append(vectors, documents)
+
+
+def open_store(path):
+    store = SegmentStore(str(path), DIMENSION)
+    store.recover()
+    return store
+
+
+def test_merges_only_a_run_of_similar_sized_segments(tmp_path):
+    store = open_store(tmp_path)
+    append(store, 40)
+    for _ in range(4):
+        append(store, 2)
+    large = store.segments[0]["name"]
+    before = store.view.ids.copy()
+
+    assert store.merge_run(4) == (1, 5)
+    plan = store.prepare_compaction(4, purge=False)
+    assert [merge["segments"] for merge in plan["merges"]] == [[segment["name"] for segment in store.segments[1:]]]
+    store.commit_compaction(plan)
+
+    assert [segment["count"] for segment in store.segments] == [40, 8]
+    assert store.segments[0]["name"] == large
+    assert np.array_equal(store.view.ids, before)
+    # The merge of a non-leading run is replayed from the log
+    assert [segment["count"] for segment in open_store(tmp_path).segments] == [40, 8]
+
+
+def test_purge_rewrites_only_segments_with_tombstones(tmp_path):
+    store = open_store(tmp_path)
+    first = append(store, 10)
+    append(store, 30)
+    store.delete(first[:3].tolist())
+
+    plan = store.prepare_compaction(4, purge=True)
+    assert [merge["segments"] for merge in plan["merges"]] == [[store.segments[0]["name"]]]
+    assert sorted(plan["purged"]) == first[:3].tolist()
+    assert store.compaction_view(plan).total == 37
+    store.commit_compaction(plan)
+
+    assert store.total == 37 and not store.tombstones
+
+
+def test_abort_removes_staged_files(tmp_path):
+    store = open_store(tmp_path)
+    for _ in range(2):
+        append(store, 2)
+    plan = store.prepare_compaction(2, purge=False)
+    staged = plan["merges"][0]["name"]
+    assert any(name.startswith(staged) for name in os.listdir(store.segments_path))
+
+    store.abort_compaction(plan)
+
+    assert not any(name.startswith(staged) for name in os.listdir(store.segments_path))
+    assert len(store.segments) == 2
+
+
+def test_staged_chunks_stay_hidden_until_published_and_survive_purge(tmp_path):
+    store = open_store(tmp_path)
+    old = append(store, 4)
+    vectors = np.random.rand(3, DIMENSION).astype("float32")
+    staged = store.append(vectors, [{"text": "new", "metadata": {}}] * 3, staged=True)
+    assert set(staged.tolist()) <= store.tombstones
+
+    plan = store.prepare_compaction(4, purge=True)
+    assert plan is None  # staged rows are not garbage
+
+    # A crash before publishing leaves them deleted
+    assert set(staged.tolist()) <= open_store(tmp_path).tombstones
+
+    assert store.publish(staged.tolist(), old.tolist()) == old.tolist()
+    recovered = open_store(tmp_path)
+    assert recovered.tombstones == set(old.tolist())
+    assert recovered.live_total == 3
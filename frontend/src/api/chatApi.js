@@ -19,6 +19,43 @@ export const chatApi = {
     return response.data
   },
   
+  // Streams the answer over Server-Sent Events: onToken gets each piece of
+  // text as it is generated, and the final `done` event is returned
+  streamMessage: async (sessionId, message, onToken, usePrecomputed = true) => {
+    const response = await fetch(`${API_BASE_URL}/chat/stream`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({
+        session_id: sessionId,
+        message,
+        use_precomputed: usePrecomputed,
+      }),
+    })
+    if (!response.ok) {
+      throw new Error(`Chat request failed with status ${response.status}`)
+    }
+    
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+    while (true) {
+      const { done, value } = await reader.read()
+      if (done) break
+      buffer += decoder.decode(value, { stream: true })
+      const events = buffer.split('\n\n')
+      buffer = events.pop()
+      for (const raw of events) {
+        const data = raw.split('\n').find((line) => line.startsWith('data: '))
+        if (!data) continue
+        const event = JSON.parse(data.slice(6))
+        if (event.type === 'token') onToken(event.content)
+        else if (event.type === 'done') return event
+        else if (event.type === 'error') throw new Error(event.message)
+      }
+    }
+    throw new Error('Chat stream ended before the answer was complete')
+  },
+  
   getSession: async (sessionId) => {
     const response = await api.get(`/chat/session/${sessionId}`)
     return response.data
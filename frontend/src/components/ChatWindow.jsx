@@ -14,6 +14,7 @@ function ChatWindow({ sessionId: initialSessionId }) {
     suggestions,
     isLoading,
     addMessage,
+    updateLastMessage,
     setCurrentInput,
     setSuggestions,
     setIsLoading,
@@ -118,6 +119,30 @@ function ChatWindow({ sessionId: initialSessionId }) {
     }
   }
   
+  // Streams the answer into an assistant message that grows as tokens arrive
+  const streamAnswer = async (text) => {
+    let answer = ''
+    const result = await chatApi.streamMessage(currentSessionId, text, (token) => {
+      if (!answer) {
+        addMessage({ role: 'assistant', content: '', timestamp: new Date().toISOString() })
+      }
+      answer += token
+      updateLastMessage(answer)
+    })
+    
+    const assistantMessage = {
+      role: 'assistant',
+      content: result.response,
+      timestamp: new Date().toISOString(),
+    }
+    if (answer) {
+      updateLastMessage(result.response)
+    } else {
+      addMessage(assistantMessage)
+    }
+    return assistantMessage
+  }
+  
   const handleSendMessage = async () => {
     if (!currentInput.trim() || isLoading) return
     
@@ -153,15 +178,7 @@ function ChatWindow({ sessionId: initialSessionId }) {
     }
     
     try {
-      const response = await chatApi.sendMessage(currentSessionId, currentInput.trim())
-      
-      const assistantMessage = {
-        role: 'assistant',
-        content: response.response,
-        timestamp: new Date().toISOString(),
-      }
-      
-      addMessage(assistantMessage)
+      const assistantMessage = await streamAnswer(currentInput.trim())
       
       // Trigger prediction for next question
       if (messages.length >= 0) {
@@ -272,18 +289,9 @@ function ChatWindow({ sessionId: initialSessionId }) {
     
     try {
       console.log('📤 Sending to API:', suggestionText)
-      const response = await chatApi.sendMessage(currentSessionId, suggestionText)
-      
-      console.log('✅ API response received:', response)
+      const assistantMessage = await streamAnswer(suggestionText)
       
-      const assistantMessage = {
-        role: 'assistant',
-        content: response.response || response.message || 'No response received',
-        timestamp: new Date().toISOString(),
-      }
-      
-      // Add assistant message to store
-      addMessage(assistantMessage)
+      console.log('✅ API response received:', assistantMessage.content)
       
       // Trigger prediction for next question
       const updatedMessages = [...messages, userMessage, assistantMessage]
@@ -418,7 +426,8 @@ function ChatWindow({ sessionId: initialSessionId }) {
             )
           })}
           
-          {isLoading && (
+          {/* Typing indicator until the first streamed token arrives */}
+          {isLoading && messages[messages.length - 1]?.role !== 'assistant' && (
             <div className="flex justify-start mb-6">
               <div className="flex items-start space-x-3 max-w-[85%]">
                 <div className="flex-shrink-0 w-8 h-8 rounded-full bg-gray-200 dark:bg-gray-700 flex items-center justify-center">
@@ -37,6 +37,13 @@ const useChatStore = create((set, get) => ({
     }
   },
   
+  // Replace the content of the last message (an answer being streamed in)
+  updateLastMessage: (content) => {
+    const messages = get().messages
+    if (messages.length === 0) return
+    set({ messages: [...messages.slice(0, -1), { ...messages[messages.length - 1], content }] })
+  },
+  
   setMessages: (messages) => {
     set({ messages })
     // Update session title from first message
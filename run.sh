@@ -35,7 +35,7 @@ echo "   Backend:   http://localhost:8000"
 echo "   API Docs:  http://localhost:8000/docs"
 echo ""
 echo "📚 To initialize RAG with sample documents:"
-echo "   docker-compose exec backend python scripts/init_rag.py"
+echo "   docker-compose exec backend python scripts/index_documents.py"
 echo ""
 echo "📋 To view logs:"
 echo "   docker-compose logs -f"